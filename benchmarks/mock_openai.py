@@ -0,0 +1,392 @@
+import argparse
+import json
+import math
+import random
+import re
+import threading
+import time
+import zlib
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+# OpenAI-compatible stand-in for offline benchmarks.
+# Serves POST /v1/chat/completions (plain and streamed) with tag-formatted
+# responses shaped like a real model's for each of the pipeline's five
+# prompt types: S1 scenarios, S2 functions, S3 simple / parallel /
+# multi-turn queries. Packed prompts (<item id="N"> blocks) are answered
+# per item inside <result id="N">. Responses are deterministic per prompt
+# and seed, so runs are comparable.
+#
+# Latency is drawn per request from a fixed, uniform or lognormal
+# distribution plus a per-token generation delay; a share of requests can
+# be answered with 429 or 5xx (with retry-after-ms) to exercise retries.
+#
+#   python -m benchmarks.mock_openai --port 8765 --latency lognormal --latency-ms 300
+#   OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=x python run_s1_openai.py
+
+_WORDS = (
+    "invoice order customer ticket shipment booking calendar meeting report budget "
+    "account payment vendor sensor device playlist recipe workout route forecast "
+    "patient appointment course student inventory warehouse contract lead campaign"
+).split()
+_TYPES = (("int", "42"), ("str", '"confirmed"'), ("float", "3.5"), ("bool", "true"), ("list", '["a", "b"]'))
+_DEF_RE = re.compile(r"def\s+([A-Za-z_]\w*)\s*\(([^)]*)\)")
+_ITEM_RE = re.compile(r'<item id="([\w-]+)">\n(.*?)\n</item>', re.DOTALL)
+
+
+@dataclass
+class MockConfig:
+    latency: str = "lognormal"  # fixed | uniform | lognormal
+    latency_ms: float = 200.0  # fixed value, uniform upper bound or lognormal median
+    latency_sigma: float = 0.5
+    tokens_per_s: float = 0.0  # completion speed; 0 = no per-token delay
+    error_429: float = 0.0
+    error_5xx: float = 0.0
+    retry_after_ms: int = 50
+    scenarios: int = 3
+    functions: int = 3
+    queries: int = 2
+    turns: int = 3
+    seed: int = 0
+
+
+@dataclass
+class MockStats:
+    requests: int = 0
+    ok: int = 0
+    rate_limited: int = 0
+    server_errors: int = 0
+    by_kind: Dict[str, int] = field(default_factory=dict)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def count(self, attr: str, kind: Optional[str] = None) -> None:
+        with self._lock:
+            setattr(self, attr, getattr(self, attr) + 1)
+            if kind is not None:
+                self.by_kind[kind] = self.by_kind.get(kind, 0) + 1
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "ok": self.ok,
+                "rate_limited": self.rate_limited,
+                "server_errors": self.server_errors,
+                "by_kind": dict(self.by_kind),
+            }
+
+
+def prompt_kind(system: str, prompt: str) -> str:
+    """Which pipeline prompt a request is (by the runners' system prompts)."""
+    if "<dialogue>" in system or "<dialogue>" in prompt:
+        return "multi_turn"
+    if "<function_calls>" in system:
+        return "parallel"
+    if "<user_query>" in system:
+        return "simple"
+    if "<function>" in system or "<signature>" in prompt:
+        return "functions"
+    return "scenarios"
+
+
+def _word(rng: random.Random) -> str:
+    return rng.choice(_WORDS)
+
+
+def _call(rng: random.Random, name: str, params: str) -> str:
+    args = []
+    for p in params.split(","):
+        pname, _, ptype = p.partition(":")
+        pname = pname.strip()
+        if not pname or pname == "self":
+            continue
+        ptype = ptype.split("=")[0].strip()
+        value = {"int": str(rng.randint(1, 99)), "float": "2.5", "bool": "True"}.get(
+            ptype, repr(_word(rng))
+        )
+        args.append(f"{pname}={value}")
+    return f"{name}({', '.join(args)})"
+
+
+def _functions_in(text: str) -> List[Tuple[str, str]]:
+    return _DEF_RE.findall(text) or [("lookup_record", "record_id: str")]
+
+
+def _scenarios(rng: random.Random, cfg: MockConfig, _: str) -> str:
+    out = ["Here are the scenarios:\n"]
+    for _i in range(cfg.scenarios):
+        a, b = _word(rng), _word(rng)
+        out.append(
+            f"<scenario>\nA user managing their {a} records needs to look up a {b}, "
+            f"update its status and notify the responsible team once the {a} is processed.\n</scenario>"
+        )
+    return "\n".join(out)
+
+
+def _functions(rng: random.Random, cfg: MockConfig, _: str) -> str:
+    out = []
+    for _i in range(cfg.functions):
+        a, b = _word(rng), _word(rng)
+        rtype, expected = rng.choice(_TYPES)
+        out.append(
+            "<function>\n<signature>\n```python\n"
+            f"def get_{a}_{b}_{rng.randint(0, 999)}({a}_id: str, limit: int = 10) -> {rtype}:\n"
+            f'    """Fetch the {b} for a {a}.\n\n    Args:\n        {a}_id: Identifier of the {a}.\n'
+            f'        limit: Maximum number of results.\n    """\n'
+            "```\n</signature>\n"
+            f"<expected>\n{expected}\n</expected>\n</function>"
+        )
+    return "\n".join(out)
+
+
+def _simple(rng: random.Random, cfg: MockConfig, prompt: str) -> str:
+    name, params = _functions_in(prompt)[0]
+    return "\n".join(
+        f"<user_query>\nCan you check the {_word(rng)} for me?\n</user_query>\n"
+        f"<function_call>\n{_call(rng, name, params)}\n</function_call>"
+        for _i in range(cfg.queries)
+    )
+
+
+def _parallel(rng: random.Random, cfg: MockConfig, prompt: str) -> str:
+    name, params = _functions_in(prompt)[0]
+    return "\n".join(
+        f"<user_query>\nCheck the {_word(rng)} and the {_word(rng)} at once.\n</user_query>\n"
+        f"<function_calls>\n{_call(rng, name, params)}\n{_call(rng, name, params)}\n</function_calls>"
+        for _i in range(cfg.queries)
+    )
+
+
+def _multi_turn(rng: random.Random, cfg: MockConfig, prompt: str) -> str:
+    functions = _functions_in(prompt)
+    turns = []
+    for i in range(cfg.turns):
+        name, params = functions[i % len(functions)]
+        turns.append(
+            f"<query>\nNow please handle the {_word(rng)}.\n</query>\n"
+            f"<function_call>\n{_call(rng, name, params)}\n</function_call>\n"
+            f'<tool>\n{{"status": "ok", "{_word(rng)}": {rng.randint(1, 99)}}}\n</tool>'
+        )
+    return "<dialogue>\n" + "\n".join(turns) + "\n</dialogue>"
+
+
+_GENERATORS = {
+    "scenarios": _scenarios,
+    "functions": _functions,
+    "simple": _simple,
+    "parallel": _parallel,
+    "multi_turn": _multi_turn,
+}
+
+
+def respond(cfg: MockConfig, system: str, prompt: str) -> Tuple[str, str]:
+    """(kind, response text) for one request; packed prompts get one
+    <result id> per <item>."""
+    kind = prompt_kind(system, prompt)
+    generate = _GENERATORS[kind]
+    rng = random.Random(zlib.crc32(prompt.encode("utf-8")) ^ cfg.seed)
+    items = _ITEM_RE.findall(prompt)
+    if not items:
+        return kind, generate(rng, cfg, prompt)
+    return kind, "\n".join(
+        f'<result id="{item_id}">\n{generate(rng, cfg, body)}\n</result>' for item_id, body in items
+    )
+
+
+def _latency_s(cfg: MockConfig, rng: random.Random, completion_tokens: int) -> float:
+    base = cfg.latency_ms / 1000
+    if cfg.latency == "uniform":
+        delay = rng.uniform(0, base)
+    elif cfg.latency == "lognormal":
+        delay = base * math.exp(rng.gauss(0, cfg.latency_sigma))
+    else:
+        delay = base
+    if cfg.tokens_per_s > 0:
+        delay += completion_tokens / cfg.tokens_per_s
+    return delay
+
+
+def _make_handler(cfg: MockConfig, stats: MockStats):
+    rng = random.Random(cfg.seed)
+    rng_lock = threading.Lock()
+
+    def draw() -> Tuple[float, float]:
+        with rng_lock:
+            return rng.random(), rng.random()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args) -> None:
+            pass
+
+        def _send_json(
+            self, status: int, payload: Dict[str, Any], headers: Optional[Dict[str, str]] = None
+        ) -> None:
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("content-type", "application/json")
+            self.send_header("content-length", str(len(body)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self) -> None:
+            body = json.loads(self.rfile.read(int(self.headers.get("content-length", 0))) or b"{}")
+            if not self.path.endswith("/chat/completions"):
+                self._send_json(404, {"error": {"message": f"{self.path} is not mocked"}})
+                return
+            stats.count("requests")
+            roll, wait_roll = draw()
+            retry = {"retry-after-ms": str(cfg.retry_after_ms)}
+            if roll < cfg.error_429:
+                stats.count("rate_limited")
+                self._send_json(429, {"error": {"message": "Rate limit reached", "type": "requests"}}, retry)
+                return
+            if roll < cfg.error_429 + cfg.error_5xx:
+                stats.count("server_errors")
+                self._send_json(503, {"error": {"message": "The server is overloaded"}}, retry)
+                return
+
+            messages = body.get("messages", [])
+            system = "".join(m.get("content") or "" for m in messages if m.get("role") == "system")
+            prompt = "".join(m.get("content") or "" for m in messages if m.get("role") != "system")
+            kind, text = respond(cfg, system, prompt)
+            prompt_tokens = len(system + prompt) // 4
+            completion_tokens = len(text) // 4
+            time.sleep(_latency_s(cfg, random.Random(wait_roll), completion_tokens))
+            stats.count("ok", kind)
+            usage = {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+                "prompt_tokens_details": {"cached_tokens": 0},
+            }
+            model = body.get("model", "mock")
+            if body.get("stream"):
+                self._stream(model, text, usage)
+                return
+            self._send_json(
+                200,
+                {
+                    "id": "chatcmpl-mock",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": model,
+                    "choices": [
+                        {
+                            "index": 0,
+                            "message": {"role": "assistant", "content": text},
+                            "finish_reason": "stop",
+                        }
+                    ],
+                    "usage": usage,
+                },
+            )
+
+        def _stream(self, model: str, text: str, usage: Dict[str, Any]) -> None:
+            self.send_response(200)
+            self.send_header("content-type", "text/event-stream")
+            self.send_header("transfer-encoding", "chunked")
+            self.end_headers()
+
+            def chunk(payload: Dict[str, Any]) -> bytes:
+                data = f"data: {json.dumps(payload)}\n\n".encode("utf-8")
+                return b"%x\r\n%s\r\n" % (len(data), data)
+
+            base = {"id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": 0, "model": model}
+            try:
+                for i in range(0, len(text), 64):
+                    delta = {"index": 0, "delta": {"content": text[i : i + 64]}, "finish_reason": None}
+                    self.wfile.write(chunk({**base, "choices": [delta]}))
+                self.wfile.write(chunk({**base, "choices": [], "usage": usage}))
+                done = b"data: [DONE]\n\n"
+                self.wfile.write(b"%x\r\n%s\r\n0\r\n\r\n" % (len(done), done))
+            except (BrokenPipeError, ConnectionResetError):
+                # the client cancelled the stream early
+                pass
+
+    return Handler
+
+
+class MockServer:
+    """Threaded mock server; start() returns the base URL (…/v1)."""
+
+    def __init__(self, config: Optional[MockConfig] = None, host: str = "127.0.0.1", port: int = 0):
+        self.config = config or MockConfig()
+        self.stats = MockStats()
+        self._server = ThreadingHTTPServer((host, port), _make_handler(self.config, self.stats))
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> str:
+        self._thread = threading.Thread(target=self._server.serve_forever, name="mock-openai", daemon=True)
+        self._thread.start()
+        return self.base_url
+
+    def serve_forever(self) -> None:
+        self._server.serve_forever()
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "MockServer":
+        self.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+
+def add_config_args(parser: argparse.ArgumentParser) -> None:
+    defaults = MockConfig()
+    parser.add_argument("--latency", choices=("fixed", "uniform", "lognormal"), default=defaults.latency)
+    parser.add_argument(
+        "--latency-ms",
+        type=float,
+        default=defaults.latency_ms,
+        help="fixed latency, uniform upper bound or lognormal median",
+    )
+    parser.add_argument("--latency-sigma", type=float, default=defaults.latency_sigma)
+    parser.add_argument(
+        "--tokens-per-s", type=float, default=defaults.tokens_per_s, help="completion speed (0: off)"
+    )
+    parser.add_argument("--error-429", type=float, default=defaults.error_429, help="share of 429 responses")
+    parser.add_argument("--error-5xx", type=float, default=defaults.error_5xx, help="share of 503 responses")
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+
+
+def config_from_args(args: argparse.Namespace) -> MockConfig:
+    return MockConfig(
+        latency=args.latency,
+        latency_ms=args.latency_ms,
+        latency_sigma=args.latency_sigma,
+        tokens_per_s=args.tokens_per_s,
+        error_429=args.error_429,
+        error_5xx=args.error_5xx,
+        seed=args.seed,
+    )
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="OpenAI-compatible mock server")
+    arg_parser.add_argument("--host", default="127.0.0.1")
+    arg_parser.add_argument("--port", type=int, default=8765)
+    add_config_args(arg_parser)
+    cli = arg_parser.parse_args()
+    server = MockServer(config_from_args(cli), cli.host, cli.port)
+    print(f"Mock OpenAI server on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(json.dumps(server.stats.summary()))
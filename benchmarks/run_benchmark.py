@@ -0,0 +1,245 @@
+import argparse
+import csv
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+from benchmarks.mock_openai import MockServer, add_config_args, config_from_args
+
+# End-to-end offline throughput benchmark.
+# For each curriculum size, copies the OpenAI runners into a scratch
+# directory, starts the mock server (benchmarks/mock_openai.py) and runs
+# run_s1_openai -> run_s2_openai -> run_s3_openai -> convert -> validate
+# against it, each stage in its own process. Reports per stage wall time,
+# records/s, requests/s, p50/p99 request latency (from usage_summary.json)
+# and the stage process's peak RSS.
+#
+#   python -m benchmarks.run_benchmark --sizes 10,50,200 --json bench.json
+#   python -m benchmarks.run_benchmark --sizes 10,50,200 --baseline bench.json
+#
+# Pipeline settings (S3_PACK_SIZE, OPENAI_STREAM, ...) are taken from the
+# environment, so configurations can be compared run against run. With
+# --baseline the run fails if records/s of any stage drops by more than
+# --tolerance against the saved result.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_RUN_DIR_RE = re.compile(r"^[0-9a-f]{32}$")
+
+STAGES = ("s1", "s2", "s3", "convert", "validate")
+ENG_OUTPUTS = ("multi_turn_eng", "simple_eng", "parallel_eng", "multiple_eng")
+_COMMANDS = {
+    "s1": ["run_s1_openai.py"],
+    "s2": ["run_s2_openai.py"],
+    "s3": ["run_s3_openai.py"],
+    "convert": ["-m", "pipeline.tools.convert_to_multi_turn_eng"],
+    "validate": ["-m", "pipeline.tools.validate_multi_turn_eng"],
+}
+# usage_summary.json key of each API stage
+_USAGE_KEYS = {"s1": "S1", "s2": "S2", "s3": "S3"}
+
+
+def _ignore(directory: str, names: List[str]) -> List[str]:
+    ignored = {"__pycache__"}
+    if os.path.basename(directory) == "pipeline":
+        ignored |= {"data"} | {name for name in names if _RUN_DIR_RE.match(name)}
+    return [name for name in names if name in ignored]
+
+
+def make_workspace(rows: int) -> str:
+    """Scratch copy of the OpenAI pipeline with a curriculum of `rows` rows
+    (the repo's curriculum, repeated with numbered subdomains if needed)."""
+    work = tempfile.mkdtemp(prefix="pfc-bench-")
+    for name in ("run_s1_openai.py", "run_s2_openai.py", "run_s3_openai.py"):
+        shutil.copy2(os.path.join(ROOT, name), work)
+    for name in ("openai_utils", "pipeline"):
+        shutil.copytree(os.path.join(ROOT, name), os.path.join(work, name), ignore=_ignore)
+    with open(os.path.join(ROOT, "pipeline", "data", "curriculum.csv"), newline="", encoding="utf-8") as f:
+        source = list(csv.DictReader(f))
+    os.makedirs(os.path.join(work, "pipeline", "data"))
+    with open(os.path.join(work, "pipeline", "data", "curriculum.csv"), "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=["domain", "subdomain", "entities"])
+        writer.writeheader()
+        for i in range(rows):
+            row = dict(source[i % len(source)])
+            if i >= len(source):
+                row["subdomain"] = f"{row['subdomain']}_{i // len(source)}"
+            writer.writerow({key: row.get(key, "") for key in ("domain", "subdomain", "entities")})
+    return work
+
+
+def _run(args: List[str], cwd: str, env: Dict[str, str], log_path: str) -> Dict[str, Any]:
+    start = time.perf_counter()
+    with open(log_path, "ab") as log:
+        proc = subprocess.Popen([sys.executable, *args], cwd=cwd, env=env, stdout=log, stderr=log)
+        # wait4 gives this child's own rusage (ru_maxrss is KiB on Linux)
+        _, status, rusage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    return {
+        "returncode": proc.returncode,
+        "wall_s": time.perf_counter() - start,
+        "peak_rss_mb": rusage.ru_maxrss / 1024,
+    }
+
+
+def _count_records(path: str) -> int:
+    if path.endswith(".jsonl"):
+        with open(path, "rb") as f:
+            return sum(1 for line in f if line.strip())
+    with open(path, "r", encoding="utf-8") as f:
+        return len(json.load(f))
+
+
+def _artifact(run_dir: str, name: str) -> Optional[str]:
+    for ext in ("jsonl", "json"):
+        path = os.path.join(run_dir, f"{name}.{ext}")
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def _stage_records(stage: str, run_dir: str) -> int:
+    names = {
+        "s1": ["scenarios"],
+        "s2": ["functions"],
+        "s3": ["simple_queries", "parallel_queries", "multiple_queries", "multi_turn_queries"],
+        "convert": list(ENG_OUTPUTS),
+        "validate": list(ENG_OUTPUTS),
+    }[stage]
+    paths = [_artifact(run_dir, name) for name in names]
+    return sum(_count_records(path) for path in paths if path is not None)
+
+
+def _run_dir(work: str) -> str:
+    with open(os.path.join(work, "run_id"), "r", encoding="utf-8") as f:
+        return os.path.join(work, "pipeline", "data", f.read().strip())
+
+
+def bench_size(rows: int, base_url: str, keep: bool = False) -> Dict[str, Any]:
+    work = make_workspace(rows)
+    log_path = os.path.join(work, "bench.log")
+    env = {
+        **os.environ,
+        "OPENAI_BASE_URL": base_url,
+        "OPENAI_API_KEY": "benchmark",
+        "OPENAI_CACHE_BYPASS": "1",
+        "OPENAI_BATCH": "0",
+        "PYTHONPATH": work,
+    }
+    stages: Dict[str, Dict[str, Any]] = {}
+    try:
+        for stage in STAGES:
+            args = list(_COMMANDS[stage])
+            if stage == "validate":
+                for name in ENG_OUTPUTS:
+                    path = os.path.join(_run_dir(work), f"{name}.jsonl")
+                    if os.path.exists(path):
+                        args.append(path)
+            result = _run(args, work, env, log_path)
+            stages[stage] = result
+            if result["returncode"] != 0:
+                print(f"[{rows} rows] {stage} failed (exit {result['returncode']}), see {log_path}")
+                keep = True
+                break
+            # s1 writes ./run_id; every later stage works in that run's directory
+            run_dir = _run_dir(work)
+            result["records"] = _stage_records(stage, run_dir)
+            result["records_per_s"] = result["records"] / result["wall_s"]
+            usage_key = _USAGE_KEYS.get(stage)
+            if usage_key is not None:
+                with open(os.path.join(run_dir, "usage_summary.json"), "r", encoding="utf-8") as f:
+                    usage = json.load(f).get(usage_key, {})
+                result["requests"] = usage.get("requests", 0)
+                result["requests_per_s"] = result["requests"] / result["wall_s"]
+                result["p50_latency_s"] = usage.get("p50_latency_s")
+                result["p99_latency_s"] = usage.get("p99_latency_s")
+    finally:
+        if keep:
+            print(f"[{rows} rows] workspace kept at {work}")
+        else:
+            shutil.rmtree(work, ignore_errors=True)
+    return {"rows": rows, "stages": stages}
+
+
+def _fmt(value: Any, width: int, spec: str = "") -> str:
+    return f"{'-':>{width}}" if value is None else format(value, f">{width}{spec}")
+
+
+def print_report(results: List[Dict[str, Any]]) -> None:
+    header = (
+        f"{'rows':>6} {'stage':<9} {'wall_s':>8} {'records':>8} {'rec/s':>9} "
+        f"{'requests':>8} {'req/s':>8} {'p50_s':>7} {'p99_s':>7} {'rss_mb':>8}"
+    )
+    print(header)
+    print("-" * len(header))
+    for result in results:
+        for stage, r in result["stages"].items():
+            print(
+                f"{result['rows']:>6} {stage:<9} {r['wall_s']:>8.2f} {_fmt(r.get('records'), 8, 'd')} "
+                f"{_fmt(r.get('records_per_s'), 9, '.1f')} {_fmt(r.get('requests'), 8, 'd')} "
+                f"{_fmt(r.get('requests_per_s'), 8, '.1f')} {_fmt(r.get('p50_latency_s'), 7, '.3f')} "
+                f"{_fmt(r.get('p99_latency_s'), 7, '.3f')} {r['peak_rss_mb']:>8.1f}"
+            )
+
+
+def compare(results: List[Dict[str, Any]], baseline: List[Dict[str, Any]], tolerance: float) -> List[str]:
+    """Stages whose records/s fell more than `tolerance` below the baseline."""
+    previous = {
+        (result["rows"], stage): r.get("records_per_s")
+        for result in baseline
+        for stage, r in result["stages"].items()
+    }
+    regressions = []
+    for result in results:
+        for stage, r in result["stages"].items():
+            before = previous.get((result["rows"], stage))
+            now = r.get("records_per_s")
+            if before and now is not None and now < before * (1 - tolerance):
+                regressions.append(
+                    f"{result['rows']} rows / {stage}: {now:.1f} records/s vs {before:.1f} in the baseline"
+                )
+    return regressions
+
+
+def main() -> int:
+    arg_parser = argparse.ArgumentParser(description="Offline pipeline throughput benchmark")
+    arg_parser.add_argument("--sizes", default="10,50,200", help="comma-separated curriculum sizes")
+    arg_parser.add_argument("--json", help="write results to this file")
+    arg_parser.add_argument("--baseline", help="results file to compare records/s against")
+    arg_parser.add_argument("--tolerance", type=float, default=0.2, help="allowed records/s drop (default: 0.2)")
+    arg_parser.add_argument("--keep", action="store_true", help="keep the scratch workspaces")
+    add_config_args(arg_parser)
+    args = arg_parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(",") if size.strip()]
+
+    results: List[Dict[str, Any]] = []
+    with MockServer(config_from_args(args)) as server:
+        for rows in sizes:
+            print(f"Benchmarking {rows} curriculum rows against {server.base_url} ...")
+            results.append(bench_size(rows, server.base_url, keep=args.keep))
+        mock_summary = server.stats.summary()
+
+    print()
+    print_report(results)
+    print(f"\nmock server: {mock_summary}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"results": results, "mock": mock_summary, "config": vars(args)}, f, indent=2)
+
+    failed = any(r["returncode"] != 0 for result in results for r in result["stages"].values())
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare(results, json.load(f)["results"], args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        failed = failed or bool(regressions)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
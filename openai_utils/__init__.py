@@ -0,0 +1,357 @@
+import asyncio
+import logging
+import os
+import re
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Sequence, TypeVar
+
+from tqdm import tqdm
+
+from .batch import batch_enabled, get_batch_backend, run_batch
+from .cache import (
+    ResponseCache,
+    cache_key,
+    close_response_cache,
+    response_cache,
+    set_cache_namespace,
+)
+from .cassette import Cassette, CassetteMiss, close_cassette, get_cassette
+from .client import (
+    RequestTiming,
+    close_clients as _close_http_clients,
+    get_async_client,
+    get_client,
+    open_clients,
+    transport_stats,
+)
+from .packing import pack_size, render_packed, unpack_results
+from .ratelimit import RateLimiter, estimate_prompt_tokens, estimate_tokens, get_rate_limiter
+from .stream import IncrementalTagParser, stream_completion, stream_enabled, stream_stats
+from .tags import TagNode, group_records, iter_nodes, parse_tags
+from .templates import CompiledTemplate, load_template, prefix_layout_enabled
+from .trace import (
+    counter,
+    export_events,
+    merge_events,
+    span,
+    start_tracing,
+    stop_tracing,
+    tracing_enabled,
+)
+from .usage import (
+    StageUsage,
+    close_usage_ledger,
+    current_stage,
+    open_usage_ledger,
+    usage_stage,
+    usage_stats,
+)
+
+try:
+    from dotenv import load_dotenv  # optional
+    load_dotenv()
+except Exception:
+    pass
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+# Simple template rendering: replace {{var}} with value
+
+def render_template(template_path: str, variables: Dict[str, str]) -> str:
+    with span("render", template=template_path):
+        return load_template(template_path, variables).render(variables)
+
+
+def assemble_prompt(
+    template_path: str, variables: Dict[str, str], trailing: Sequence[str] = ()
+) -> str:
+    """render_template, but with OPENAI_PREFIX_LAYOUT=1 the per-request
+    `trailing` variables go after the static instructions, so consecutive
+    requests share a cacheable prefix.
+    """
+    with span("render", template=template_path):
+        tpl = load_template(template_path, variables)
+        if not trailing or not prefix_layout_enabled():
+            return tpl.render(variables)
+        prefix, suffix = tpl.render_split(variables, trailing)
+        return f"{prefix}\n\n{suffix}\n"
+
+
+def extract_tags(text: str, tag: str) -> List[str]:
+    with span("parse", tag=tag):
+        return [node.content for node in parse_tags(text, (tag,))]
+
+
+# Minimal OpenAI chat wrapper
+
+def _build_request_kwargs(
+    prompt: str, model: str | None = None, system: str | None = None
+) -> Dict[str, Any]:
+    model = model or os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+
+    messages = []
+    if system:
+        messages.append({"role": "system", "content": system})
+    messages.append({"role": "user", "content": prompt})
+
+    kwargs = {
+        "model": model,
+        "messages": messages,
+        "temperature": float(os.getenv("OPENAI_TEMPERATURE", "0.7")),
+    }
+
+    # Token limit handling:
+    # To avoid API incompatibility, we DO NOT send any token limit by default.
+    # If you explicitly set OPENAI_MAX_TOKENS, we will include it using the field
+    # specified by OPENAI_MAX_TOKENS_FIELD (default: max_completion_tokens).
+    max_tokens_env = os.getenv("OPENAI_MAX_TOKENS")
+    if max_tokens_env:
+        try:
+            max_tokens_value = int(max_tokens_env)
+            max_tokens_field = os.getenv(
+                "OPENAI_MAX_TOKENS_FIELD", "max_completion_tokens"
+            )
+            if max_tokens_field == "max_tokens":
+                kwargs["max_tokens"] = max_tokens_value
+            else:
+                kwargs["max_completion_tokens"] = max_tokens_value
+        except ValueError:
+            # ignore invalid value, proceed without token cap
+            pass
+    return kwargs
+
+
+def _total_tokens(usage: Any) -> int | None:
+    if isinstance(usage, dict):
+        return usage.get("total_tokens")
+    return getattr(usage, "total_tokens", None) if usage is not None else None
+
+
+def _estimated_usage(kwargs: Dict[str, Any], content: str) -> Dict[str, int]:
+    """Usage of a stream cancelled before its final (usage) chunk."""
+    prompt = estimate_prompt_tokens(kwargs)
+    completion = len(content) // 4
+    return {"prompt_tokens": prompt, "completion_tokens": completion, "total_tokens": prompt + completion}
+
+
+def chat_complete(prompt: str, model: str | None = None, system: str | None = None) -> str:
+    """Call OpenAI Chat Completions with a single user prompt.
+    Requires OPENAI_API_KEY in environment.
+    """
+    kwargs = _build_request_kwargs(prompt, model, system)
+    cassette = get_cassette()
+    cache = response_cache()
+    key = cache_key(kwargs) if cache is not None or cassette is not None else ""
+    if cassette is not None and cassette.replaying:
+        replayed = cassette.lookup(key)
+        if replayed is not None:
+            return replayed
+    if cache is not None:
+        with span("cache_lookup", cat="cache"):
+            cached = cache.get(key)
+        if cached is not None:
+            if cassette is not None:
+                cassette.record(key, kwargs["model"], cached)
+            return cached
+    client = get_client()
+    limiter = get_rate_limiter(kwargs["model"])
+    est = estimate_tokens(kwargs)
+    with span("rate_limit", est_tokens=est):
+        limiter.acquire_sync(est)
+    raw = usage = None
+    start = time.perf_counter()
+    try:
+        with span("request", cat="network", model=kwargs["model"]):
+            raw = client.chat.completions.with_raw_response.create(**kwargs)
+            resp = raw.parse()
+        usage = resp.usage
+    finally:
+        limiter.release(
+            est,
+            headers=raw.headers if raw is not None else None,
+            used_tokens=_total_tokens(usage),
+        )
+    usage_stats().record(usage, kwargs["model"], time.perf_counter() - start)
+    content = resp.choices[0].message.content or ""
+    if cache is not None:
+        cache.put(key, content)
+    if cassette is not None:
+        cassette.record(key, kwargs["model"], content, usage)
+    return content
+
+
+async def chat_complete_async(
+    prompt: str,
+    model: str | None = None,
+    system: str | None = None,
+    parser: IncrementalTagParser | None = None,
+) -> str:
+    """Async variant of chat_complete built on AsyncOpenAI.
+    Does not block the event loop, so many calls can be in flight at once.
+
+    With a parser and OPENAI_STREAM=1 the completion is streamed through the
+    parser and cancelled as soon as it reports done; the returned text is
+    what was received up to that point, and is not put in the response
+    cache (the cache holds full completions only).
+    """
+    kwargs = _build_request_kwargs(prompt, model, system)
+    cassette = get_cassette()
+    cache = response_cache()
+    key = cache_key(kwargs) if cache is not None or cassette is not None else ""
+    if cassette is not None and cassette.replaying:
+        replayed = cassette.lookup(key)
+        if replayed is not None:
+            if parser is not None:
+                parser.feed(replayed)
+            return replayed
+    if cache is not None:
+        with span("cache_lookup", cat="cache"):
+            cached = cache.get(key)
+        if cached is not None:
+            if cassette is not None:
+                cassette.record(key, kwargs["model"], cached)
+            if parser is not None:
+                parser.feed(cached)
+            return cached
+    client = get_async_client()
+    limiter = get_rate_limiter(kwargs["model"])
+    est = estimate_tokens(kwargs)
+    with span("rate_limit", est_tokens=est):
+        await limiter.acquire(est)
+    headers = usage = None
+    cancelled = estimated = False
+    start = time.perf_counter()
+    try:
+        if parser is not None and stream_enabled():
+            with span("request", cat="network", model=kwargs["model"], stream=True):
+                content, headers, usage, cancelled = await stream_completion(
+                    client, kwargs, parser
+                )
+            if usage is None:
+                usage, estimated = _estimated_usage(kwargs, content), True
+        else:
+            with span("request", cat="network", model=kwargs["model"]):
+                raw = await client.chat.completions.with_raw_response.create(**kwargs)
+                headers = raw.headers
+                resp = raw.parse()
+            usage = resp.usage
+            content = resp.choices[0].message.content or ""
+            if parser is not None:
+                parser.feed(content)
+    finally:
+        limiter.release(est, headers=headers, used_tokens=_total_tokens(usage))
+    usage_stats().record(usage, kwargs["model"], time.perf_counter() - start, estimated=estimated)
+    if cache is not None and not cancelled:
+        cache.put(key, content)
+    if cassette is not None:
+        cassette.record(key, kwargs["model"], content, usage)
+    return content
+
+
+async def complete_batch(
+    prompts: Iterable[str],
+    work_dir: str,
+    name: str,
+    model: str | None = None,
+    system: str | None = None,
+) -> List[str | None]:
+    """Batch API counterpart of mapping chat_complete_async over prompts.
+    Returns response texts in prompt order, None for requests that failed.
+    """
+    bodies = (_build_request_kwargs(prompt, model, system) for prompt in prompts)
+    cassette = get_cassette()
+    if cassette is None:
+        with span("batch", cat="network", batch=name):
+            return await run_batch(bodies, work_dir, name)
+
+    # only requests the cassette cannot replay are submitted
+    bodies = list(bodies)
+    keys = [cache_key(body) for body in bodies]
+    results: List[str | None] = [None] * len(bodies)
+    if cassette.replaying:
+        results = [cassette.lookup(key) for key in keys]
+    missing = [i for i, content in enumerate(results) if content is None]
+    if missing:
+        with span("batch", cat="network", batch=name):
+            contents = await run_batch((bodies[i] for i in missing), work_dir, name)
+        for i, content in zip(missing, contents):
+            results[i] = content
+            if content is not None:
+                cassette.record(keys[i], bodies[i]["model"], content)
+    return results
+
+
+async def close_clients() -> None:
+    """Close pooled HTTP clients, the response cache, the cassette, the usage
+    ledger and the trace (call at runner exit)."""
+    await _close_http_clients()
+    close_response_cache()
+    if stream_stats().streams:
+        logging.info(f"OpenAI streaming: {stream_stats().summary()}")
+    for stage, summary in usage_stats().summary().items():
+        logging.info(f"OpenAI usage [{stage}]: {summary}")
+    close_cassette()
+    close_usage_ledger()
+    stop_tracing()
+
+
+def max_in_flight(stage: str, default: int = 8) -> int:
+    """Max concurrent requests for a stage.
+    Reads <STAGE>_MAX_IN_FLIGHT (e.g. S2_MAX_IN_FLIGHT), then OPENAI_MAX_IN_FLIGHT.
+    """
+    for key in (f"{stage.upper()}_MAX_IN_FLIGHT", "OPENAI_MAX_IN_FLIGHT"):
+        value = os.getenv(key)
+        if value:
+            try:
+                return max(1, int(value))
+            except ValueError:
+                pass
+    return default
+
+
+async def map_bounded(
+    func: Callable[[T], Awaitable[R]],
+    items: Iterable[T],
+    limit: int,
+    desc: str | None = None,
+) -> List[R]:
+    """Run func over items with at most `limit` calls in flight.
+    Items are pulled lazily, so a generator is never materialized up front.
+    Results are returned in input order regardless of completion order.
+    The first exception cancels the other calls before it is raised.
+    """
+    pbar = tqdm(total=len(items) if hasattr(items, "__len__") else None, desc=desc)
+    pending = enumerate(items)
+    results: Dict[int, R] = {}
+
+    async def worker() -> None:
+        # workers share one iterator; next() never interleaves on the loop
+        for idx, item in pending:
+            results[idx] = await func(item)
+            pbar.update(1)
+
+    workers = [asyncio.ensure_future(worker()) for _ in range(max(1, limit))]
+    try:
+        await asyncio.gather(*workers)
+    finally:
+        # no-op on success; after a failure, stop the siblings from pulling
+        # more items (or recording them) once the caller starts unwinding
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        pbar.close()
+    return [results[idx] for idx in range(len(results))]
+
+
+def extract_code_fence(text: str, lang: str = "python") -> List[str]:
+    """Extract fenced code blocks ```lang ... ``` from text.
+    Returns a list of code strings (without fences).
+    """
+    if not text:
+        return []
+    pattern = re.compile(
+        rf"```{lang}\s*(.*?)```",
+        re.DOTALL | re.IGNORECASE,
+    )
+    return [m.strip() for m in pattern.findall(text)]
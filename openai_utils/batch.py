@@ -0,0 +1,254 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from .cache import cache_key, response_cache
+from .client import get_async_client
+from .usage import usage_stats
+
+# OpenAI Batch API execution.
+# Prompts are rendered into JSONL request files (split to respect the
+# per-batch request/size limits), submitted, polled until every batch reaches
+# a terminal state, and the outputs are returned in input order so the
+# stage's usual post-processing runs unchanged.
+#
+#   OPENAI_BATCH=1 / --batch         use batch mode in the runners
+#   OPENAI_BATCH_BACKEND=local       file-based stand-in for offline runs
+#   OPENAI_BATCH_LOCAL_DIR           local backend root (default: pipeline/data/local_batches)
+#   OPENAI_BATCH_MAX_REQUESTS        requests per batch (default: 50000)
+#   OPENAI_BATCH_MAX_MB              input file size per batch (default: 190)
+#   OPENAI_BATCH_POLL_S              poll interval in seconds (default: 30)
+
+_ENDPOINT = "/v1/chat/completions"
+_TERMINAL = {"completed", "failed", "expired", "cancelled"}
+
+
+def batch_enabled() -> bool:
+    return os.getenv("OPENAI_BATCH", "0") == "1"
+
+
+class OpenAIBatchBackend:
+    async def submit(self, input_path: str) -> str:
+        client = get_async_client()
+        with open(input_path, "rb") as f:
+            uploaded = await client.files.create(file=f, purpose="batch")
+        batch = await client.batches.create(
+            input_file_id=uploaded.id, endpoint=_ENDPOINT, completion_window="24h"
+        )
+        return batch.id
+
+    async def poll(self, batch_id: str) -> Tuple[str, Optional[str]]:
+        """Return (status, output JSONL text once terminal)."""
+        client = get_async_client()
+        batch = await client.batches.retrieve(batch_id)
+        if batch.status not in _TERMINAL:
+            return batch.status, None
+        if batch.status != "completed":
+            logging.warning(f"Batch {batch_id} ended with status {batch.status}")
+        if not batch.output_file_id:
+            return batch.status, ""
+        content = await client.files.content(batch.output_file_id)
+        return batch.status, content.text
+
+
+class LocalBatchBackend:
+    """File-based stand-in for the Batch API.
+
+    Each submitted batch gets a directory with input.jsonl. A batch is
+    completed once output.jsonl exists next to it; if nothing else has
+    written one, the backend answers the requests itself through the
+    configured OpenAI-compatible endpoint (e.g. a local mock server).
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    async def submit(self, input_path: str) -> str:
+        with open(input_path, "rb") as f:
+            data = f.read()
+        batch_id = "batch_local_" + hashlib.sha256(data).hexdigest()[:16]
+        batch_dir = os.path.join(self.root, batch_id)
+        os.makedirs(batch_dir, exist_ok=True)
+        with open(os.path.join(batch_dir, "input.jsonl"), "wb") as f:
+            f.write(data)
+        return batch_id
+
+    async def poll(self, batch_id: str) -> Tuple[str, Optional[str]]:
+        batch_dir = os.path.join(self.root, batch_id)
+        output_path = os.path.join(batch_dir, "output.jsonl")
+        if not os.path.exists(output_path):
+            await self._respond(batch_dir, output_path)
+        with open(output_path, "r", encoding="utf-8") as f:
+            return "completed", f.read()
+
+    async def _respond(self, batch_dir: str, output_path: str) -> None:
+        client = get_async_client()
+        lines: List[str] = []
+        with open(os.path.join(batch_dir, "input.jsonl"), "r", encoding="utf-8") as f:
+            for line in f:
+                req = json.loads(line)
+                try:
+                    resp = await client.chat.completions.create(**req["body"])
+                    out = {
+                        "custom_id": req["custom_id"],
+                        "response": {"status_code": 200, "body": resp.model_dump()},
+                        "error": None,
+                    }
+                except Exception as e:
+                    out = {
+                        "custom_id": req["custom_id"],
+                        "response": None,
+                        "error": {"message": str(e)},
+                    }
+                lines.append(json.dumps(out, ensure_ascii=False))
+        tmp_path = output_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, output_path)
+
+
+def get_batch_backend():
+    if os.getenv("OPENAI_BATCH_BACKEND", "openai") == "local":
+        return LocalBatchBackend(os.getenv("OPENAI_BATCH_LOCAL_DIR", "pipeline/data/local_batches"))
+    return OpenAIBatchBackend()
+
+
+def _env_int(key: str, default: int) -> int:
+    try:
+        return int(os.getenv(key, str(default)))
+    except ValueError:
+        return default
+
+
+def _write_chunks(
+    requests: Iterable[Tuple[str, Dict[str, Any]]], work_dir: str, name: str
+) -> List[Dict[str, Any]]:
+    """Write request lines into size/count-limited JSONL files."""
+    max_requests = _env_int("OPENAI_BATCH_MAX_REQUESTS", 50000)
+    max_bytes = int(float(os.getenv("OPENAI_BATCH_MAX_MB", "190")) * 1024 * 1024)
+    chunks: List[Dict[str, Any]] = []
+    out = None
+    digest = None
+    count = size = 0
+
+    def close_chunk():
+        out.close()
+        chunks[-1].update({"count": count, "sha256": digest.hexdigest()})
+
+    for custom_id, body in requests:
+        line = json.dumps(
+            {"custom_id": custom_id, "method": "POST", "url": _ENDPOINT, "body": body},
+            ensure_ascii=False,
+        ).encode("utf-8") + b"\n"
+        if out is None or count >= max_requests or size + len(line) > max_bytes:
+            if out is not None:
+                close_chunk()
+            path = os.path.join(work_dir, f"{name}_{len(chunks):03d}.jsonl")
+            out = open(path, "wb")
+            digest = hashlib.sha256()
+            count = size = 0
+            chunks.append({"input": path})
+        out.write(line)
+        digest.update(line)
+        count += 1
+        size += len(line)
+    if out is not None:
+        close_chunk()
+    return chunks
+
+
+def _parse_output(text: str, results: Dict[str, str]) -> int:
+    errors = 0
+    for line in (text or "").splitlines():
+        if not line.strip():
+            continue
+        item = json.loads(line)
+        response = item.get("response") or {}
+        body = response.get("body") or {}
+        choices = body.get("choices") or []
+        if item.get("error") or response.get("status_code") != 200 or not choices:
+            errors += 1
+            continue
+        results[item["custom_id"]] = choices[0].get("message", {}).get("content") or ""
+        usage_stats().record(body.get("usage"), body.get("model") or "", batch=True)
+    return errors
+
+
+async def run_batch(
+    bodies: Iterable[Dict[str, Any]], work_dir: str, name: str
+) -> List[Optional[str]]:
+    """Run chat completion request bodies through the Batch API.
+
+    Returns the response text per body, in input order (None for requests
+    that failed or expired, so callers can leave them for a re-run). Bodies
+    already in the response cache are not submitted, and a manifest lets a
+    re-run resume polling instead of resubmitting; batches that did not
+    complete cleanly are dropped from it, so their requests are resubmitted.
+    """
+    os.makedirs(work_dir, exist_ok=True)
+    cache = response_cache()
+    keys: List[str] = []
+    results: Dict[str, str] = {}
+    submitted: List[int] = []
+
+    def pending():
+        for idx, body in enumerate(bodies):
+            key = cache_key(body)
+            keys.append(key)
+            if cache is not None:
+                cached = cache.get(key)
+                if cached is not None:
+                    results[f"{name}-{idx}"] = cached
+                    continue
+            submitted.append(idx)
+            yield f"{name}-{idx}", body
+
+    chunks = _write_chunks(pending(), work_dir, name)
+    manifest_path = os.path.join(work_dir, f"{name}.manifest.json")
+    previous: Dict[str, str] = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            previous = {c["sha256"]: c["batch_id"] for c in json.load(f) if c.get("batch_id")}
+
+    backend = get_batch_backend()
+    for chunk in chunks:
+        chunk["batch_id"] = previous.get(chunk["sha256"]) or await backend.submit(chunk["input"])
+        logging.info(f"Batch {chunk['batch_id']}: {chunk['count']} requests ({chunk['input']})")
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(chunks, f, indent=2)
+
+    poll_s = float(os.getenv("OPENAI_BATCH_POLL_S", "30"))
+    waiting = list(chunks)
+    while waiting:
+        still_waiting = []
+        for chunk in waiting:
+            status, output = await backend.poll(chunk["batch_id"])
+            if output is None:
+                still_waiting.append(chunk)
+                continue
+            if _parse_output(output, results) or status != "completed":
+                chunk["batch_id"] = None
+        waiting = still_waiting
+        if waiting:
+            logging.info(f"{len(waiting)} batch(es) of {name} still running")
+            await asyncio.sleep(poll_s)
+
+    # only cleanly completed batches are resumed
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump([c for c in chunks if c.get("batch_id")], f, indent=2)
+
+    missing = sum(1 for idx in submitted if f"{name}-{idx}" not in results)
+    if cache is not None:
+        for idx in submitted:
+            content = results.get(f"{name}-{idx}")
+            if content:
+                cache.put(keys[idx], content)
+    if missing:
+        logging.warning(
+            f"{missing} batch request(s) of {name} failed or expired; "
+            "they are left out and resubmitted on the next run"
+        )
+    return [results.get(f"{name}-{idx}") for idx in range(len(keys))]
@@ -0,0 +1,180 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+
+# Content-addressed response cache for chat completions.
+# Responses are stored in one SQLite file (WAL mode, so several runner
+# processes can read and write it at once) keyed by a hash of the request:
+# model, messages (system + rendered prompt), temperature and token cap.
+# Entries are scoped to a namespace, which the runners set to their run_id:
+# re-running a stage of the same run hits, while a new run samples fresh
+# completions instead of replaying the previous run's.
+#
+#   OPENAI_CACHE_PATH       cache file (default: pipeline/data/llm_cache.sqlite3)
+#   OPENAI_CACHE_BYPASS=1   neither read nor write the cache
+#   OPENAI_CACHE_NAMESPACE  namespace to use instead of the run_id (share one
+#                           value across runs to reuse their responses)
+#   OPENAI_CACHE_MAX_AGE    evict entries older than this many seconds (default: never)
+#   OPENAI_CACHE_MAX_MB     evict least recently used entries above this size (default: 1024)
+
+_KEY_FIELDS = ("model", "messages", "temperature", "max_tokens", "max_completion_tokens")
+
+
+def cache_key(kwargs: Dict[str, Any]) -> str:
+    payload = {k: kwargs.get(k) for k in _KEY_FIELDS}
+    blob = json.dumps(payload, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    def __init__(
+        self, path: str, max_age_s: float = 0.0, max_bytes: int = 0, namespace: str = ""
+    ):
+        self.path = path
+        self.namespace = namespace
+        self.max_age_s = max_age_s
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self._local = threading.local()
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY,"
+            " content TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " created REAL NOT NULL,"
+            " accessed REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses(accessed)")
+        self.evict()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _scoped(self, key: str) -> str:
+        if not self.namespace:
+            return key
+        return hashlib.sha256(f"{self.namespace}\0{key}".encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        key = self._scoped(key)
+        conn = self._conn()
+        row = conn.execute("SELECT content FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (time.time(), key))
+        return row[0]
+
+    def put(self, key: str, content: str) -> None:
+        now = time.time()
+        self._conn().execute(
+            "INSERT OR REPLACE INTO responses (key, content, size, created, accessed)"
+            " VALUES (?, ?, ?, ?, ?)",
+            (self._scoped(key), content, len(content.encode("utf-8")), now, now),
+        )
+        self.writes += 1
+
+    def evict(self) -> int:
+        """Drop expired entries, then least recently used ones above max_bytes."""
+        conn = self._conn()
+        removed = 0
+        if self.max_age_s > 0:
+            cur = conn.execute(
+                "DELETE FROM responses WHERE created < ?", (time.time() - self.max_age_s,)
+            )
+            removed += cur.rowcount
+        if self.max_bytes > 0:
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if total > self.max_bytes:
+                excess = total - self.max_bytes
+                freed = 0
+                keys = []
+                for key, size in conn.execute(
+                    "SELECT key, size FROM responses ORDER BY accessed ASC"
+                ):
+                    keys.append((key,))
+                    freed += size
+                    if freed >= excess:
+                        break
+                conn.executemany("DELETE FROM responses WHERE key = ?", keys)
+                removed += len(keys)
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "writes": self.writes,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def close(self) -> None:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+_cache: Optional[ResponseCache] = None
+_cache_lock = threading.Lock()
+_namespace = ""
+
+
+def set_cache_namespace(namespace: str) -> None:
+    """Scope cached responses to namespace (the runners pass their run_id);
+    OPENAI_CACHE_NAMESPACE takes precedence."""
+    global _namespace
+    _namespace = namespace
+
+
+def response_cache() -> Optional[ResponseCache]:
+    """Process-wide cache, or None when OPENAI_CACHE_BYPASS=1."""
+    global _cache
+    if os.getenv("OPENAI_CACHE_BYPASS", "0") == "1":
+        return None
+    with _cache_lock:
+        if _cache is None:
+            try:
+                max_age = float(os.getenv("OPENAI_CACHE_MAX_AGE", "0"))
+            except ValueError:
+                max_age = 0.0
+            try:
+                max_bytes = int(float(os.getenv("OPENAI_CACHE_MAX_MB", "1024")) * 1024 * 1024)
+            except ValueError:
+                max_bytes = 0
+            _cache = ResponseCache(
+                os.getenv("OPENAI_CACHE_PATH", "pipeline/data/llm_cache.sqlite3"),
+                max_age_s=max_age,
+                max_bytes=max_bytes,
+            )
+        _cache.namespace = os.getenv("OPENAI_CACHE_NAMESPACE") or _namespace
+        return _cache
+
+
+def close_response_cache() -> None:
+    global _cache
+    with _cache_lock:
+        cache, _cache = _cache, None
+    if cache is not None:
+        if cache.hits or cache.misses:
+            logging.info(f"LLM response cache: {cache.stats()}")
+        cache.close()
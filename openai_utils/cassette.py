@@ -0,0 +1,138 @@
+import gzip
+import json
+import logging
+import os
+import threading
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+
+from .usage import usage_fields
+
+# Record/replay cassettes for chat completions.
+# In record mode every completed request (including response-cache hits) is
+# appended to a gzip-compressed JSONL cassette as {"key", "model", "content",
+# "usage"}; the key is the response cache's request hash. In replay mode the
+# cassette is served instead of the API: no network, no rate limiting, so a
+# whole stage re-runs in seconds and only the post-processing is left to
+# profile. A request recorded several times (same prompt) replays its
+# responses in recorded order, then repeats the last one.
+#
+#   OPENAI_CASSETTE              cassette file, e.g. pipeline/data/<run_id>/s2.cassette.jsonl.gz
+#   OPENAI_CASSETTE_MODE         record | replay (default: record)
+#   OPENAI_CASSETTE_ON_MISS      in replay mode, a request not in the cassette:
+#                                fail (default) | passthrough (send it to the API)
+
+
+class CassetteMiss(KeyError):
+    """A replayed request that the cassette does not contain."""
+
+
+class Cassette:
+    def __init__(self, path: str, mode: str = "record", on_miss: str = "fail"):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"OPENAI_CASSETTE_MODE must be record or replay, not {mode!r}")
+        if on_miss not in ("fail", "passthrough"):
+            raise ValueError(f"OPENAI_CASSETTE_ON_MISS must be fail or passthrough, not {on_miss!r}")
+        self.path = path
+        self.mode = mode
+        self.on_miss = on_miss
+        self.hits = 0
+        self.misses = 0
+        self.recorded = 0
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Deque[str]] = {}
+        self._fp = None
+        if mode == "replay":
+            self._load()
+        else:
+            dirname = os.path.dirname(path)
+            if dirname:
+                os.makedirs(dirname, exist_ok=True)
+            # appending adds a gzip member; readers see one continuous stream
+            self._fp = gzip.open(path, "at", encoding="utf-8")
+
+    def _load(self) -> None:
+        if not os.path.exists(self.path):
+            raise FileNotFoundError(
+                f"Cassette {self.path} not found (record it with OPENAI_CASSETTE_MODE=record)"
+            )
+        count = 0
+        try:
+            with gzip.open(self.path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    entry = json.loads(line)
+                    self._entries.setdefault(entry["key"], deque()).append(entry["content"])
+                    count += 1
+        except (EOFError, gzip.BadGzipFile, json.JSONDecodeError):
+            # a recording process that crashed leaves a truncated last member
+            logging.warning(f"Cassette {self.path}: truncated, replaying the {count} complete entries")
+        logging.info(
+            f"Cassette {self.path}: replaying {count} response(s) for {len(self._entries)} request(s)"
+        )
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == "replay"
+
+    def lookup(self, key: str) -> Optional[str]:
+        """Recorded response for key; None on a passthrough miss.
+        Raises CassetteMiss on a miss when OPENAI_CASSETTE_ON_MISS=fail."""
+        with self._lock:
+            queue = self._entries.get(key)
+            if queue is None:
+                self.misses += 1
+                if self.on_miss == "fail":
+                    raise CassetteMiss(f"request {key[:16]}… is not in cassette {self.path}")
+                return None
+            self.hits += 1
+            return queue.popleft() if len(queue) > 1 else queue[0]
+
+    def record(self, key: str, model: str, content: str, usage: Any = None) -> None:
+        if self._fp is None:
+            return
+        prompt, cached, completion = usage_fields(usage)
+        line = json.dumps(
+            {"key": key, "model": model, "content": content, "usage": [prompt, cached, completion]},
+            ensure_ascii=False,
+        )
+        with self._lock:
+            self._fp.write(line + "\n")
+            self.recorded += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {"mode": self.mode, "hits": self.hits, "misses": self.misses, "recorded": self.recorded}
+
+    def close(self) -> None:
+        with self._lock:
+            fp, self._fp = self._fp, None
+        if fp is not None:
+            fp.close()
+
+
+_cassette: Optional[Cassette] = None
+_cassette_lock = threading.Lock()
+
+
+def get_cassette() -> Optional[Cassette]:
+    """Process-wide cassette, or None when OPENAI_CASSETTE is unset."""
+    global _cassette
+    path = os.getenv("OPENAI_CASSETTE")
+    if not path:
+        return None
+    with _cassette_lock:
+        if _cassette is None:
+            _cassette = Cassette(
+                path,
+                mode=os.getenv("OPENAI_CASSETTE_MODE", "record").lower(),
+                on_miss=os.getenv("OPENAI_CASSETTE_ON_MISS", "fail").lower(),
+            )
+        return _cassette
+
+
+def close_cassette() -> None:
+    global _cassette
+    with _cassette_lock:
+        cassette, _cassette = _cassette, None
+    if cassette is not None:
+        logging.info(f"Cassette {cassette.path}: {cassette.stats()}")
+        cassette.close()
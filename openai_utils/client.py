@@ -0,0 +1,252 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Deque, Dict, List, Optional
+
+import httpx
+
+# Process-wide OpenAI client registry.
+# One sync client and one async client (per event loop) are shared by every
+# chat_complete call so keep-alive connections, TLS sessions and the env lookup
+# are paid once per process instead of once per request.
+#
+# Pool configuration (env):
+#   OPENAI_POOL_MAX_CONNECTIONS   max open connections (default: 100)
+#   OPENAI_POOL_MAX_KEEPALIVE     max idle keep-alive connections (default: 20)
+#   OPENAI_POOL_KEEPALIVE_EXPIRY  seconds an idle connection is kept (default: 30)
+#   OPENAI_HTTP2=1                negotiate HTTP/2 (requires the `h2` package)
+
+
+@dataclass
+class RequestTiming:
+    """Wall-clock phases of one HTTP request, in seconds.
+    connect is 0.0 when a pooled connection was reused.
+    """
+
+    connect: float = 0.0
+    ttfb: float = 0.0
+    total: float = 0.0
+    reused: bool = True
+    http_version: str = ""
+
+
+class TransportStats:
+    """Collects per-request timings from the pooled transports."""
+
+    def __init__(self, keep_last: int = 10000):
+        self._lock = threading.Lock()
+        self.timings: Deque[RequestTiming] = deque(maxlen=keep_last)
+        self.requests = 0
+        self.new_connections = 0
+        self.connect_total = 0.0
+        self.ttfb_total = 0.0
+        self.total_total = 0.0
+
+    def record(self, timing: RequestTiming) -> None:
+        with self._lock:
+            self.timings.append(timing)
+            self.requests += 1
+            if not timing.reused:
+                self.new_connections += 1
+            self.connect_total += timing.connect
+            self.ttfb_total += timing.ttfb
+            self.total_total += timing.total
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            n = self.requests or 1
+            new = self.new_connections or 1
+            return {
+                "requests": self.requests,
+                "new_connections": self.new_connections,
+                "reused_connections": self.requests - self.new_connections,
+                "avg_connect_s": self.connect_total / new,
+                "avg_ttfb_s": self.ttfb_total / n,
+                "avg_total_s": self.total_total / n,
+                # handshakes a client-per-call setup would have paid for
+                "handshakes_saved": self.requests - self.new_connections,
+                "est_connect_time_saved_s": (self.requests - self.new_connections)
+                * (self.connect_total / new),
+            }
+
+
+_stats = TransportStats()
+
+
+def transport_stats() -> TransportStats:
+    return _stats
+
+
+def _int_env(key: str, default: int) -> int:
+    try:
+        return int(os.getenv(key, str(default)))
+    except ValueError:
+        return default
+
+
+def _float_env(key: str, default: float) -> float:
+    try:
+        return float(os.getenv(key, str(default)))
+    except ValueError:
+        return default
+
+
+def pool_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=_int_env("OPENAI_POOL_MAX_CONNECTIONS", 100),
+        max_keepalive_connections=_int_env("OPENAI_POOL_MAX_KEEPALIVE", 20),
+        keepalive_expiry=_float_env("OPENAI_POOL_KEEPALIVE_EXPIRY", 30.0),
+    )
+
+
+def http2_enabled() -> bool:
+    if os.getenv("OPENAI_HTTP2", "0") != "1":
+        return False
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        logging.warning("OPENAI_HTTP2=1 but the `h2` package is not installed; using HTTP/1.1")
+        return False
+    return True
+
+
+class _Tracer:
+    """Turns httpcore trace events into a RequestTiming."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.timing = RequestTiming()
+        self._connect_start: Optional[float] = None
+
+    def on_event(self, name: str, info: Dict[str, Any]) -> None:
+        now = time.perf_counter()
+        if name == "connection.connect_tcp.started":
+            self._connect_start = now
+            self.timing.reused = False
+        elif name in ("connection.connect_tcp.complete", "connection.start_tls.complete"):
+            if self._connect_start is not None:
+                self.timing.connect = now - self._connect_start
+        elif name.endswith("receive_response_headers.complete"):
+            self.timing.ttfb = now - self.start
+            self.timing.http_version = name.split(".", 1)[0]
+
+    def finish(self) -> None:
+        self.timing.total = time.perf_counter() - self.start
+        _stats.record(self.timing)
+
+
+class _TimedStream(httpx.SyncByteStream):
+    def __init__(self, stream: httpx.SyncByteStream, tracer: _Tracer):
+        self._stream = stream
+        self._tracer = tracer
+
+    def __iter__(self):
+        yield from self._stream
+
+    def close(self) -> None:
+        try:
+            self._stream.close()
+        finally:
+            self._tracer.finish()
+
+
+class _TimedAsyncStream(httpx.AsyncByteStream):
+    def __init__(self, stream: httpx.AsyncByteStream, tracer: _Tracer):
+        self._stream = stream
+        self._tracer = tracer
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self) -> None:
+        try:
+            await self._stream.aclose()
+        finally:
+            self._tracer.finish()
+
+
+class _TimedTransport(httpx.HTTPTransport):
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        tracer = _Tracer()
+        request.extensions["trace"] = tracer.on_event
+        response = super().handle_request(request)
+        response.stream = _TimedStream(response.stream, tracer)
+        return response
+
+
+class _TimedAsyncTransport(httpx.AsyncHTTPTransport):
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        tracer = _Tracer()
+
+        async def on_event(name: str, info: Dict[str, Any]) -> None:
+            tracer.on_event(name, info)
+
+        request.extensions["trace"] = on_event
+        response = await super().handle_async_request(request)
+        response.stream = _TimedAsyncStream(response.stream, tracer)
+        return response
+
+
+_lock = threading.Lock()
+_sync_client: Any = None
+# keyed by event loop: an httpx.AsyncClient's connections belong to one loop
+_async_clients: Dict[int, Any] = {}
+
+
+def get_client():
+    """Shared sync OpenAI client with a pooled, keep-alive transport."""
+    global _sync_client
+    with _lock:
+        if _sync_client is None:
+            from openai import DefaultHttpxClient, OpenAI
+
+            transport = _TimedTransport(limits=pool_limits(), http2=http2_enabled())
+            _sync_client = OpenAI(http_client=DefaultHttpxClient(transport=transport))
+        return _sync_client
+
+
+def get_async_client():
+    """Shared AsyncOpenAI client for the running event loop."""
+    loop_id = id(asyncio.get_running_loop())
+    with _lock:
+        client = _async_clients.get(loop_id)
+        if client is None:
+            from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+            transport = _TimedAsyncTransport(limits=pool_limits(), http2=http2_enabled())
+            client = AsyncOpenAI(http_client=DefaultAsyncHttpxClient(transport=transport))
+            _async_clients[loop_id] = client
+        return client
+
+
+def open_clients() -> None:
+    """Create the shared clients up front (call at runner start-up)."""
+    try:
+        asyncio.get_running_loop()
+        get_async_client()
+    except RuntimeError:
+        get_client()
+
+
+async def close_clients() -> None:
+    """Close every pooled client and log the transport timing summary."""
+    global _sync_client
+    with _lock:
+        sync_client, _sync_client = _sync_client, None
+        async_clients: List[Any] = list(_async_clients.values())
+        _async_clients.clear()
+    for client in async_clients:
+        try:
+            await client.close()
+        except RuntimeError:
+            # client bound to a loop that is already closed
+            pass
+    if sync_client is not None:
+        sync_client.close()
+    if _stats.requests:
+        logging.info(f"OpenAI transport: {_stats.summary()}")
@@ -0,0 +1,60 @@
+import os
+import re
+from typing import Dict, Iterable, Mapping, Sequence
+
+from .templates import load_template
+from .trace import span
+
+# Prompt packing: several items (scenarios, function schemas) in one request.
+# The template's instructions are rendered once with the item variable
+# pointing at the items, which follow as <item id="N"> blocks; the model
+# answers each item inside <result id="N">, and unpack_results() splits the
+# response back per item. Items missing from the response are reported by
+# the caller individually instead of failing the whole pack.
+#
+#   <STAGE>_PACK_SIZE      items per request, e.g. S2_PACK_SIZE / S3_PACK_SIZE (default: 1)
+
+_PACK_INSTRUCTIONS = (
+    "This request covers {count} independent items, listed below inside "
+    '<item id="..."> tags. Apply the instructions above to each item on its own. '
+    'Wrap everything you produce for an item in <result id="..."></result> with that '
+    "item's id, one <result> block per item, and never mix output across items."
+)
+
+_RESULT_RE = re.compile(
+    r"<result\s+id\s*=\s*[\"']?([\w-]+)[\"']?\s*>(.*?)</result\s*>", re.DOTALL | re.IGNORECASE
+)
+
+
+def pack_size(stage: str, default: int = 1) -> int:
+    """Items per request for a stage, from <STAGE>_PACK_SIZE."""
+    try:
+        return max(1, int(os.getenv(f"{stage.upper()}_PACK_SIZE", str(default))))
+    except ValueError:
+        return default
+
+
+def render_packed(
+    template_path: str,
+    variables: Mapping[str, object],
+    item_variable: str,
+    items: Sequence[str],
+) -> str:
+    """Render a one-item template for several items; item i gets id str(i + 1)."""
+    with span("render", template=template_path, items=len(items)):
+        variables = {**variables, item_variable: "(one per item, see the <item> blocks below)"}
+        instructions = load_template(template_path, variables).render(variables)
+        blocks = "\n".join(f'<item id="{i + 1}">\n{item}\n</item>' for i, item in enumerate(items))
+        return (
+            f"{instructions}\n\n{_PACK_INSTRUCTIONS.format(count=len(items))}\n\n{blocks}\n"
+        )
+
+
+def unpack_results(text: str, ids: Iterable[str]) -> Dict[str, str]:
+    """Per-item output of a packed response; ids the model skipped are absent."""
+    wanted = set(ids)
+    results: Dict[str, str] = {}
+    for item_id, body in _RESULT_RE.findall(text or ""):
+        if item_id in wanted and item_id not in results:
+            results[item_id] = body.strip()
+    return results
@@ -0,0 +1,195 @@
+import asyncio
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, Mapping, Optional
+
+# Shared requests/min + tokens/min limiter.
+# Budgets start from OPENAI_RPM / OPENAI_TPM (unset or 0 = unknown, admit
+# freely) and are then re-synced from the x-ratelimit-* headers of every
+# response, so concurrent runners can sit right at the account's quota.
+
+_RESET_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_UNIT_SECONDS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def parse_reset(value: Optional[str]) -> float:
+    """Parse x-ratelimit-reset-* durations like '1s', '6m0s', '20ms' to seconds."""
+    if not value:
+        return 0.0
+    total = 0.0
+    for amount, unit in _RESET_RE.findall(value):
+        total += float(amount) * _UNIT_SECONDS[unit]
+    if total == 0.0:
+        try:
+            return float(value)
+        except ValueError:
+            return 0.0
+    return total
+
+
+class TokenBucket:
+    """Per-minute budget refilled continuously; capacity 0 means unlimited."""
+
+    def __init__(self, capacity: float = 0.0):
+        self.capacity = float(capacity)
+        self.level = self.capacity
+        self.rate = self.capacity / 60.0
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        if self.capacity > 0:
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        self._refill(now)
+        if self.capacity <= 0:
+            return 0.0
+        # a single request larger than the whole bucket is admitted once full
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        if self.rate <= 0:
+            return 1.0
+        return (amount - self.level) / self.rate
+
+    def take(self, amount: float) -> None:
+        if self.capacity > 0:
+            self.level -= amount
+
+    def refund(self, amount: float) -> None:
+        if self.capacity > 0:
+            self.level = min(self.capacity, self.level + amount)
+
+    def sync(self, limit: Optional[float], remaining: float, reset_s: float, in_flight: float) -> None:
+        now = time.monotonic()
+        if limit:
+            self.capacity = float(limit)
+        if self.capacity <= 0:
+            return
+        # the server's view does not yet include requests still in flight
+        self.level = min(self.capacity, remaining - in_flight)
+        if reset_s > 0 and self.capacity > remaining:
+            self.rate = (self.capacity - remaining) / reset_s
+        else:
+            self.rate = self.capacity / 60.0
+        self.updated = now
+
+
+class RateLimiter:
+    """Admits a request only when both the request and token budgets allow it."""
+
+    def __init__(self, rpm: float = 0.0, tpm: float = 0.0):
+        self._lock = threading.Lock()
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self._in_flight_requests = 0
+        self._in_flight_tokens = 0.0
+        self.waited_s = 0.0
+
+    def _try_acquire(self, est_tokens: float) -> float:
+        with self._lock:
+            now = time.monotonic()
+            wait = max(
+                self.requests.wait_time(1, now),
+                self.tokens.wait_time(est_tokens, now),
+            )
+            if wait <= 0:
+                self.requests.take(1)
+                self.tokens.take(est_tokens)
+                self._in_flight_requests += 1
+                self._in_flight_tokens += est_tokens
+            return wait
+
+    async def acquire(self, est_tokens: float) -> None:
+        start = time.monotonic()
+        while True:
+            wait = self._try_acquire(est_tokens)
+            if wait <= 0:
+                break
+            await asyncio.sleep(min(wait, 1.0))
+        self.waited_s += time.monotonic() - start
+
+    def acquire_sync(self, est_tokens: float) -> None:
+        start = time.monotonic()
+        while True:
+            wait = self._try_acquire(est_tokens)
+            if wait <= 0:
+                break
+            time.sleep(min(wait, 1.0))
+        self.waited_s += time.monotonic() - start
+
+    def release(
+        self,
+        est_tokens: float,
+        headers: Optional[Mapping[str, str]] = None,
+        used_tokens: Optional[int] = None,
+    ) -> None:
+        """Settle a finished request: refund over-estimates and re-sync from headers."""
+        with self._lock:
+            self._in_flight_requests -= 1
+            self._in_flight_tokens -= est_tokens
+            if used_tokens is not None:
+                self.tokens.refund(est_tokens - used_tokens)
+            if not headers:
+                return
+            # a malformed header skips the re-sync; release runs in a finally
+            # and must not fail the request it settles
+            remaining_requests = _to_float(headers.get("x-ratelimit-remaining-requests"))
+            if remaining_requests is not None:
+                self.requests.sync(
+                    _to_float(headers.get("x-ratelimit-limit-requests")),
+                    remaining_requests,
+                    parse_reset(headers.get("x-ratelimit-reset-requests")),
+                    self._in_flight_requests,
+                )
+            remaining_tokens = _to_float(headers.get("x-ratelimit-remaining-tokens"))
+            if remaining_tokens is not None:
+                self.tokens.sync(
+                    _to_float(headers.get("x-ratelimit-limit-tokens")),
+                    remaining_tokens,
+                    parse_reset(headers.get("x-ratelimit-reset-tokens")),
+                    self._in_flight_tokens,
+                )
+
+
+def _to_float(value: Optional[str]) -> Optional[float]:
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def estimate_prompt_tokens(kwargs: Dict[str, Any]) -> int:
+    """Rough prompt size: ~4 chars/token."""
+    return sum(len(m.get("content") or "") for m in kwargs.get("messages", [])) // 4
+
+
+def estimate_tokens(kwargs: Dict[str, Any]) -> int:
+    """Rough token cost used for admission: the prompt estimate plus the completion cap."""
+    completion = kwargs.get("max_completion_tokens") or kwargs.get("max_tokens")
+    if completion is None:
+        try:
+            completion = int(os.getenv("OPENAI_EST_COMPLETION_TOKENS", "512"))
+        except ValueError:
+            completion = 512
+    return estimate_prompt_tokens(kwargs) + int(completion)
+
+
+_limiters: Dict[str, RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(model: str) -> RateLimiter:
+    """Process-wide limiter per model (OpenAI quotas are per model)."""
+    with _limiters_lock:
+        limiter = _limiters.get(model)
+        if limiter is None:
+            limiter = RateLimiter(
+                rpm=_to_float(os.getenv("OPENAI_RPM")) or 0.0,
+                tpm=_to_float(os.getenv("OPENAI_TPM")) or 0.0,
+            )
+            _limiters[model] = limiter
+        return limiter
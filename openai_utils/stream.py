@@ -0,0 +1,193 @@
+import os
+import re
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Callable, Deque, Dict, List, Optional, Sequence, Tuple
+
+from .tags import TagNode, parse_tags
+
+# Streaming completions with incremental tag parsing.
+# Deltas are fed into an IncrementalTagParser, which emits each record
+# (a <scenario>, a <function>, a <user_query>/<function_call> pair, a
+# multi-turn <query>/<function_call>/<tool> turn) as soon as its last tag
+# closes. Once the stage's target count or stop tag is reached the parser
+# reports done and the caller cancels the stream.
+
+Record = Dict[str, TagNode]
+
+
+class IncrementalTagParser:
+    """Assemble records from streamed text.
+
+    fields:     tags that make up one record, in order; the record closes with
+                the last one (same grouping rules as tags.group_records)
+    children:   extra tags parsed inside record elements (e.g. <signature>)
+    target:     stop after this many records
+    stop_tag:   stop once </stop_tag> is seen (e.g. </dialogue>)
+    """
+
+    def __init__(
+        self,
+        fields: Sequence[str],
+        children: Sequence[str] = (),
+        target: Optional[int] = None,
+        stop_tag: Optional[str] = None,
+        on_record: Optional[Callable[[Record], None]] = None,
+    ):
+        self.fields = tuple(f.lower() for f in fields)
+        self.tags = self.fields + tuple(c.lower() for c in children)
+        self.target = target
+        self.stop_tag = stop_tag.lower() if stop_tag else None
+        self.on_record = on_record
+        self.records: List[Record] = []
+        self.done = False
+        self.first_record_at: Optional[float] = None
+        self._parts: List[str] = []
+        self._buf = ""
+        self._pos = 0
+        closers = self.fields + ((self.stop_tag,) if self.stop_tag else ())
+        self._close_re = re.compile(
+            "</(" + "|".join(re.escape(t) for t in closers) + ")>", re.IGNORECASE
+        )
+        self._close_len = max(len(t) for t in closers) + 3
+        self._current: Optional[Record] = None
+
+    @property
+    def text(self) -> str:
+        return "".join(self._parts)
+
+    def feed(self, delta: str) -> List[Record]:
+        """Add streamed text; returns records completed by it."""
+        if self.done or not delta:
+            return []
+        self._parts.append(delta)
+        self._buf += delta
+        emitted: List[Record] = []
+        while not self.done:
+            m = self._close_re.search(self._buf, self._pos)
+            if m is None:
+                # a closing tag may straddle two deltas
+                self._pos = max(0, len(self._buf) - self._close_len)
+                break
+            if m.group(1).lower() == self.stop_tag:
+                self.done = True
+                break
+            for node in parse_tags(self._buf[: m.end()], self.tags):
+                record = self._add(node)
+                if record is not None:
+                    emitted.append(record)
+            self._buf = self._buf[m.end() :]
+            self._pos = 0
+        return emitted
+
+    def _add(self, node: TagNode) -> Optional[Record]:
+        if node.tag == self.fields[0]:
+            self._current = {node.tag: node}
+        elif self._current is not None and node.tag in self.fields and node.tag not in self._current:
+            self._current[node.tag] = node
+        else:
+            return None
+        if len(self._current) < len(self.fields):
+            return None
+        record, self._current = self._current, None
+        self.records.append(record)
+        if self.first_record_at is None:
+            self.first_record_at = time.perf_counter()
+        if self.on_record is not None:
+            self.on_record(record)
+        if self.target is not None and len(self.records) >= self.target:
+            self.done = True
+        return record
+
+
+@dataclass
+class StreamTiming:
+    """Seconds from request start to first token / first complete record."""
+
+    ttft: Optional[float]
+    ttfr: Optional[float]
+    records: int
+    cancelled: bool
+    completion_chars: int
+
+
+class StreamStats:
+    def __init__(self, keep_last: int = 10000):
+        self._lock = threading.Lock()
+        self.timings: Deque[StreamTiming] = deque(maxlen=keep_last)
+        self.streams = 0
+        self.cancelled = 0
+
+    def record(self, timing: StreamTiming) -> None:
+        with self._lock:
+            self.timings.append(timing)
+            self.streams += 1
+            if timing.cancelled:
+                self.cancelled += 1
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            ttfr = sorted(t.ttfr for t in self.timings if t.ttfr is not None)
+            ttft = sorted(t.ttft for t in self.timings if t.ttft is not None)
+        return {
+            "streams": self.streams,
+            "cancelled_early": self.cancelled,
+            "p50_ttft_s": ttft[len(ttft) // 2] if ttft else None,
+            "p50_ttfr_s": ttfr[len(ttfr) // 2] if ttfr else None,
+        }
+
+
+_stats = StreamStats()
+
+
+def stream_stats() -> StreamStats:
+    return _stats
+
+
+async def stream_completion(
+    client: Any, kwargs: Dict[str, Any], parser: IncrementalTagParser
+) -> Tuple[str, Any, Optional[int], bool]:
+    """Stream a chat completion through parser, cancelling once it is done.
+    Returns (content, response headers, usage if reported, whether the
+    stream was cancelled before the completion ended).
+    """
+    start = time.perf_counter()
+    ttft: Optional[float] = None
+    usage: Any = None
+    cancelled = False
+    raw = await client.chat.completions.with_raw_response.create(
+        **kwargs, stream=True, stream_options={"include_usage": True}
+    )
+    stream = raw.parse()
+    try:
+        async for chunk in stream:
+            if chunk.usage is not None:
+                usage = chunk.usage
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                if ttft is None:
+                    ttft = time.perf_counter() - start
+                parser.feed(delta)
+                if parser.done:
+                    cancelled = True
+                    break
+    finally:
+        await stream.close()
+    _stats.record(
+        StreamTiming(
+            ttft=ttft,
+            ttfr=parser.first_record_at - start if parser.first_record_at else None,
+            records=len(parser.records),
+            cancelled=cancelled,
+            completion_chars=len(parser.text),
+        )
+    )
+    return parser.text, raw.headers, usage, cancelled
+
+
+def stream_enabled() -> bool:
+    return os.getenv("OPENAI_STREAM", "0") == "1"
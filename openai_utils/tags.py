@@ -0,0 +1,80 @@
+import re
+from functools import lru_cache
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Sequence, Tuple
+
+# Single-pass tag tokenizer for model responses.
+# One precompiled pattern per tag set matches every element of interest in a
+# single scan, in document order; element bodies that contain further markup
+# are parsed the same way to build the nesting. Unclosed tags are skipped
+# (their inner elements are still found), as with the old per-tag regex.
+
+
+class TagNode(NamedTuple):
+    tag: str
+    content: str
+    children: Tuple["TagNode", ...]
+
+    def find(self, tag: str) -> List["TagNode"]:
+        """Direct children with the given tag, in document order."""
+        return [c for c in self.children if c.tag == tag]
+
+    def first(self, tag: str) -> str | None:
+        for c in self.children:
+            if c.tag == tag:
+                return c.content
+        return None
+
+
+@lru_cache(maxsize=64)
+def _element_pattern(tags: Tuple[str, ...]) -> re.Pattern:
+    names = "|".join(re.escape(t) for t in tags)
+    # body is an unrolled "anything up to the matching close tag" loop,
+    # which avoids retrying the backreference at every character
+    return re.compile(rf"<({names})>([^<]*(?:<(?!/\1>)[^<]*)*)</\1>", re.IGNORECASE)
+
+
+_new_node = tuple.__new__
+_NO_CHILDREN: Tuple[TagNode, ...] = ()
+
+
+def _parse(pattern: re.Pattern, text: str) -> Tuple[TagNode, ...]:
+    return tuple(
+        _new_node(
+            TagNode,
+            (tag.lower(), raw.strip(), _parse(pattern, raw) if "<" in raw else _NO_CHILDREN),
+        )
+        for tag, raw in pattern.findall(text)
+    )
+
+
+def parse_tags(text: str, tags: Iterable[str]) -> Tuple[TagNode, ...]:
+    """Parse the given tags out of text; returns top-level nodes in document order."""
+    key = tuple(sorted({t.lower() for t in tags}))
+    return _parse(_element_pattern(key), text or "")
+
+
+def iter_nodes(nodes: Sequence[TagNode]) -> Iterator[TagNode]:
+    """Depth-first walk in document order."""
+    for node in nodes:
+        yield node
+        yield from iter_nodes(node.children)
+
+
+def group_records(nodes: Sequence[TagNode], fields: Sequence[str]) -> List[Dict[str, str]]:
+    """Group sibling nodes into records that start at fields[0].
+
+    Only complete records (every field present) are returned, so a missing
+    tag drops its own record instead of shifting every later pair.
+    """
+    records: List[Dict[str, str]] = []
+    current: Dict[str, str] | None = None
+    for node in nodes:
+        if node.tag == fields[0]:
+            if current is not None and len(current) == len(fields):
+                records.append(current)
+            current = {node.tag: node.content}
+        elif current is not None and node.tag in fields and node.tag not in current:
+            current[node.tag] = node.content
+    if current is not None and len(current) == len(fields):
+        records.append(current)
+    return records
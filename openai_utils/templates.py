@@ -0,0 +1,127 @@
+import os
+import re
+import threading
+from typing import Dict, FrozenSet, Iterable, List, Mapping, Optional, Sequence, Tuple, Union
+
+# Compiled prompt templates.
+# A prompt.md file is read once and split into literal text and {{var}}
+# placeholders; rendering is then a single join. Compiled templates are
+# reused until the file's mtime changes. Callers declare the variables they
+# supply when loading a template, and a template whose placeholders differ
+# from them raises ValueError there, before anything is rendered.
+#
+# render_split() moves per-request variables behind the static instructions
+# so that requests share a long identical prefix, which is what provider-side
+# prompt caching keys on.
+#
+#   OPENAI_PREFIX_LAYOUT=1   use the static-first layout in the runners
+
+_PLACEHOLDER_RE = re.compile(r"\{\{(\w+)\}\}")
+
+# Segment: literal text (str) or a placeholder name (1-tuple)
+Segment = Union[str, Tuple[str]]
+
+
+class CompiledTemplate:
+    def __init__(self, path: str, source: str, mtime_ns: int = 0):
+        self.path = path
+        self.source = source
+        self.mtime_ns = mtime_ns
+        self.segments: List[Segment] = []
+        pos = 0
+        for m in _PLACEHOLDER_RE.finditer(source):
+            if m.start() > pos:
+                self.segments.append(source[pos : m.start()])
+            self.segments.append((m.group(1),))
+            pos = m.end()
+        if pos < len(source):
+            self.segments.append(source[pos:])
+        self.variables: FrozenSet[str] = frozenset(
+            seg[0] for seg in self.segments if isinstance(seg, tuple)
+        )
+        self._checked: set = set()
+
+    def check(self, names: Iterable[str]) -> Tuple[FrozenSet[str], FrozenSet[str]]:
+        """Return (missing, unknown) variable names for a set of render inputs."""
+        names = frozenset(names)
+        return self.variables - names, names - self.variables
+
+    def require(self, names: Iterable[str]) -> None:
+        """Raise ValueError unless names are exactly the template's variables."""
+        names = frozenset(names)
+        # each distinct variable set is checked once per compile
+        if names in self._checked:
+            return
+        missing, unknown = self.check(names)
+        if missing or unknown:
+            raise ValueError(
+                f"Template {self.path}: missing variables {sorted(missing)}, "
+                f"unknown variables {sorted(unknown)}"
+            )
+        self._checked.add(names)
+
+    def render(self, variables: Mapping[str, object]) -> str:
+        parts = []
+        for seg in self.segments:
+            if isinstance(seg, tuple):
+                name = seg[0]
+                # missing variables keep their placeholder, as before
+                parts.append(str(variables[name]) if name in variables else "{{" + name + "}}")
+            else:
+                parts.append(seg)
+        return "".join(parts)
+
+    def render_split(
+        self, variables: Mapping[str, object], trailing: Sequence[str]
+    ) -> Tuple[str, str]:
+        """Render with the `trailing` variables taken out of the text.
+
+        Returns (static prefix, variable suffix). Each trailing placeholder
+        (and a <tag>...</tag> wrapper holding nothing else, e.g. <functions>
+        around {{function_schemas}}) is replaced by a pointer to a block in
+        the suffix, named after the wrapper's tag or else the variable.
+        """
+        trailing = [name for name in trailing if name in self.variables and name in variables]
+        marked = dict(variables)
+        for name in trailing:
+            marked[name] = f"\x00{name}\x00"
+        prefix = self.render(marked)
+        blocks = []
+        for name in trailing:
+            marker = f"\x00{name}\x00"
+            wrapper = re.search(rf"<(\w+)>\s*{marker}\s*</\1>", prefix)
+            tag = wrapper.group(1) if wrapper else name
+            pointer = f"(the <{tag}> block at the end of this prompt)"
+            prefix = re.sub(rf"<{tag}>\s*{marker}\s*</{tag}>|{marker}", lambda _m: pointer, prefix)
+            blocks.append(f"<{tag}>\n{variables[name]}\n</{tag}>")
+        return prefix, "\n\n".join(blocks)
+
+
+_templates: Dict[str, CompiledTemplate] = {}
+_templates_lock = threading.Lock()
+
+
+def prefix_layout_enabled() -> bool:
+    return os.getenv("OPENAI_PREFIX_LAYOUT", "0") == "1"
+
+
+def load_template(
+    template_path: str, variables: Optional[Iterable[str]] = None
+) -> CompiledTemplate:
+    """Compiled template for a path, recompiled when the file changes on disk.
+
+    With `variables`, the names the caller will render with, raises
+    ValueError if the template's placeholders are not exactly those.
+    """
+    key = os.path.abspath(template_path)
+    mtime_ns = os.stat(key).st_mtime_ns
+    tpl = _templates.get(key)
+    if tpl is None or tpl.mtime_ns != mtime_ns:
+        with open(key, "r", encoding="utf-8") as f:
+            source = f.read()
+        tpl = CompiledTemplate(template_path, source, mtime_ns)
+        with _templates_lock:
+            _templates[key] = tpl
+    if variables is not None:
+        tpl.require(variables)
+    return tpl
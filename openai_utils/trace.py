@@ -0,0 +1,191 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# Span tracing in Chrome trace-event format (load in chrome://tracing or
+# https://ui.perfetto.dev).
+# span("render") / span("request") / ... record complete ("X") events; spans
+# opened inside asyncio tasks are laid out on one lane per task so that
+# concurrent requests do not appear to nest. While tracing, a probe task
+# samples event-loop lag as a counter track. Disabled, span() returns a
+# shared no-op context manager and nothing is recorded. Worker processes
+# hand their events back with export_events(); the parent adds them to its
+# trace with merge_events(), one process track per worker.
+#
+#   PIPELINE_TRACE=1              record spans; each runner writes trace_<name>.json
+#                                 into its run directory
+#   PIPELINE_TRACE_LAG_MS         loop-lag probe interval (default: 50)
+
+_enabled = os.getenv("PIPELINE_TRACE", "0") == "1"
+_NULL = nullcontext()
+_events: List[Dict[str, Any]] = []
+_lock = threading.Lock()
+# lane (trace "tid") per asyncio task or thread, by id, with its display name
+_lanes: Dict[int, int] = {}
+_lane_names: Dict[int, str] = {}
+# metadata (process and lane names) of merged worker events
+_merged_meta: Dict[Tuple[Any, ...], Dict[str, Any]] = {}
+_path: Optional[str] = None
+_probe: Optional["asyncio.Task[None]"] = None
+_pid = os.getpid()
+_t0 = time.perf_counter()
+
+
+def tracing_enabled() -> bool:
+    return _enabled
+
+
+def _reset_in_child() -> None:
+    # a forked worker starts with its own pid and none of the parent's events
+    global _pid
+    _pid = os.getpid()
+    _events.clear()
+    _lanes.clear()
+    _lane_names.clear()
+    _merged_meta.clear()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_in_child)
+
+
+def _now_us() -> float:
+    return (time.perf_counter() - _t0) * 1e6
+
+
+def _lane() -> int:
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        task = None
+    owner = id(task) if task is not None else threading.get_ident()
+    lane = _lanes.get(owner)
+    if lane is None:
+        with _lock:
+            lane = _lanes.setdefault(owner, len(_lanes) + 1)
+            _lane_names[lane] = task.get_name() if task is not None else threading.current_thread().name
+    return lane
+
+
+@contextmanager
+def _span(name: str, cat: str, args: Dict[str, Any]) -> Iterator[None]:
+    lane = _lane()
+    start = _now_us()
+    try:
+        yield
+    finally:
+        event = {
+            "name": name,
+            "cat": cat,
+            "ph": "X",
+            "ts": start,
+            "dur": _now_us() - start,
+            "pid": _pid,
+            "tid": lane,
+        }
+        if args:
+            event["args"] = args
+        _events.append(event)
+
+
+def span(name: str, cat: str = "", **args: Any):
+    """Context manager timing one phase (render, request, parse, write, ...)."""
+    if not _enabled:
+        return _NULL
+    return _span(name, cat or name, args)
+
+
+def counter(name: str, **values: float) -> None:
+    if _enabled:
+        _events.append({"name": name, "ph": "C", "ts": _now_us(), "pid": _pid, "args": values})
+
+
+def export_events() -> List[Dict[str, Any]]:
+    """Take the events recorded so far, with absolute timestamps, for
+    merge_events() in another process."""
+    if not _enabled:
+        return []
+    offset = _t0 * 1e6
+    with _lock:
+        events = [dict(event, ts=event["ts"] + offset) for event in _events]
+        _events.clear()
+        names = [
+            {"name": "thread_name", "ph": "M", "pid": _pid, "tid": lane, "args": {"name": label}}
+            for lane, label in _lane_names.items()
+        ]
+    return names + events
+
+
+def merge_events(events: List[Dict[str, Any]], process: str = "worker") -> None:
+    """Add events exported by another process to this trace."""
+    if not _enabled or not events:
+        return
+    offset = _t0 * 1e6
+    with _lock:
+        for event in events:
+            pid = event["pid"]
+            if ("process_name", pid) not in _merged_meta:
+                _merged_meta[("process_name", pid)] = {
+                    "name": "process_name", "ph": "M", "pid": pid, "args": {"name": f"{process} {pid}"}
+                }
+            if event["ph"] == "M":
+                _merged_meta[(event["name"], pid, event.get("tid"))] = event
+            else:
+                _events.append(dict(event, ts=event["ts"] - offset))
+
+
+async def _loop_lag_probe(interval: float) -> None:
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lag_ms = max(0.0, (time.perf_counter() - start - interval) * 1000)
+        counter("event_loop_lag", lag_ms=round(lag_ms, 3))
+
+
+def start_tracing(path: str) -> None:
+    """Trace into path (no-op unless PIPELINE_TRACE=1). Starts the loop-lag
+    probe when called from inside a running event loop."""
+    global _path, _probe
+    if not _enabled:
+        return
+    _path = path
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return
+    try:
+        interval = float(os.getenv("PIPELINE_TRACE_LAG_MS", "50")) / 1000
+    except ValueError:
+        interval = 0.05
+    _probe = loop.create_task(_loop_lag_probe(interval), name="trace-loop-lag")
+
+
+def stop_tracing() -> None:
+    """Stop the probe and write the collected events."""
+    global _path, _probe
+    if _probe is not None:
+        _probe.cancel()
+        _probe = None
+    if not _enabled or _path is None:
+        return
+    path, _path = _path, None
+    dirname = os.path.dirname(path)
+    if dirname:
+        os.makedirs(dirname, exist_ok=True)
+    with _lock:
+        events = list(_events)
+        _events.clear()
+        names = [
+            {"name": "thread_name", "ph": "M", "pid": _pid, "tid": lane, "args": {"name": label}}
+            for lane, label in _lane_names.items()
+        ]
+        names += _merged_meta.values()
+        _merged_meta.clear()
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"traceEvents": names + events, "displayTimeUnit": "ms"}, f)
+    logging.info(f"Trace with {len(events)} events written to {path}")
@@ -0,0 +1,286 @@
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, Iterator, List, Optional, TextIO, Tuple
+
+# Per-stage token and cost ledger.
+# Every completed request is recorded with its model, stage, generator,
+# latency and token usage (prompt, cached prompt, completion). Stage and
+# generator come from a context variable set around a stage's requests
+# (usage_stage()), so the tasks spawned inside inherit them without
+# threading them through every call. The runners also report how many
+# records each generator produced, which gives the yield metric:
+# records per 1k tokens. Streams cancelled before their final chunk report
+# no usage; those calls are recorded with estimated tokens and counted as
+# estimated_requests.
+#
+# With a run directory open (open_usage_ledger()), each call is appended to
+# <run_dir>/usage_ledger.jsonl and close_usage_ledger() merges this
+# process's totals into <run_dir>/usage_summary.json.
+#
+#   OPENAI_PRICE_INPUT_PER_1M          USD per 1M prompt tokens   (default: table below, by model)
+#   OPENAI_PRICE_CACHED_INPUT_PER_1M   USD per 1M cached tokens
+#   OPENAI_PRICE_OUTPUT_PER_1M         USD per 1M completion tokens
+# Batch API calls are billed at half price.
+
+# (input, cached input, output) USD per 1M tokens
+_PRICES: Dict[str, Tuple[float, float, float]] = {
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+    "gpt-4o": (2.50, 1.25, 10.00),
+    "gpt-4.1-mini": (0.40, 0.10, 1.60),
+    "gpt-4.1": (2.00, 0.50, 8.00),
+}
+
+_scope: ContextVar[Tuple[str, str]] = ContextVar("openai_usage_scope", default=("other", ""))
+
+
+@contextmanager
+def usage_stage(stage: Optional[str] = None, generator: Optional[str] = None) -> Iterator[None]:
+    """Attribute requests made inside the block to stage (and generator)."""
+    current_stage, current_generator = _scope.get()
+    token = _scope.set(
+        (stage or current_stage, generator if generator is not None else current_generator)
+    )
+    try:
+        yield
+    finally:
+        _scope.reset(token)
+
+
+def current_stage() -> str:
+    return _scope.get()[0]
+
+
+def usage_fields(usage: Any) -> Tuple[int, int, int]:
+    """(prompt, cached prompt, completion) tokens from an SDK usage object or
+    a raw usage dict (Batch API output); missing fields count as 0."""
+    if usage is None:
+        return 0, 0, 0
+    if isinstance(usage, dict):
+        details = usage.get("prompt_tokens_details") or {}
+        cached = details.get("cached_tokens") or 0
+        return usage.get("prompt_tokens") or 0, cached, usage.get("completion_tokens") or 0
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = getattr(details, "cached_tokens", None) or 0
+    return (
+        getattr(usage, "prompt_tokens", None) or 0,
+        cached,
+        getattr(usage, "completion_tokens", None) or 0,
+    )
+
+
+def _env_price(key: str) -> Optional[float]:
+    value = os.getenv(key)
+    if value:
+        try:
+            return float(value)
+        except ValueError:
+            pass
+    return None
+
+
+def _prices(model: str) -> Optional[Tuple[float, float, float]]:
+    # longest matching prefix, so "gpt-4o-mini-2024-07-18" is priced as gpt-4o-mini
+    base = next(
+        (_PRICES[name] for name in sorted(_PRICES, key=len, reverse=True) if model.startswith(name)),
+        None,
+    )
+    input_price = _env_price("OPENAI_PRICE_INPUT_PER_1M")
+    if base is None:
+        if input_price is None:
+            return None
+        base = (input_price, input_price, 0.0)
+    cached_price = _env_price("OPENAI_PRICE_CACHED_INPUT_PER_1M")
+    output_price = _env_price("OPENAI_PRICE_OUTPUT_PER_1M")
+    return (
+        input_price if input_price is not None else base[0],
+        cached_price if cached_price is not None else base[1],
+        output_price if output_price is not None else base[2],
+    )
+
+
+def call_cost(model: str, prompt: int, cached: int, completion: int, batch: bool = False) -> Optional[float]:
+    """USD cost of one call, or None for an unpriced model."""
+    prices = _prices(model)
+    if prices is None:
+        return None
+    input_price, cached_price, output_price = prices
+    cost = ((prompt - cached) * input_price + cached * cached_price + completion * output_price) / 1e6
+    return cost / 2 if batch else cost
+
+
+@dataclass
+class CallRecord:
+    stage: str
+    generator: str
+    model: str
+    prompt_tokens: int
+    cached_tokens: int
+    completion_tokens: int
+    latency_s: Optional[float]
+    cost_usd: Optional[float]
+    batch: bool
+    ts: float
+    estimated: bool = False
+
+
+@dataclass
+class StageUsage:
+    requests: int = 0
+    prompt_tokens: int = 0
+    cached_tokens: int = 0
+    completion_tokens: int = 0
+    cost_usd: float = 0.0
+    unpriced_requests: int = 0
+    estimated_requests: int = 0
+    records: int = 0
+    latencies: List[float] = field(default_factory=list)
+    models: Dict[str, int] = field(default_factory=dict)
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    @property
+    def cache_hit_rate(self) -> Optional[float]:
+        """Share of prompt tokens served from the provider's prompt cache."""
+        return self.cached_tokens / self.prompt_tokens if self.prompt_tokens else None
+
+    def add(self, call: CallRecord) -> None:
+        self.requests += 1
+        self.prompt_tokens += call.prompt_tokens
+        self.cached_tokens += call.cached_tokens
+        self.completion_tokens += call.completion_tokens
+        if call.cost_usd is None:
+            self.unpriced_requests += 1
+        else:
+            self.cost_usd += call.cost_usd
+        if call.estimated:
+            self.estimated_requests += 1
+        if call.latency_s is not None:
+            self.latencies.append(call.latency_s)
+        self.models[call.model] = self.models.get(call.model, 0) + 1
+
+    def summary(self) -> Dict[str, Any]:
+        lat = sorted(self.latencies)
+        total = self.total_tokens
+        return {
+            "requests": self.requests,
+            "prompt_tokens": self.prompt_tokens,
+            "cached_tokens": self.cached_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cache_hit_rate": round(self.cache_hit_rate, 4) if self.cache_hit_rate is not None else None,
+            "cost_usd": round(self.cost_usd, 6),
+            "unpriced_requests": self.unpriced_requests,
+            "estimated_requests": self.estimated_requests,
+            "records": self.records,
+            "records_per_1k_tokens": round(self.records * 1000 / total, 4) if total else None,
+            "usd_per_1k_records": round(self.cost_usd * 1000 / self.records, 6) if self.records else None,
+            "p50_latency_s": round(lat[len(lat) // 2], 4) if lat else None,
+            "p99_latency_s": round(lat[min(len(lat) - 1, int(len(lat) * 0.99))], 4) if lat else None,
+            "models": dict(self.models),
+        }
+
+
+class UsageStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        # keyed by "S3" and, per generator, "S3/simple"
+        self.stages: Dict[str, StageUsage] = {}
+        self._ledger: Optional[TextIO] = None
+        self._run_dir: Optional[str] = None
+
+    def _entries(self, stage: str, generator: str) -> List[StageUsage]:
+        keys = [stage] + ([f"{stage}/{generator}"] if generator else [])
+        return [self.stages.setdefault(key, StageUsage()) for key in keys]
+
+    def record(
+        self,
+        usage: Any,
+        model: str = "",
+        latency_s: Optional[float] = None,
+        batch: bool = False,
+        estimated: bool = False,
+    ) -> None:
+        stage, generator = _scope.get()
+        prompt, cached, completion = usage_fields(usage)
+        call = CallRecord(
+            stage=stage,
+            generator=generator,
+            model=model,
+            prompt_tokens=prompt,
+            cached_tokens=cached,
+            completion_tokens=completion,
+            latency_s=round(latency_s, 4) if latency_s is not None else None,
+            cost_usd=call_cost(model, prompt, cached, completion, batch),
+            batch=batch,
+            ts=round(time.time(), 3),
+            estimated=estimated,
+        )
+        with self._lock:
+            for entry in self._entries(stage, generator):
+                entry.add(call)
+            if self._ledger is not None:
+                self._ledger.write(json.dumps(asdict(call)) + "\n")
+
+    def add_records(self, count: int) -> None:
+        """Count records produced by the current stage/generator."""
+        stage, generator = _scope.get()
+        with self._lock:
+            for entry in self._entries(stage, generator):
+                entry.records += count
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {key: entry.summary() for key, entry in self.stages.items()}
+
+    def open_ledger(self, run_dir: str) -> None:
+        os.makedirs(run_dir, exist_ok=True)
+        with self._lock:
+            self._run_dir = run_dir
+            self._ledger = open(os.path.join(run_dir, "usage_ledger.jsonl"), "a", encoding="utf-8")
+
+    def close_ledger(self) -> None:
+        with self._lock:
+            ledger, run_dir = self._ledger, self._run_dir
+            self._ledger = self._run_dir = None
+        if ledger is not None:
+            ledger.close()
+        if run_dir is None or not self.stages:
+            return
+        # each runner is its own process: merge this one's stages into the file
+        path = os.path.join(run_dir, "usage_summary.json")
+        merged: Dict[str, Any] = {}
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    merged = json.load(f)
+            except (OSError, json.JSONDecodeError):
+                logging.warning(f"Could not read {path}; rewriting it")
+        merged.update(self.summary())
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(merged, f, indent=2)
+        os.replace(tmp_path, path)
+        logging.info(f"Usage summary written to {path}")
+
+
+_stats = UsageStats()
+
+
+def usage_stats() -> UsageStats:
+    return _stats
+
+
+def open_usage_ledger(run_dir: str) -> None:
+    """Log every call under run_dir and write usage_summary.json on close."""
+    _stats.open_ledger(run_dir)
+
+
+def close_usage_ledger() -> None:
+    _stats.close_ledger()
@@ -1,3 +1,18 @@
-from .s1_scenario import Scenario
-from .s2_functions import Functions
-from .s3_queries import SimpleQuery, ParallelQuery, MultiTurnQuery
+import importlib
+
+# Task classes are resolved lazily so that lightweight helpers in this package
+# (journal, parser, ...) can be imported by the OpenAI-only runners without
+# pulling in the Dria SDK.
+_LAZY = {
+    "Scenario": ".s1_scenario",
+    "Functions": ".s2_functions",
+    "SimpleQuery": ".s3_queries",
+    "ParallelQuery": ".s3_queries",
+    "MultiTurnQuery": ".s3_queries",
+}
+
+
+def __getattr__(name):
+    if name in _LAZY:
+        return getattr(importlib.import_module(_LAZY[name], __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,272 @@
+import codecs
+import json
+import logging
+import mmap
+import os
+import queue
+import threading
+from typing import Any, Iterable, Iterator, Optional
+
+from openai_utils import span
+
+# Stage artifacts (scenarios, functions, *_queries) as JSON arrays or JSONL.
+# Records are serialized and written by a background thread through a
+# buffered file, so the event loop only enqueues and the full list is never
+# dumped in one go. Readers accept either format, whichever file exists, and
+# decode lazily from a memory-mapped file.
+#
+#   PIPELINE_OUTPUT_FORMAT=jsonl   write <name>.jsonl instead of <name>.json
+#   PIPELINE_WRITE_BUFFER_KB       writer file buffer (default: 1024)
+
+FORMATS = ("json", "jsonl")
+_STOP = object()
+
+
+def output_format() -> str:
+    fmt = os.getenv("PIPELINE_OUTPUT_FORMAT", "json").lower()
+    if fmt not in FORMATS:
+        logging.warning(f"Unknown PIPELINE_OUTPUT_FORMAT={fmt!r}, using json")
+        return "json"
+    return fmt
+
+
+def format_of(path: str) -> str:
+    return "jsonl" if path.endswith(".jsonl") else "json"
+
+
+def output_path(run_dir: str, name: str) -> str:
+    """Where a stage writes artifact `name` in the configured format."""
+    return os.path.join(run_dir, f"{name}.{output_format()}")
+
+
+def artifact_path(run_dir: str, name: str) -> str:
+    """Existing file for artifact `name`, preferring the configured format."""
+    preferred = output_format()
+    for fmt in (preferred,) + tuple(f for f in FORMATS if f != preferred):
+        path = os.path.join(run_dir, f"{name}.{fmt}")
+        if os.path.exists(path):
+            return path
+    raise FileNotFoundError(f"No {name}.json or {name}.jsonl in {run_dir}")
+
+
+_RELEASE_EVERY = 16 << 20
+
+
+def _release(mm: mmap.mmap, upto: int) -> None:
+    # Mapped pages that were already decoded still count towards RSS; drop
+    # them (they are re-read from the page cache if ever touched again).
+    if hasattr(mm, "madvise") and hasattr(mmap, "MADV_DONTNEED"):
+        upto -= upto % mmap.PAGESIZE
+        if upto > 0:
+            mm.madvise(mmap.MADV_DONTNEED, 0, upto)
+
+
+def _iter_jsonl(mm: mmap.mmap) -> Iterator[Any]:
+    released = 0
+    for line in iter(mm.readline, b""):
+        if line.strip():
+            yield json.loads(line)
+        if mm.tell() - released >= _RELEASE_EVERY:
+            released = mm.tell()
+            _release(mm, released)
+
+
+def _iter_json_array(mm: mmap.mmap, chunk_size: int) -> Iterator[Any]:
+    # Decode one element at a time from a sliding window over the mapped
+    # file; the window only ever holds the current element plus one chunk.
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder("utf-8")()
+    buf = ""
+    pos = 0
+    offset = 0
+    eof = False
+    started = False
+
+    def fill() -> None:
+        nonlocal buf, pos, offset, eof
+        data = mm[offset : offset + chunk_size]
+        _release(mm, offset)
+        offset += len(data)
+        eof = offset >= len(mm)
+        buf = buf[pos:] + text_decoder.decode(data, final=eof)
+        pos = 0
+
+    fill()
+    while True:
+        while True:
+            while pos < len(buf) and (buf[pos].isspace() or (started and buf[pos] == ",")):
+                pos += 1
+            if pos < len(buf) or eof:
+                break
+            fill()
+        if pos >= len(buf):
+            raise ValueError("unterminated JSON array")
+        if not started:
+            if buf[pos] != "[":
+                raise ValueError("expected a JSON array")
+            started = True
+            pos += 1
+            continue
+        if buf[pos] == "]":
+            return
+        try:
+            record, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            fill()
+            continue
+        if end == len(buf) and not eof:
+            # a bare number/literal may continue in the next chunk
+            fill()
+            continue
+        pos = end
+        yield record
+
+
+def iter_records(path: str, chunk_size: int = 1 << 20, fmt: Optional[str] = None) -> Iterator[Any]:
+    """Lazily yield records from a JSON array or JSONL file (format from the
+    extension unless fmt is given).
+
+    The file is memory-mapped and decoded one record at a time, so memory use
+    does not grow with the artifact and the first record is available at once.
+    """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if (fmt or format_of(path)) == "jsonl":
+                yield from _iter_jsonl(mm)
+            else:
+                yield from _iter_json_array(mm, chunk_size)
+
+
+class Encoded(str):
+    """A record already serialized with json.dumps (e.g. by a worker
+    process); written as is."""
+
+
+class RecordWriter:
+    """Write records to a JSON array or JSONL file from a background thread.
+
+    write() only enqueues (waiting if the writer is far behind); the thread
+    encodes, writes through a buffered file and flushes whenever it catches
+    up with the queue. close() drains the queue, finishes the array (JSON)
+    and optionally fsyncs. A new file is written next to path and moved into
+    place on a clean close, so readers never see a half-written artifact.
+    """
+
+    def __init__(self, path: str, fmt: Optional[str] = None, append: bool = False, sync: bool = False):
+        self.path = path
+        self.fmt = fmt or format_of(path)
+        self.sync = sync
+        self.count = 0
+        if append and self.fmt != "jsonl":
+            raise ValueError("only JSONL artifacts can be appended to")
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        try:
+            buffering = int(os.getenv("PIPELINE_WRITE_BUFFER_KB", "1024")) * 1024
+        except ValueError:
+            buffering = 1024 * 1024
+        self._tmp_path = None if append else path + ".tmp"
+        self._fp = open(
+            path if append else self._tmp_path,
+            "a" if append else "w",
+            encoding="utf-8",
+            buffering=buffering,
+        )
+        # bounded, so a fast producer waits for the disk instead of queueing
+        # the whole artifact in memory
+        self._queue: "queue.Queue[Any]" = queue.Queue(maxsize=10000)
+        self._error: Optional[BaseException] = None
+        self._closed = False
+        self._thread = threading.Thread(
+            target=self._run, name=f"writer:{os.path.basename(path)}", daemon=True
+        )
+        self._thread.start()
+
+    def write(self, record: Any) -> None:
+        if self._error is not None:
+            raise self._error
+        self._queue.put(record)
+
+    def write_many(self, records: Iterable[Any]) -> None:
+        for record in records:
+            self.write(record)
+
+    def _encode(self, record: Any) -> str:
+        if isinstance(record, Encoded):
+            if self.fmt == "jsonl":
+                return record + "\n"
+            return ("[\n  " if self.count == 0 else ",\n  ") + record
+        if self.fmt == "jsonl":
+            return json.dumps(record, ensure_ascii=False) + "\n"
+        # same layout as json.dumps(records, indent=2), one element at a time
+        body = json.dumps(record, ensure_ascii=False, indent=2).replace("\n", "\n  ")
+        return ("[\n  " if self.count == 0 else ",\n  ") + body
+
+    def flush(self) -> None:
+        """Block until everything written so far is on disk (in the OS cache)."""
+        done = threading.Event()
+        self._queue.put(done)
+        while not done.wait(0.1):
+            if not self._thread.is_alive():
+                break
+        if self._error is not None:
+            raise self._error
+
+    def _run(self) -> None:
+        try:
+            while True:
+                record = self._queue.get()
+                if record is _STOP:
+                    return
+                if isinstance(record, threading.Event):
+                    self._fp.flush()
+                    record.set()
+                    continue
+                self._fp.write(self._encode(record))
+                self.count += 1
+                if self._queue.empty():
+                    self._fp.flush()
+        except BaseException as e:
+            self._error = e
+
+    def close(self, commit: bool = True) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        with span("write_drain", cat="write", path=self.path):
+            self._queue.put(_STOP)
+            self._thread.join()
+            try:
+                if self.fmt == "json" and self._error is None:
+                    self._fp.write("[]" if self.count == 0 else "\n]")
+                self._fp.flush()
+                if self.sync:
+                    os.fsync(self._fp.fileno())
+            finally:
+                self._fp.close()
+        if self._error is not None:
+            raise self._error
+        if self._tmp_path is not None:
+            if commit:
+                os.replace(self._tmp_path, self.path)
+            else:
+                os.remove(self._tmp_path)
+
+    def __enter__(self) -> "RecordWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        # an interrupted stage leaves the previous artifact in place
+        self.close(commit=exc_type is None)
+
+
+def write_records(path: str, records: Iterable[Any]) -> int:
+    """Stream records into path (format from its extension); returns the count."""
+    with span("write", path=path), RecordWriter(path) as writer:
+        writer.write_many(records)
+    return writer.count
@@ -0,0 +1,123 @@
+import math
+import os
+from typing import Iterator, List, Optional, Set
+
+import numpy as np
+
+# Membership sets for fixed-size (16-byte) hash keys with bounded memory.
+# BloomFilter has a fixed size; filters of the same geometry are merged with
+# a bitwise OR, and are saved to and loaded from compressed .npz files.
+# ScalableBloomFilter chains Bloom filters, each twice the capacity and half
+# the false-positive rate of the previous one, so the overall rate stays
+# below error_rate however many keys are added. KeySet checks the scalable
+# filter first and confirms its hits against the exact keys while it holds
+# at most exact_limit of them; past that only the filter is kept.
+
+
+class BloomFilter:
+    def __init__(
+        self, capacity: int, error_rate: float, bits: Optional[bytearray] = None, count: int = 0
+    ):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bits if bits is not None else bytearray((self.size + 7) // 8)
+        self.count = count
+
+    def _positions(self, key: bytes) -> Iterator[int]:
+        # double hashing over the two halves of the key
+        h1 = int.from_bytes(key[:8], "little")
+        h2 = int.from_bytes(key[8:16], "little") | 1
+        size = self.size
+        for i in range(self.hashes):
+            yield (h1 + i * h2) % size
+
+    def __contains__(self, key: bytes) -> bool:
+        bits = self.bits
+        return all(bits[p >> 3] & (1 << (p & 7)) for p in self._positions(key))
+
+    def add(self, key: bytes) -> None:
+        bits = self.bits
+        for p in self._positions(key):
+            bits[p >> 3] |= 1 << (p & 7)
+        self.count += 1
+
+    def union(self, other: "BloomFilter") -> None:
+        """Add every key of a filter with the same geometry."""
+        if (other.size, other.hashes) != (self.size, self.hashes):
+            raise ValueError("Bloom filters differ in size or hash count")
+        merged = np.bitwise_or(
+            np.frombuffer(self.bits, dtype=np.uint8), np.frombuffer(other.bits, dtype=np.uint8)
+        )
+        self.bits = bytearray(merged.tobytes())
+        self.count += other.count
+
+    def save(self, path: str, **extra) -> None:
+        with open(path + ".tmp", "wb") as fp:
+            np.savez_compressed(
+                fp,
+                capacity=np.int64(self.capacity),
+                error_rate=np.float64(self.error_rate),
+                count=np.int64(self.count),
+                bits=np.frombuffer(self.bits, dtype=np.uint8),
+                **extra,
+            )
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, path: str) -> "BloomFilter":
+        with np.load(path) as data:
+            return cls(
+                int(data["capacity"]),
+                float(data["error_rate"]),
+                bits=bytearray(data["bits"].tobytes()),
+                count=int(data["count"]),
+            )
+
+
+class ScalableBloomFilter:
+    def __init__(self, initial_capacity: int = 1 << 20, error_rate: float = 1e-4):
+        self.initial_capacity = initial_capacity
+        self.error_rate = error_rate
+        self.filters: List[BloomFilter] = []
+
+    def __contains__(self, key: bytes) -> bool:
+        return any(key in f for f in reversed(self.filters))
+
+    def __len__(self) -> int:
+        return sum(f.count for f in self.filters)
+
+    def add(self, key: bytes) -> None:
+        if not self.filters or self.filters[-1].count >= self.filters[-1].capacity:
+            # the rates of the chain sum to at most error_rate
+            i = len(self.filters)
+            self.filters.append(
+                BloomFilter(self.initial_capacity << i, self.error_rate / 2 ** (i + 1))
+            )
+        self.filters[-1].add(key)
+
+
+class KeySet:
+    """Scalable Bloom filter with an exact-set fallback for its hits, kept
+    while there are at most exact_limit keys."""
+
+    def __init__(self, exact_limit: int = 1_000_000, error_rate: float = 1e-4):
+        self.exact_limit = exact_limit
+        self.bloom = ScalableBloomFilter(error_rate=error_rate)
+        self.exact: Optional[Set[bytes]] = set()
+
+    def __contains__(self, key: bytes) -> bool:
+        if key not in self.bloom:
+            return False
+        return self.exact is None or key in self.exact
+
+    def __len__(self) -> int:
+        return len(self.bloom)
+
+    def add(self, key: bytes) -> None:
+        self.bloom.add(key)
+        if self.exact is not None:
+            self.exact.add(key)
+            if len(self.exact) > self.exact_limit:
+                self.exact = None
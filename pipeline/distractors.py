@@ -0,0 +1,208 @@
+import logging
+import math
+import os
+from typing import Any, Dict, Iterable, List, Optional, Sequence, TypeVar
+
+import numpy as np
+
+from pipeline.registry import FunctionRegistry
+from pipeline.similarity import FunctionSimilarityIndex
+
+# Distractor sampling for multiple-function queries.
+# Every function gets 2 or 3 (p=0.5 each) distinct distractors from its own
+# functions entry (fewer when the entry is smaller) plus, with p=0.5, one
+# function from a different entry. The scenarios are flattened once into
+# NumPy index arrays and all draws for all functions are made in a handful
+# of vectorized calls, so building the table is linear in the number of
+# functions. A function listed in several entries keeps the draw of its
+# last entry. Draws come from a seeded generator: the same functions index
+# and seed give the same multiple_queries.
+#
+# Uniform distractors are usually easy to tell apart from the target, so
+# each distractor of a sampled query is swapped, with probability
+# S3_HARD_NEGATIVES, for one of the target's most similar functions from
+# the similarity index (pipeline/similarity.py).
+#
+#   S3_DISTRACTOR_SEED    seed for distractor and query sampling (default: 0)
+#   S3_HARD_NEGATIVES     share of distractors replaced by hard negatives, 0-1 (default: 0.5)
+
+T = TypeVar("T")
+
+# in-scenario draws per function (2 or 3) + one outer-scenario slot
+MAX_DISTRACTORS = 4
+
+
+def distractor_seed() -> int:
+    try:
+        return int(os.getenv("S3_DISTRACTOR_SEED", "0"))
+    except ValueError:
+        logging.warning("S3_DISTRACTOR_SEED is not an integer, using 0")
+        return 0
+
+
+def hard_negative_ratio() -> float:
+    try:
+        ratio = float(os.getenv("S3_HARD_NEGATIVES", "0.5"))
+    except ValueError:
+        logging.warning("S3_HARD_NEGATIVES is not a number, using 0.5")
+        return 0.5
+    return min(max(ratio, 0.0), 1.0)
+
+
+def make_rng(seed: Optional[int] = None) -> np.random.Generator:
+    return np.random.default_rng(distractor_seed() if seed is None else seed)
+
+
+def _distinct_draws(rng: np.random.Generator, n: np.ndarray) -> np.ndarray:
+    """Three distinct uniform positions in [0, n) per row (first
+    min(3, n) columns are meaningful)."""
+    u = rng.random((len(n), 3))
+    a = np.floor(u[:, 0] * np.maximum(n, 1)).astype(np.int64)
+    b = np.floor(u[:, 1] * np.maximum(n - 1, 1)).astype(np.int64)
+    c = np.floor(u[:, 2] * np.maximum(n - 2, 1)).astype(np.int64)
+    # shift each later draw past the values already taken
+    b += b >= a
+    lo, hi = np.minimum(a, b), np.maximum(a, b)
+    c += c >= lo
+    c += c >= hi
+    return np.stack([a, b, c], axis=1)
+
+
+class DistractorTable:
+    """Distractor function ids per function id (-1 padded rows)."""
+
+    def __init__(self, table: np.ndarray):
+        self.table = table
+
+    def __len__(self) -> int:
+        return len(self.table)
+
+    def __getitem__(self, fid: Optional[int]) -> List[int]:
+        if fid is None or fid < 0 or fid >= len(self.table):
+            return []
+        row = self.table[fid]
+        return row[row >= 0].tolist()
+
+
+def sample_distractors(
+    scenarios: Sequence[Sequence[int]],
+    rng: np.random.Generator,
+    num_functions: Optional[int] = None,
+) -> DistractorTable:
+    """Draw the distractors of every function of every scenario at once.
+
+    `scenarios` lists the function ids of each functions entry (as in
+    FunctionRegistry.scenarios)."""
+    # a function repeated inside one entry is a single candidate
+    unique = [list(dict.fromkeys(ids)) for ids in scenarios]
+    lengths = np.fromiter((len(ids) for ids in unique), dtype=np.int64, count=len(unique))
+    flat = np.fromiter(
+        (fid for ids in unique for fid in ids), dtype=np.int64, count=int(lengths.sum())
+    )
+    if num_functions is None:
+        num_functions = int(flat.max()) + 1 if len(flat) else 0
+    table = np.full((num_functions, MAX_DISTRACTORS), -1, dtype=np.int64)
+    n = len(flat)
+    if n == 0:
+        return DistractorTable(table)
+
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    owner = np.repeat(np.arange(len(unique)), lengths)
+    position = np.arange(n) - starts[owner]
+
+    # in-scenario: 2 or 3 distinct positions among the other functions
+    others = lengths[owner] - 1
+    wanted = np.where(rng.random(n) > 0.5, 2, 3)
+    take = np.minimum(wanted, others)
+    picks = _distinct_draws(rng, others)
+    # positions among the others -> positions in the scenario (skip self)
+    picks += picks >= position[:, None]
+    inner = flat[np.minimum(starts[owner][:, None] + picks, n - 1)]
+    table_rows = np.where(np.arange(3)[None, :] < take[:, None], inner, -1)
+
+    # outer: one function from a uniformly chosen different, non-empty entry
+    outer = np.full(n, -1, dtype=np.int64)
+    if len(unique) > 1:
+        add = rng.random(n) > 0.5
+        scenario = np.floor(rng.random(n) * (len(unique) - 1)).astype(np.int64)
+        scenario += scenario >= owner
+        size = lengths[scenario]
+        slot = np.floor(rng.random(n) * np.maximum(size, 1)).astype(np.int64)
+        add &= size > 0
+        outer[add] = flat[starts[scenario[add]] + slot[add]]
+
+    # compact each row: in-scenario picks, then the outer pick
+    rows = np.concatenate([table_rows, outer[:, None]], axis=1)
+    order = np.argsort(rows < 0, axis=1, kind="stable")
+    rows = np.take_along_axis(rows, order, axis=1)
+
+    # the last occurrence of a function wins
+    last = np.full(num_functions, -1, dtype=np.int64)
+    np.maximum.at(last, flat, np.arange(n))
+    present = last >= 0
+    table[present] = rows[last[present]]
+    return DistractorTable(table)
+
+
+def reservoir_sample(records: Iterable[T], k: int, rng: np.random.Generator) -> List[T]:
+    """Uniform sample of up to k records in one pass, in random order
+    (Algorithm L: O(k log(n/k)) draws)."""
+    if k <= 0:
+        return []
+    sample: List[T] = []
+    it = iter(records)
+    for record in it:
+        sample.append(record)
+        if len(sample) == k:
+            break
+    if len(sample) == k:
+        w = math.exp(math.log(rng.random()) / k)
+        skip = math.floor(math.log(rng.random()) / math.log1p(-w))
+        for record in it:
+            if skip > 0:
+                skip -= 1
+                continue
+            sample[int(rng.integers(k))] = record
+            w *= math.exp(math.log(rng.random()) / k)
+            skip = math.floor(math.log(rng.random()) / math.log1p(-w))
+    return [sample[i] for i in rng.permutation(len(sample))]
+
+
+def mix_hard_negatives(
+    fid: int,
+    distractors: List[int],
+    index: FunctionSimilarityIndex,
+    ratio: float,
+    rng: np.random.Generator,
+) -> List[int]:
+    """Swap each distractor, with probability ratio, for the most similar
+    function not offered yet (kept when there are no more)."""
+    swap = np.flatnonzero(rng.random(len(distractors)) < ratio)
+    if len(swap) == 0:
+        return distractors
+    hard = index.similar(fid, len(swap), exclude=set(distractors))
+    mixed = list(distractors)
+    for slot, replacement in zip(swap, hard):
+        mixed[slot] = replacement
+    return mixed
+
+
+def attach_distractors(
+    samples: List[Dict[str, Any]],
+    registry: FunctionRegistry,
+    table: DistractorTable,
+    rng: np.random.Generator,
+    index: Optional[FunctionSimilarityIndex] = None,
+    ratio: float = 0.0,
+) -> None:
+    """Turn sampled simple queries into multiple queries in place:
+    function_schema -> function_schemas (target first, then distractors)."""
+    for sample in samples:
+        fid = registry.id_of(sample["function_schema"])
+        distractors = table[fid]
+        if index is not None and fid is not None and ratio > 0:
+            distractors = mix_hard_negatives(fid, distractors, index, ratio, rng)
+        sample["function_schemas"] = [sample["function_schema"]] + [
+            registry.get(d).function for d in distractors
+        ]
+        del sample["function_schema"]
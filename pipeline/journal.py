@@ -0,0 +1,303 @@
+import asyncio
+import hashlib
+import json
+import logging
+import mmap
+import os
+from typing import Any, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+from openai_utils import (
+    batch_enabled,
+    chat_complete_async,
+    complete_batch,
+    map_bounded,
+    max_in_flight,
+    span,
+    unpack_results,
+    usage_stage,
+    usage_stats,
+)
+
+from .artifacts import RecordWriter
+
+# Append-only journal of completed stage inputs.
+# Each line is {"key": <input key>, "output": <parsed records>}, written and
+# handed to a background writer as soon as an input's request has been
+# parsed, so a crash or Ctrl-C loses at most the requests still in flight. On restart the runner
+# skips keys already in the journal, and compact() rebuilds the stage's
+# usual JSON output in input order.
+
+
+def input_key(index: int, item: Any, params: str = "") -> str:
+    """Stable key for one stage input: position plus a hash of its content
+    and of the settings that shape its prompt (so changed inputs re-run)."""
+    blob = json.dumps(item, sort_keys=True, ensure_ascii=False) + "\x00" + params
+    return f"{index}-{hashlib.sha1(blob.encode('utf-8')).hexdigest()[:16]}"
+
+
+def keyed(items: Iterable[Any], params: str = "") -> Iterator[Tuple[str, Any]]:
+    """(input_key, item) pairs, computed lazily."""
+    for index, item in enumerate(items):
+        yield input_key(index, item, params), item
+
+
+class StageJournal:
+    def __init__(self, path: str):
+        self.path = path
+        # only keys are kept in memory; outputs are read back from the file
+        self.keys: Set[str] = set()
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        if os.path.exists(path):
+            self._load()
+        self._writer = RecordWriter(path, "jsonl", append=True, sync=True)
+
+    def _scan(self) -> Iterator[Tuple[Optional[str], int, int]]:
+        """(key, start, end) byte range of every journal line; key is None
+        for a torn write from a crash (that input simply re-runs)."""
+        with open(self.path, "rb") as f:
+            start = 0
+            for line in f:
+                end = start + len(line)
+                try:
+                    key = json.loads(line)["key"]
+                except (json.JSONDecodeError, UnicodeDecodeError, KeyError, TypeError):
+                    key = None
+                if key is not None or line.strip():
+                    yield key, start, end
+                start = end
+
+    def _load(self) -> None:
+        skipped = 0
+        torn_tail = False
+        for key, _, _ in self._scan():
+            if key is None:
+                skipped += 1
+            else:
+                self.keys.add(key)
+        with open(self.path, "rb") as f:
+            if f.seek(0, os.SEEK_END) > 0:
+                f.seek(-1, os.SEEK_END)
+                torn_tail = f.read(1) != b"\n"
+        if torn_tail:
+            # terminate a torn last line so the next append starts clean
+            with open(self.path, "ab") as out:
+                out.write(b"\n")
+        if skipped:
+            logging.warning(f"Journal {self.path}: skipped {skipped} incomplete line(s)")
+        if self.keys:
+            logging.info(f"Journal {self.path}: resuming with {len(self.keys)} completed input(s)")
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.keys
+
+    def record(self, key: str, output: Any) -> None:
+        self.keys.add(key)
+        self._writer.write({"key": key, "output": output})
+
+    def iter_outputs(self, keys: Iterable[str]) -> Iterator[Any]:
+        """Outputs for keys in order; list outputs are flattened.
+
+        Reads each output back from the (memory-mapped) journal, so only
+        byte offsets are held in memory.
+        """
+        self._writer.flush()
+        spans = {key: (start, end) for key, start, end in self._scan() if key is not None}
+        if not spans:
+            return
+        with open(self.path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for key in keys:
+                span = spans.get(key)
+                if span is None:
+                    continue
+                output = json.loads(mm[span[0] : span[1]])["output"]
+                if isinstance(output, list):
+                    yield from output
+                else:
+                    yield output
+
+    def compact(self, keys: Iterable[str]) -> List[Any]:
+        return list(self.iter_outputs(keys))
+
+    def close(self) -> None:
+        self._writer.close()
+
+    def __enter__(self) -> "StageJournal":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
+        if exc_type is not None:
+            logging.warning(
+                f"Journal {self.path}: stopped early ({exc_type.__name__}); "
+                f"{len(self.keys)} completed input(s) saved, re-run to resume"
+            )
+
+
+class StageStep(NamedTuple):
+    """How one generator turns a job into a prompt and its response into
+    journaled output; several steps can share one run_steps() pass.
+
+    With pack_size > 1, up to that many jobs go into one request built by
+    build_pack (see openai_utils.render_packed) and the response is split
+    back per job by id.
+    """
+
+    name: str
+    journal: StageJournal
+    build_prompt: Callable[[Any], str]
+    parse: Callable[[Any, str], Any]
+    system: str
+    make_parser: Optional[Callable[[], Any]] = None
+    pack_size: int = 1
+    build_pack: Optional[Callable[[List[Any]], str]] = None
+
+
+# one request: a step and the (key, job) items it covers
+Pack = Tuple[StageStep, List[Tuple[str, Any]]]
+
+
+def _packs(pending: Iterable[Tuple[StageStep, str, Any]]) -> Iterator[Pack]:
+    open_packs: Dict[str, Pack] = {}
+    for step, key, job in pending:
+        if step.pack_size <= 1 or step.build_pack is None:
+            yield step, [(key, job)]
+            continue
+        _, items = open_packs.setdefault(step.name, (step, []))
+        items.append((key, job))
+        if len(items) >= step.pack_size:
+            yield open_packs.pop(step.name)
+    yield from open_packs.values()
+
+
+def _pack_prompt(pack: Pack) -> str:
+    step, items = pack
+    if len(items) == 1:
+        return step.build_prompt(items[0][1])
+    return step.build_pack([job for _, job in items])
+
+
+def _record_pack(pack: Pack, content: str) -> None:
+    step, items = pack
+    if len(items) == 1:
+        key, job = items[0]
+        # like a packed item, a bad completion is left for resume instead of
+        # failing the stage (and cancelling the requests in flight)
+        try:
+            with span("parse", step=step.name):
+                output = step.parse(job, content)
+        except Exception as e:
+            logging.warning(f"{step.name or 'request'}: item {key} could not be parsed: {e}")
+            return
+        _record(step, key, output)
+        return
+    with span("parse", step=step.name, items=len(items)):
+        results = unpack_results(content, (str(i) for i in range(1, len(items) + 1)))
+    for i, (key, job) in enumerate(items, 1):
+        # a bad item is left out of the journal (and re-runs on resume)
+        # without discarding the rest of its pack
+        body = results.get(str(i))
+        if body is None:
+            logging.warning(f"{step.name or 'pack'}: item {key} missing from packed response")
+            continue
+        try:
+            with span("parse", step=step.name):
+                output = step.parse(job, body)
+        except Exception as e:
+            logging.warning(f"{step.name or 'pack'}: item {key} could not be parsed: {e}")
+            continue
+        _record(step, key, output)
+
+
+def _record(step: StageStep, key: str, output: Any) -> None:
+    step.journal.record(key, output)
+    usage_stats().add_records(len(output) if isinstance(output, list) else 1)
+
+
+async def run_steps(
+    work: Iterable[Tuple[StageStep, str, Any]],
+    *,
+    stage: str,
+    batch_dir: str,
+    batch_name: str,
+    desc: Optional[str] = None,
+) -> None:
+    """Run (step, key, job) items not yet in their step's journal through one
+    shared request budget, recording each parsed output as soon as its
+    response arrives. In batch mode each step is submitted as its own batch
+    (<batch_name>_<step name>), all polled concurrently. work may be lazy."""
+    with usage_stage(stage):
+        await _run_packs(
+            _packs((step, key, job) for step, key, job in work if key not in step.journal),
+            stage=stage,
+            batch_dir=batch_dir,
+            batch_name=batch_name,
+            desc=desc,
+        )
+
+
+async def _run_packs(
+    packs: Iterable[Pack], *, stage: str, batch_dir: str, batch_name: str, desc: Optional[str]
+) -> None:
+    if batch_enabled():
+        # a batch is submitted as a whole, so its jobs are held until it returns
+        by_step: Dict[str, List[Pack]] = {}
+        for pack in packs:
+            by_step.setdefault(pack[0].name, []).append(pack)
+
+        async def run_batch(step_packs: List[Pack]) -> None:
+            step = step_packs[0][0]
+            with usage_stage(generator=step.name):
+                contents = await complete_batch(
+                    (_pack_prompt(pack) for pack in step_packs),
+                    batch_dir,
+                    f"{batch_name}_{step.name}" if step.name else batch_name,
+                    system=step.system,
+                )
+                for pack, content in zip(step_packs, contents):
+                    # a failed or expired request stays out of the journal,
+                    # so the next run sends it again
+                    if content is not None:
+                        _record_pack(pack, content)
+
+        await asyncio.gather(*(run_batch(step_packs) for step_packs in by_step.values()))
+        return
+
+    async def run(pack: Pack) -> None:
+        step, items = pack
+        # early stop is per item, so packed requests are read to the end
+        parser = step.make_parser() if step.make_parser is not None and len(items) == 1 else None
+        with usage_stage(generator=step.name):
+            content = await chat_complete_async(
+                prompt=_pack_prompt(pack), system=step.system, parser=parser
+            )
+            _record_pack(pack, content)
+
+    await map_bounded(run, packs, max_in_flight(stage), desc=desc)
+
+
+async def run_journaled(
+    journal: StageJournal,
+    jobs: Iterable[Tuple[str, Any]],
+    build_prompt: Callable[[Any], str],
+    parse: Callable[[Any, str], Any],
+    *,
+    system: str,
+    stage: str,
+    batch_dir: str,
+    batch_name: str,
+    make_parser: Optional[Callable[[], Any]] = None,
+    desc: Optional[str] = None,
+    pack_size: int = 1,
+    build_pack: Optional[Callable[[List[Any]], str]] = None,
+) -> None:
+    """run_steps() for a single generator over (key, job) pairs."""
+    step = StageStep("", journal, build_prompt, parse, system, make_parser, pack_size, build_pack)
+    await run_steps(
+        ((step, key, job) for key, job in jobs),
+        stage=stage,
+        batch_dir=batch_dir,
+        batch_name=batch_name,
+        desc=desc,
+    )
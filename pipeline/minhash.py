@@ -0,0 +1,108 @@
+import re
+import zlib
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+# MinHash signatures and LSH banding, shared by the function similarity
+# index (hard-negative distractors) and scenario near-duplicate pruning.
+# Tokens are hashed with crc32, so signatures are stable across processes
+# and can be persisted; the permutations are derived from a fixed seed.
+
+# smallest prime above 2**32; a*x + b stays below 2**64 for 32-bit a, b, x
+_PRIME = np.uint64(4294967311)
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+def words(text: str) -> List[str]:
+    return _WORD_RE.findall(text.lower())
+
+
+def shingles(text: str, n: int = 3) -> Set[str]:
+    """Word n-grams of text (the whole text when it is shorter)."""
+    tokens = words(text)
+    if len(tokens) <= n:
+        return {" ".join(tokens)} if tokens else set()
+    return {" ".join(tokens[i : i + n]) for i in range(len(tokens) - n + 1)}
+
+
+def _collision(s: float, bands: int, rows: int) -> float:
+    return 1.0 - (1.0 - s**rows) ** bands
+
+
+def optimal_bands(threshold: float, num_perm: int) -> Tuple[int, int]:
+    """(bands, rows) whose S-curve best separates pairs around threshold:
+    minimizes the false positive plus false negative area."""
+    steps = 100
+    grid = [i / steps for i in range(steps + 1)]
+    best, best_error = (1, num_perm), float("inf")
+    for bands in range(1, num_perm + 1):
+        rows = num_perm // bands
+        fp = sum(_collision(s, bands, rows) for s in grid if s < threshold) / steps
+        fn = sum(1 - _collision(s, bands, rows) for s in grid if s >= threshold) / steps
+        if fp + fn < best_error:
+            best, best_error = (bands, rows), fp + fn
+    return best
+
+
+class MinHasher:
+    def __init__(self, num_perm: int = 128, seed: int = 1):
+        self.num_perm = num_perm
+        self.seed = seed
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, 1 << 32, size=num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, 1 << 32, size=num_perm, dtype=np.uint64)
+
+    def signature(self, tokens: Iterable[str]) -> np.ndarray:
+        hashed = np.fromiter(
+            {zlib.crc32(t.encode("utf-8")) for t in tokens}, dtype=np.uint64
+        )
+        if len(hashed) == 0:
+            # empty sets only match each other
+            return np.full(self.num_perm, 0xFFFFFFFF, dtype=np.uint32)
+        values = (self._a[:, None] * hashed[None, :] + self._b[:, None]) % _PRIME
+        return values.min(axis=1).astype(np.uint32)
+
+    def signatures(self, token_sets: Iterable[Iterable[str]]) -> np.ndarray:
+        rows = [self.signature(tokens) for tokens in token_sets]
+        if not rows:
+            return np.empty((0, self.num_perm), dtype=np.uint32)
+        return np.stack(rows)
+
+
+def jaccard(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Estimated Jaccard similarity of signature a against each row of b."""
+    return (np.atleast_2d(b) == a).mean(axis=1)
+
+
+class LSHIndex:
+    """Banded LSH buckets over MinHash signatures; items are added and
+    queried one at a time, so it can be filled while streaming."""
+
+    def __init__(self, num_perm: int = 128, threshold: float = 0.5, bands: Optional[int] = None):
+        if bands is None:
+            bands, rows = optimal_bands(threshold, num_perm)
+        else:
+            rows = num_perm // bands
+        self.num_perm = num_perm
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = rows
+        self._buckets: List[Dict[bytes, List[int]]] = [{} for _ in range(bands)]
+
+    def _keys(self, signature: np.ndarray) -> Iterable[Tuple[int, bytes]]:
+        for band in range(self.bands):
+            yield band, signature[band * self.rows : (band + 1) * self.rows].tobytes()
+
+    def add(self, key: int, signature: np.ndarray) -> None:
+        for band, bucket_key in self._keys(signature):
+            self._buckets[band].setdefault(bucket_key, []).append(key)
+
+    def candidates(self, signature: np.ndarray) -> Set[int]:
+        """Keys sharing at least one band with signature."""
+        found: Set[int] = set()
+        for band, bucket_key in self._keys(signature):
+            bucket = self._buckets[band].get(bucket_key)
+            if bucket:
+                found.update(bucket)
+        return found
@@ -0,0 +1,202 @@
+import ast
+import csv
+import hashlib
+import logging
+import os
+import re
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+import numpy as np
+
+from pipeline.artifacts import RecordWriter, artifact_path, iter_records
+from pipeline.bloom import BloomFilter, KeySet
+
+# Exact-duplicate filter for generated (user_query, function_call) pairs.
+# Simple and parallel generation often return the same pair for a function
+# across models and runs; the S3 writers drop a record whose normalized pair
+# was already written. The query is whitespace-collapsed and casefolded; the
+# call is parsed with `ast` and unparsed without its assignment targets, so
+# quoting, spacing and result variable names do not matter (text that does
+# not parse is whitespace-collapsed). Pairs are keyed by a 16-byte blake2b
+# hash per query type.
+#
+# Pairs of the current run are checked against a KeySet (a scalable Bloom
+# filter whose hits are confirmed exactly up to S3_DEDUP_EXACT_LIMIT pairs)
+# and against the curriculum's history: one fixed-size Bloom filter under
+# pipeline/data/dedup/<curriculum hash>/history.npz holding the pairs of all
+# earlier runs. A run saves its pairs to <run_id>.npz in the history's
+# geometry, and the next run of another run_id folds that file into the
+# history (a bitwise OR) and deletes it, so memory and lookups stay bounded
+# by the history size however many runs there are. Re-running a run replaces
+# its own file instead of matching against it, until it has been folded.
+# Earlier runs are folded in even when cross-run matching is turned off, so
+# per-run files never pile up.
+#
+#   S3_DEDUP=0                   keep duplicate pairs
+#   S3_DEDUP_CROSS_RUN=0         only drop duplicates within the run
+#   S3_DEDUP_STATE_DIR           state directory (default: pipeline/data/dedup/<curriculum hash>)
+#   S3_DEDUP_EXACT_LIMIT         pairs of a run confirmed exactly (default: 1000000)
+#   S3_DEDUP_ERROR_RATE          Bloom false-positive rate bound (default: 0.0001)
+#   S3_DEDUP_HISTORY_CAPACITY    pairs the history is sized for (default: 10000000)
+
+CURRICULUM_PATH = "pipeline/data/curriculum.csv"
+HISTORY_NAME = "history.npz"
+
+_FENCE_RE = re.compile(r"^\s*```[\w-]*\s*$", re.MULTILINE)
+
+
+def _env_number(name: str, default, cast):
+    try:
+        return cast(os.getenv(name, str(default)))
+    except ValueError:
+        logging.warning(f"{name} is not a number, using {default}")
+        return default
+
+
+def dedup_enabled() -> bool:
+    return os.getenv("S3_DEDUP", "1") != "0"
+
+
+def cross_run_enabled() -> bool:
+    return os.getenv("S3_DEDUP_CROSS_RUN", "1") != "0"
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.split()).casefold()
+
+
+def normalize_call(call: str) -> str:
+    text = _FENCE_RE.sub("", call).strip()
+    try:
+        module = ast.parse(text)
+    except SyntaxError:
+        return " ".join(text.split())
+    statements: List[str] = []
+    for node in module.body:
+        # `result = f(x)` and `f(x)` are the same call
+        if isinstance(node, (ast.Assign, ast.AnnAssign)) and node.value is not None:
+            node = node.value
+        statements.append(ast.unparse(node))
+    return "\n".join(statements)
+
+
+def pair_key(kind: str, query: str, call: str) -> bytes:
+    text = "\0".join((kind, normalize_query(query), normalize_call(call)))
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+
+def _curriculum_hash(path: str = CURRICULUM_PATH) -> str:
+    digest = hashlib.blake2b(digest_size=8)
+    with open(path, newline="", encoding="utf-8") as f:
+        # row content only: reordering the CSV keeps the same state
+        for row in sorted(tuple(r) for r in csv.reader(f)):
+            digest.update("\x1f".join(row).encode("utf-8") + b"\n")
+    return digest.hexdigest()
+
+
+def state_dir() -> str:
+    configured = os.getenv("S3_DEDUP_STATE_DIR")
+    if configured:
+        return configured
+    return os.path.join("pipeline", "data", "dedup", _curriculum_hash())
+
+
+class PairDeduplicator:
+    """Seen-pair state of one run, checked against the folded state of the
+    curriculum's earlier runs."""
+
+    def __init__(self, run_id: str, directory: Optional[str] = None):
+        self.run_id = run_id
+        self.directory = directory or state_dir()
+        exact_limit = _env_number("S3_DEDUP_EXACT_LIMIT", 1_000_000, int)
+        error_rate = _env_number("S3_DEDUP_ERROR_RATE", 1e-4, float)
+        capacity = max(1, _env_number("S3_DEDUP_HISTORY_CAPACITY", 10_000_000, int))
+        self.seen = KeySet(exact_limit, error_rate)
+        history = self._load_history(capacity, error_rate)
+        self.history: Optional[BloomFilter] = history if cross_run_enabled() else None
+        # this run's new pairs, in the history's geometry so they can be folded in
+        self.pairs = BloomFilter(history.capacity, history.error_rate)
+        self.stats: Dict[str, Dict[str, int]] = {}
+
+    def _load_history(self, capacity: int, error_rate: float) -> BloomFilter:
+        path = os.path.join(self.directory, HISTORY_NAME)
+        history, runs = BloomFilter(capacity, error_rate), []
+        if os.path.exists(path):
+            try:
+                history = BloomFilter.load(path)
+                with np.load(path) as data:
+                    runs = data["runs"].tolist()
+            except (OSError, ValueError, KeyError) as e:
+                logging.warning(f"Starting a new dedup history, {path} is unreadable: {e}")
+        folded: List[str] = []
+        names = sorted(os.listdir(self.directory)) if os.path.isdir(self.directory) else []
+        for name in names:
+            if not name.endswith(".npz") or name in (HISTORY_NAME, f"{self.run_id}.npz"):
+                continue
+            try:
+                history.union(BloomFilter.load(os.path.join(self.directory, name)))
+            except (OSError, ValueError, KeyError) as e:
+                logging.warning(f"Skipping dedup state {name}: {e}")
+                continue
+            folded.append(name)
+        if folded:
+            runs += [name[: -len(".npz")] for name in folded]
+            history.save(path, runs=np.array(runs, dtype=str))
+            for name in folded:
+                os.remove(os.path.join(self.directory, name))
+            logging.info(f"Dedup: folded {len(folded)} earlier run(s) into {path}")
+        if self.run_id in runs:
+            logging.warning(
+                f"Run {self.run_id} is already part of the dedup history; "
+                "its own earlier pairs count as duplicates"
+            )
+        if history.count > history.capacity:
+            logging.warning(
+                f"Dedup history holds {history.count} pairs, over its capacity of "
+                f"{history.capacity}: false positives exceed S3_DEDUP_ERROR_RATE. "
+                "Raise S3_DEDUP_HISTORY_CAPACITY with a new S3_DEDUP_STATE_DIR."
+            )
+        return history
+
+    def filter(self, kind: str, records: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        """Records whose (user_query, function_call) pair is new."""
+        stats = self.stats.setdefault(kind, {"records": 0, "this_run": 0, "earlier_runs": 0})
+        for record in records:
+            stats["records"] += 1
+            key = pair_key(kind, record.get("user_query", ""), record.get("function_call", ""))
+            if key in self.seen:
+                stats["this_run"] += 1
+                continue
+            self.seen.add(key)
+            if self.history is not None and key in self.history:
+                stats["earlier_runs"] += 1
+                continue
+            self.pairs.add(key)
+            yield record
+        dropped = stats["this_run"] + stats["earlier_runs"]
+        logging.info(
+            f"Dedup {kind}: dropped {dropped}/{stats['records']} duplicate pair(s) "
+            f"({stats['this_run']} within this run, {stats['earlier_runs']} from earlier runs)"
+        )
+        if stats["records"] >= 10 and stats["records"] - dropped <= stats["records"] // 20:
+            cause = (
+                "nearly all were written by earlier runs; a shared OPENAI_CACHE_NAMESPACE "
+                "replays their completions (set S3_DEDUP_CROSS_RUN=0 to keep them)"
+                if stats["earlier_runs"] > stats["this_run"]
+                else "the model keeps returning the same pairs"
+            )
+            logging.warning(
+                f"Dedup {kind}: only {stats['records'] - dropped} of {stats['records']} "
+                f"record(s) kept: {cause}"
+            )
+
+    def save(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        self.pairs.save(os.path.join(self.directory, f"{self.run_id}.npz"))
+
+
+def dedup_artifact(run_dir: str, name: str, dedup: PairDeduplicator) -> None:
+    """Drop duplicate pairs from an artifact that was written as a whole."""
+    path = artifact_path(run_dir, name)
+    with RecordWriter(path) as writer:
+        writer.write_many(dedup.filter(name, iter_records(path)))
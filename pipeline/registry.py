@@ -0,0 +1,227 @@
+import logging
+import os
+import re
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from pipeline.artifacts import RecordWriter, artifact_path, iter_records
+from pipeline.s2_functions.parser import parse_signature, signature_hash
+
+# Function registry: every unique function of a run, interned once.
+# S2 writes <run_dir>/functions.index next to functions.json; S3 and the
+# tools load it once and look functions up by id, signature text (via its
+# hash) or name, instead of re-parsing signatures and rebuilding their own
+# maps. Each entry carries the parsed signature, the JSON-schema tool
+# definition and the functions.json entries ("scenarios") it appears in.
+#
+# The index is JSONL: a header line, one line per function in id order,
+# then one line per scenario listing its function ids in their original
+# order. An index older than functions.json is rebuilt on load.
+
+INDEX_NAME = "functions.index"
+INDEX_VERSION = 1
+
+
+def _python_type_to_jsonschema(t: str) -> Dict[str, Any]:
+    t = t.strip()
+    m = re.match(r"optional\[(.*)\]$", t, flags=re.IGNORECASE)
+    if m:
+        t = m.group(1).strip()
+    # Basic mapping
+    if t.lower() in {"str", "string"}:
+        return {"type": "string"}
+    if t.lower() in {"int", "integer"}:
+        return {"type": "integer"}
+    if t.lower() in {"float", "double", "number"}:
+        return {"type": "number"}
+    if t.lower() in {"bool", "boolean"}:
+        return {"type": "boolean"}
+    if t.lower().startswith("list[") or t.lower() == "list":
+        # extract inner type if any
+        inner = "string"
+        m = re.match(r"list\[([^\]]+)\]", t, flags=re.IGNORECASE)
+        if m:
+            inner = m.group(1)
+        return {"type": "array", "items": _python_type_to_jsonschema(inner)}
+    if t.lower().startswith("dict[") or t.lower() == "dict":
+        # Generic object
+        return {"type": "object"}
+    # Fallback
+    return {"type": "string"}
+
+
+def tool_schema(parsed: Dict[str, Any]) -> Dict[str, Any]:
+    """JSON-schema tool definition for a parse_signature() result."""
+    name = parsed.get("function_name", "unknown")
+    params = parsed.get("parameters", [])
+    param_descriptions = parsed.get("param_descriptions", {})
+
+    properties: Dict[str, Any] = {}
+    required: List[str] = []
+
+    for p_name, p_type, p_default in params:
+        properties[p_name] = _python_type_to_jsonschema(p_type)
+        if param_descriptions.get(p_name):
+            properties[p_name]["description"] = param_descriptions[p_name]
+        if p_default is None:
+            required.append(p_name)
+
+    return {
+        "name": name,
+        "description": parsed.get("description") or f"Auto-generated tool for function {name}",
+        "parameters": {
+            "type": "object",
+            "properties": properties,
+            "required": required,
+        },
+    }
+
+
+@dataclass
+class FunctionEntry:
+    id: int
+    hash: str
+    name: str
+    function: str
+    return_type: str
+    # [name, type, default source or None]
+    parameters: List[List[Optional[str]]]
+    description: str
+    param_descriptions: Dict[str, str]
+    tool: Dict[str, Any]
+    expected: Any = None
+    # indices of the functions.json entries this function appears in
+    scenarios: List[int] = field(default_factory=list)
+
+    @property
+    def param_names(self) -> List[str]:
+        return [p[0] for p in self.parameters]
+
+
+class FunctionRegistry:
+    def __init__(self):
+        self.functions: List[FunctionEntry] = []
+        # function ids of each functions.json entry, in their original order
+        self.scenarios: List[List[int]] = []
+        self._by_hash: Dict[str, int] = {}
+        self._by_name: Dict[str, List[int]] = {}
+
+    def __len__(self) -> int:
+        return len(self.functions)
+
+    def _index(self, entry: FunctionEntry) -> None:
+        self._by_hash[entry.hash] = entry.id
+        if entry.name:
+            self._by_name.setdefault(entry.name, []).append(entry.id)
+
+    def intern(self, function: str, expected: Any = None) -> int:
+        """Id of `function`, registering it on first sight."""
+        digest = signature_hash(function)
+        fid = self._by_hash.get(digest)
+        if fid is not None:
+            return fid
+        parsed = parse_signature(function)
+        entry = FunctionEntry(
+            id=len(self.functions),
+            hash=digest,
+            name=parsed.get("function_name", ""),
+            function=function,
+            return_type=parsed.get("return_type", ""),
+            parameters=[list(p) for p in parsed.get("parameters", [])],
+            description=parsed.get("description", ""),
+            param_descriptions=dict(parsed.get("param_descriptions", {})),
+            tool=tool_schema(parsed) if parsed else {},
+            expected=expected,
+        )
+        self.functions.append(entry)
+        self._index(entry)
+        return entry.id
+
+    def add_scenario(self, functions: Iterable[Dict[str, Any]]) -> List[int]:
+        """Register one functions.json entry's functions; returns their ids."""
+        index = len(self.scenarios)
+        ids = []
+        for func in functions:
+            fid = self.intern(func["function"], func.get("expected"))
+            owners = self.functions[fid].scenarios
+            if not owners or owners[-1] != index:
+                owners.append(index)
+            ids.append(fid)
+        self.scenarios.append(ids)
+        return ids
+
+    @classmethod
+    def build(cls, records: Iterable[Dict[str, Any]]) -> "FunctionRegistry":
+        registry = cls()
+        for record in records:
+            registry.add_scenario(record.get("functions", []))
+        return registry
+
+    def get(self, fid: int) -> FunctionEntry:
+        return self.functions[fid]
+
+    def id_of(self, function: str) -> Optional[int]:
+        return self._by_hash.get(signature_hash(function))
+
+    def lookup(self, function: str) -> Optional[FunctionEntry]:
+        fid = self.id_of(function)
+        return self.functions[fid] if fid is not None else None
+
+    def named(self, name: str) -> List[FunctionEntry]:
+        """Every function called `name` (several when names collide)."""
+        return [self.functions[fid] for fid in self._by_name.get(name, ())]
+
+    def _lines(self) -> Iterator[Dict[str, Any]]:
+        yield {"version": INDEX_VERSION, "functions": len(self.functions), "scenarios": len(self.scenarios)}
+        for entry in self.functions:
+            yield asdict(entry)
+        for index, ids in enumerate(self.scenarios):
+            yield {"scenario": index, "functions": ids}
+
+    def save(self, path: str) -> None:
+        with RecordWriter(path, "jsonl") as writer:
+            writer.write_many(self._lines())
+
+    @classmethod
+    def load(cls, path: str) -> "FunctionRegistry":
+        registry = cls()
+        records = iter_records(path, fmt="jsonl")
+        header = next(records, None)
+        if not header or header.get("version") != INDEX_VERSION:
+            raise ValueError(f"{path} is not a version {INDEX_VERSION} function index")
+        for record in records:
+            if "scenario" in record:
+                registry.scenarios.append(record["functions"])
+            else:
+                entry = FunctionEntry(**record)
+                registry.functions.append(entry)
+                registry._index(entry)
+        return registry
+
+
+def function_index_path(run_dir: str) -> str:
+    return os.path.join(run_dir, INDEX_NAME)
+
+
+def write_function_index(run_dir: str) -> FunctionRegistry:
+    """Build the registry from the run's functions artifact and persist it."""
+    registry = FunctionRegistry.build(iter_records(artifact_path(run_dir, "functions")))
+    registry.save(function_index_path(run_dir))
+    logging.info(
+        f"Function index: {len(registry)} unique function(s) from {len(registry.scenarios)} "
+        f"functions entries written to {function_index_path(run_dir)}"
+    )
+    return registry
+
+
+def load_function_index(run_dir: str) -> FunctionRegistry:
+    """The run's function registry, (re)built if missing or older than the
+    functions artifact."""
+    path = function_index_path(run_dir)
+    functions_path = artifact_path(run_dir, "functions")
+    if os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(functions_path):
+        try:
+            return FunctionRegistry.load(path)
+        except (ValueError, TypeError, KeyError) as e:
+            logging.warning(f"Rebuilding {path}: {e}")
+    return write_function_index(run_dir)
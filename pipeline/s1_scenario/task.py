@@ -5,7 +5,8 @@ from dria.models import TaskResult
 from pydantic import BaseModel, Field
 
 from dria_workflows import *
-from dria.factory.utilities import get_tags, get_abs_path
+from openai_utils import extract_tags, load_template
+from dria.factory.utilities import get_abs_path
 
 
 class ScenarioOutput(BaseModel):
@@ -29,18 +30,18 @@ class Scenario(SingletonTemplate):
 
     def workflow(self):
 
-        builder = WorkflowBuilder(
+        variables = dict(
             domain=self.domain,
             subdomain=self.subdomain,
-            entities=self.entities,
             num_scenarios=str(self.num_scenarios),
         )
+        builder = WorkflowBuilder(entities=self.entities, **variables)
         builder.set_max_tokens(850)
         builder.set_max_time(105)
         builder.set_max_steps(3)
 
         builder.generative_step(
-            path=get_abs_path("prompt.md"),
+            prompt=load_template(get_abs_path("prompt.md"), variables).render(variables),
             operator=Operator.GENERATION,
             outputs=[Write.new("output")],
         )
@@ -54,7 +55,7 @@ class Scenario(SingletonTemplate):
     def callback(self, result: List[TaskResult]) -> List[ScenarioOutput]:
         results = []
         for r in result:
-            scenario = get_tags(r.result, "scenario")
+            scenario = extract_tags(r.result, "scenario")
             for sce in scenario:
                 results.append(
                     ScenarioOutput(
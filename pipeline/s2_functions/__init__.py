@@ -1 +1,8 @@
-from .task import Functions
+import importlib
+
+
+def __getattr__(name):
+    # lazy, so `pipeline.s2_functions.parser` does not import the Dria SDK
+    if name == "Functions":
+        return importlib.import_module(".task", __name__).Functions
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
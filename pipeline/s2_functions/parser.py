@@ -1,7 +1,35 @@
+import ast
+import hashlib
+import os
 import re
+import textwrap
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
 
+# Function signatures are parsed with `ast`, so nested generics
+# (Dict[str, List[int]]), defaults containing commas and multi-line
+# signatures come out whole, together with the docstring and per-parameter
+# descriptions (Google "Args:", numpy "Parameters" or Sphinx ":param x:").
+# Signatures that are not valid Python fall back to the old regex.
+#
+# The same signature is parsed by S2, the converter and tool building, so
+# results are memoized in a bounded LRU keyed by a hash of the signature
+# text; the returned dict is shared between callers and must not be mutated.
+#
+#   PARSE_SIGNATURE_CACHE_SIZE    parsed signatures kept (default: 8192)
 
-def parse_signature(function: str) -> dict:
+_SECTION_RE = re.compile(r"^\s*(Args|Arguments|Parameters|Params)\s*:?\s*$", re.IGNORECASE)
+_UNDERLINE_RE = re.compile(r"^\s*-{3,}\s*$")
+_END_SECTION_RE = re.compile(
+    r"^\s*(Returns?|Yields?|Raises?|Examples?|Notes?|See Also|Attributes)\s*:?\s*$", re.IGNORECASE
+)
+_GOOGLE_PARAM_RE = re.compile(r"^\s*\*{0,2}(\w+)\s*(?:\(([^)]*)\))?\s*:\s*(.*)$")
+_NUMPY_PARAM_RE = re.compile(r"^\s*(\w+)\s*(?::\s*(.*))?$")
+_SPHINX_PARAM_RE = re.compile(r"^\s*:param\s+(?:[\w\[\], ]+\s+)?(\w+)\s*:\s*(.*)$")
+
+
+def _parse_signature_regex(function: str) -> dict:
     signature_pattern = re.compile(
         r"def\s+([A-Za-z_]\w*)\s*\((.*?)\)\s*->\s*([A-Za-z_][\w\[\]]*)\s*:", re.DOTALL
     )
@@ -26,6 +54,143 @@ def parse_signature(function: str) -> dict:
             "function_name": func_name,
             "return_type": return_type,
             "parameters": params,
+            "docstring": "",
+            "description": "",
+            "param_descriptions": {},
         }
     else:
         return {}
+
+
+def _function_node(function: str) -> Optional[ast.FunctionDef]:
+    start = re.search(r"^[ \t]*(async[ \t]+)?def\s", function, re.MULTILINE)
+    if start is None:
+        return None
+    source = textwrap.dedent(function[start.start() :])
+    # a bare signature (or signature + docstring) has no body yet
+    for candidate in (source, source.rstrip() + "\n    ...\n"):
+        try:
+            module = ast.parse(candidate)
+        except SyntaxError:
+            continue
+        for node in module.body:
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                return node
+    return None
+
+
+def _param_descriptions(docstring: str) -> Dict[str, str]:
+    descriptions: Dict[str, str] = {}
+    current: Optional[str] = None
+    in_section = False
+    numpy = False
+    indent = 0
+    for line in docstring.splitlines():
+        sphinx = _SPHINX_PARAM_RE.match(line)
+        if sphinx:
+            current = sphinx.group(1)
+            descriptions[current] = sphinx.group(2).strip()
+            continue
+        if _SECTION_RE.match(line):
+            in_section, numpy, current, indent = True, False, None, -1
+            continue
+        if not in_section:
+            continue
+        if _UNDERLINE_RE.match(line):
+            numpy = True
+            continue
+        if _END_SECTION_RE.match(line):
+            in_section, current = False, None
+            continue
+        if not line.strip():
+            continue
+        line_indent = len(line) - len(line.lstrip())
+        if indent < 0:
+            indent = line_indent
+        if line_indent <= indent:
+            if line_indent < indent:
+                # dedented past the parameter list: the section is over
+                in_section, current = False, None
+                continue
+            # "name (type): text" / "name: text" (Google); "name : type" (numpy,
+            # with the text on the following indented lines)
+            match = (_NUMPY_PARAM_RE if numpy else _GOOGLE_PARAM_RE).match(line)
+            if match:
+                current = match.group(1)
+                descriptions[current] = "" if numpy else match.group(3).strip()
+                continue
+        if current is not None:
+            # continuation line of the current parameter
+            descriptions[current] = f"{descriptions[current]} {line.strip()}".strip()
+    return descriptions
+
+
+def _parse_signature_ast(function: str) -> Optional[dict]:
+    node = _function_node(function)
+    if node is None:
+        return None
+    args = node.args
+    positional = args.posonlyargs + args.args
+    # defaults align with the last positional parameters
+    defaults: List[Optional[ast.expr]] = [None] * (len(positional) - len(args.defaults)) + list(
+        args.defaults
+    )
+    pairs: List[Tuple[ast.arg, Optional[ast.expr]]] = list(zip(positional, defaults))
+    pairs += list(zip(args.kwonlyargs, args.kw_defaults))
+
+    params = []
+    for i, (arg, default) in enumerate(pairs):
+        if i == 0 and arg.arg in ("self", "cls"):
+            continue
+        p_type = ast.unparse(arg.annotation) if arg.annotation is not None else "Any"
+        p_default = ast.unparse(default) if default is not None else None
+        params.append((arg.arg, p_type, p_default))
+
+    docstring = ast.get_docstring(node) or ""
+    return {
+        "function_name": node.name,
+        "return_type": ast.unparse(node.returns) if node.returns is not None else "",
+        "parameters": params,
+        "docstring": docstring,
+        "description": docstring.split("\n\n", 1)[0].strip(),
+        "param_descriptions": _param_descriptions(docstring),
+    }
+
+
+try:
+    _CACHE_SIZE = max(0, int(os.getenv("PARSE_SIGNATURE_CACHE_SIZE", "8192")))
+except ValueError:
+    _CACHE_SIZE = 8192
+_cache: "OrderedDict[str, dict]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def signature_hash(function: str) -> str:
+    """Content hash identifying a function by its exact signature text."""
+    return hashlib.blake2b(function.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def parse_signature(function: str) -> dict:
+    """Parse the first function definition in `function`.
+
+    Returns {"function_name", "return_type", "parameters": [(name, type,
+    default source or None)], "docstring", "description" (first paragraph),
+    "param_descriptions": {name: text}}, or {} when no signature is found.
+    Unannotated parameters have type "Any"; a missing return annotation
+    gives return_type "".
+    """
+    key = signature_hash(function)
+    with _cache_lock:
+        parsed = _cache.get(key)
+        if parsed is not None:
+            _cache.move_to_end(key)
+            return parsed
+    parsed = _parse_signature_ast(function)
+    if parsed is None:
+        parsed = _parse_signature_regex(function)
+    if _CACHE_SIZE:
+        with _cache_lock:
+            _cache[key] = parsed
+            if len(_cache) > _CACHE_SIZE:
+                _cache.popitem(last=False)
+    return parsed
@@ -5,8 +5,8 @@ from dria.models import TaskResult
 from pydantic import BaseModel, Field
 
 from dria_workflows import *
+from openai_utils import load_template, parse_tags
 from dria.factory.utilities import (
-    get_tags,
     parse_json,
     get_abs_path,
     extract_backtick_label,
@@ -38,16 +38,17 @@ class Functions(SingletonTemplate):
 
     def workflow(self):
 
-        builder = WorkflowBuilder(
+        variables = dict(
             scenario=self.scenario
             # num_queries=str(self.num_queries),
         )
+        builder = WorkflowBuilder(**variables)
         builder.set_max_tokens(800)
         builder.set_max_time(85)
         builder.set_max_steps(3)
 
         builder.generative_step(
-            path=get_abs_path("prompt.md"),
+            prompt=load_template(get_abs_path("prompt.md"), variables).render(variables),
             operator=Operator.GENERATION,
             outputs=[Write.new("output")],
         )
@@ -61,12 +62,14 @@ class Functions(SingletonTemplate):
     def callback(self, result: List[TaskResult]) -> List[FunctionsOutput]:
         results = []
         for r in result:
-            fs = get_tags(r.result, "function")
+            fs = parse_tags(r.result, ("function", "signature", "expected"))
 
             functions = []
             for function in fs:
-                signature = get_tags(function, "signature")[0]
-                expected = get_tags(function, "expected")[0]
+                if function.tag != "function":
+                    continue
+                signature = function.find("signature")[0].content
+                expected = function.find("expected")[0].content
 
                 schema = extract_backtick_label(signature, "python")[0]
                 parsed = parse_signature(schema)
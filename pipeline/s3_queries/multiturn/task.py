@@ -6,10 +6,10 @@ from dria.models import TaskResult
 from pydantic import BaseModel, Field
 
 from dria_workflows import *
+from openai_utils import group_records, load_template, parse_tags
 from dria_workflows.workflows.interface import MessageInput
 
 from dria.factory.utilities import (
-    get_tags,
     parse_json,
     get_abs_path,
     extract_backtick_label,
@@ -42,18 +42,19 @@ class MultiTurnQuery(SingletonTemplate):
 
     def workflow(self):
 
-        builder = WorkflowBuilder(
+        variables = dict(
             scenario=self.scenario,
             function_schemas=json.dumps(
                 [f.model_dump() for f in self.function_schemas]
             ),
         )
+        builder = WorkflowBuilder(**variables)
         builder.set_max_tokens(800)
         builder.set_max_time(85)
         builder.set_max_steps(3)
 
         builder.generative_step(
-            path=get_abs_path("prompt.md"),
+            prompt=load_template(get_abs_path("prompt.md"), variables).render(variables),
             operator=Operator.GENERATION,
             outputs=[Write.new("output")],
         )
@@ -67,15 +68,16 @@ class MultiTurnQuery(SingletonTemplate):
     def callback(self, result: List[TaskResult]) -> List[MultiTurnOutput]:
         results = []
         for r in result:
-            queries = get_tags(r.result, "query")
-            calls = get_tags(r.result, "function_call")
-            tool_response = get_tags(r.result, "tool")
+            nodes = parse_tags(r.result, ("dialogue", "query", "function_call", "tool"))
+            # turns may or may not be wrapped in <dialogue>
+            dialogues = [n for n in nodes if n.tag == "dialogue"]
+            turn_nodes = dialogues[0].children if dialogues else nodes
 
             traces = []
-            for q, c, t in zip(queries, calls, tool_response):
-                traces.append({"query": q})
-                traces.append({"function_call": c})
-                traces.append({"tool": t})
+            for turn in group_records(turn_nodes, ("query", "function_call", "tool")):
+                traces.append({"query": turn["query"]})
+                traces.append({"function_call": turn["function_call"]})
+                traces.append({"tool": turn["tool"]})
 
             results.append(
                 MultiTurnOutput(
@@ -5,8 +5,8 @@ from dria.models import TaskResult
 from pydantic import BaseModel, Field
 
 from dria_workflows import *
+from openai_utils import group_records, load_template, parse_tags
 from dria.factory.utilities import (
-    get_tags,
     parse_json,
     get_abs_path,
     extract_backtick_label,
@@ -41,17 +41,17 @@ class ParallelQuery(SingletonTemplate):
 
     def workflow(self):
 
-        builder = WorkflowBuilder(
-            scenario=self.scenario,
+        variables = dict(
             function_schema=self.function_schema,
             num_queries=str(self.num_queries),
         )
+        builder = WorkflowBuilder(scenario=self.scenario, **variables)
         builder.set_max_tokens(800)
         builder.set_max_time(85)
         builder.set_max_steps(3)
 
         builder.generative_step(
-            path=get_abs_path("prompt.md"),
+            prompt=load_template(get_abs_path("prompt.md"), variables).render(variables),
             operator=Operator.GENERATION,
             outputs=[Write.new("output")],
         )
@@ -65,10 +65,10 @@ class ParallelQuery(SingletonTemplate):
     def callback(self, result: List[TaskResult]) -> List[ParallelQueryOutput]:
         results = []
         for r in result:
-            calls = get_tags(r.result, "function_calls")
-            queries = get_tags(r.result, "user_query")
+            nodes = parse_tags(r.result, ("user_query", "function_calls"))
 
-            for q, c in zip(queries, calls):
+            for pair in group_records(nodes, ("user_query", "function_calls")):
+                q, c = pair["user_query"], pair["function_calls"]
                 results.append(
                     ParallelQueryOutput(
                         user_query=q,
@@ -0,0 +1,130 @@
+import logging
+import os
+import re
+from typing import List, Optional, Set
+
+import numpy as np
+
+from pipeline.minhash import LSHIndex, MinHasher, jaccard, words
+from pipeline.registry import FunctionEntry, FunctionRegistry
+
+# Similarity index over the run's functions, for hard-negative distractors:
+# functions that look alike (shared name parts, parameter names and types,
+# docstring words) but are not the target. Each function is a MinHash
+# signature of its token set; LSH buckets give the candidates of a lookup,
+# which are ranked by estimated Jaccard similarity, so a top-k query only
+# touches functions that share a band with the target.
+#
+# Signatures are persisted to <run_dir>/functions.minhash.npz (keyed by the
+# registry's signature hashes) and recomputed when the function index
+# changes; the LSH buckets are rebuilt from them on load.
+#
+#   S3_HARD_NEGATIVE_THRESHOLD   similarity the LSH banding is tuned for (default: 0.5)
+
+INDEX_NAME = "functions.minhash.npz"
+NUM_PERM = 128
+SEED = 1
+
+_CAMEL_RE = re.compile(r"(?<=[a-z0-9])(?=[A-Z])")
+# docstring filler that makes unrelated functions look alike
+_STOPWORDS = {
+    "a", "an", "and", "are", "as", "be", "by", "for", "from", "if", "in", "is", "it", "of",
+    "on", "or", "that", "the", "this", "to", "with", "returns", "return", "args", "given",
+}
+
+
+def _threshold() -> float:
+    try:
+        return float(os.getenv("S3_HARD_NEGATIVE_THRESHOLD", "0.5"))
+    except ValueError:
+        logging.warning("S3_HARD_NEGATIVE_THRESHOLD is not a number, using 0.5")
+        return 0.5
+
+
+def _identifier_words(name: str) -> List[str]:
+    return words(_CAMEL_RE.sub("_", name).replace("_", " "))
+
+
+def function_tokens(entry: FunctionEntry) -> Set[str]:
+    """Tokens of a function: name parts (and the name bigrams), parameter
+    name parts and types, and docstring words."""
+    tokens: Set[str] = set()
+    name = _identifier_words(entry.name)
+    tokens.update(f"name:{w}" for w in name)
+    tokens.update(f"name:{a}_{b}" for a, b in zip(name, name[1:]))
+    for p_name, p_type, _ in entry.parameters:
+        tokens.update(f"param:{w}" for w in _identifier_words(p_name or ""))
+        tokens.update(f"type:{w}" for w in words(p_type or ""))
+    text = " ".join([entry.description, *entry.param_descriptions.values()])
+    tokens.update(w for w in words(text) if w not in _STOPWORDS and len(w) > 2)
+    return tokens
+
+
+class FunctionSimilarityIndex:
+    def __init__(self, registry: FunctionRegistry, signatures: np.ndarray, threshold: float):
+        self.registry = registry
+        self.signatures = signatures
+        self._names = np.array([entry.name for entry in registry.functions], dtype=object)
+        self.lsh = LSHIndex(NUM_PERM, threshold)
+        for fid, signature in enumerate(signatures):
+            self.lsh.add(fid, signature)
+
+    @classmethod
+    def build(
+        cls, registry: FunctionRegistry, threshold: Optional[float] = None
+    ) -> "FunctionSimilarityIndex":
+        hasher = MinHasher(NUM_PERM, SEED)
+        signatures = hasher.signatures(function_tokens(entry) for entry in registry.functions)
+        return cls(registry, signatures, _threshold() if threshold is None else threshold)
+
+    def save(self, path: str) -> None:
+        hashes = np.array([entry.hash for entry in self.registry.functions], dtype="U32")
+        with open(path + ".tmp", "wb") as f:
+            np.savez(f, signatures=self.signatures, hashes=hashes, num_perm=NUM_PERM, seed=SEED)
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(
+        cls, path: str, registry: FunctionRegistry, threshold: Optional[float] = None
+    ) -> "FunctionSimilarityIndex":
+        with np.load(path) as data:
+            if int(data["num_perm"]) != NUM_PERM or int(data["seed"]) != SEED:
+                raise ValueError(f"{path} was built with different MinHash parameters")
+            hashes = data["hashes"].tolist()
+            if hashes != [entry.hash for entry in registry.functions]:
+                raise ValueError(f"{path} does not match the function index")
+            signatures = data["signatures"]
+        return cls(registry, signatures, _threshold() if threshold is None else threshold)
+
+    def similar(self, fid: int, k: int, exclude: Optional[Set[int]] = None) -> List[int]:
+        """Up to k functions most similar to fid, most similar first.
+        Functions named like the target are skipped: a same-name distractor
+        would make the expected call ambiguous."""
+        candidates = np.fromiter(self.lsh.candidates(self.signatures[fid]), dtype=np.int64)
+        skip = np.fromiter(exclude or (), dtype=np.int64)
+        keep = (self._names[candidates] != self._names[fid]) & ~np.isin(candidates, skip)
+        candidates = candidates[keep & (candidates != fid)]
+        if len(candidates) == 0:
+            return []
+        scores = jaccard(self.signatures[fid], self.signatures[candidates])
+        # ties broken by id so lookups are deterministic
+        order = np.lexsort((candidates, -scores))[:k]
+        return candidates[order].tolist()
+
+
+def similarity_index_path(run_dir: str) -> str:
+    return os.path.join(run_dir, INDEX_NAME)
+
+
+def load_similarity_index(run_dir: str, registry: FunctionRegistry) -> FunctionSimilarityIndex:
+    """The run's function similarity index, rebuilt if missing or stale."""
+    path = similarity_index_path(run_dir)
+    if os.path.exists(path):
+        try:
+            return FunctionSimilarityIndex.load(path, registry)
+        except (ValueError, KeyError, OSError) as e:
+            logging.warning(f"Rebuilding {path}: {e}")
+    index = FunctionSimilarityIndex.build(registry)
+    index.save(path)
+    logging.info(f"Similarity index: {len(registry)} function signature(s) written to {path}")
+    return index
@@ -1,64 +1,38 @@
+import argparse
 import json
+import logging
+import multiprocessing
 import os
 import re
 import ast
 import uuid
-from typing import Any, Dict, List, Tuple
+from collections import deque
+from itertools import chain, islice
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Tuple
 
+from openai_utils import export_events, merge_events, span, start_tracing, stop_tracing
+from pipeline.artifacts import Encoded, RecordWriter, artifact_path, format_of, iter_records
+from pipeline.registry import FunctionRegistry, function_index_path, load_function_index, tool_schema
 from pipeline.s2_functions.parser import parse_signature
 
-
-def _python_type_to_jsonschema(t: str) -> Dict[str, Any]:
-    t = t.strip()
-    # Basic mapping
-    if t.lower() in {"str", "string"}:
-        return {"type": "string"}
-    if t.lower() in {"int", "integer"}:
-        return {"type": "integer"}
-    if t.lower() in {"float", "double", "number"}:
-        return {"type": "number"}
-    if t.lower() in {"bool", "boolean"}:
-        return {"type": "boolean"}
-    if t.lower().startswith("list[") or t.lower() == "list":
-        # extract inner type if any
-        inner = "string"
-        m = re.match(r"list\[([^\]]+)\]", t, flags=re.IGNORECASE)
-        if m:
-            inner = m.group(1)
-        return {"type": "array", "items": _python_type_to_jsonschema(inner)}
-    if t.lower().startswith("dict[") or t.lower() == "dict":
-        # Generic object
-        return {"type": "object"}
-    # Fallback
-    return {"type": "string"}
+# Converts S3 artifacts to the tools/messages JSONL training format:
+# multi_turn_queries -> multi_turn_eng.jsonl, and likewise simple_eng,
+# parallel_eng and multiple_eng. Input is read in chunks that a process
+# pool converts (and JSON-encodes) in parallel; chunks are written back in
+# input order, with only a few in flight, so memory does not grow with the
+# input. With PIPELINE_TRACE=1 the workers' spans come back with their
+# chunks and are merged into trace_convert.json.
+#
+#   CONVERT_WORKERS    worker processes (default: the CPU count)
 
 
 def build_tool_from_signature(signature: str) -> Dict[str, Any]:
-    parsed = parse_signature(signature)
-    name = parsed.get("function_name", "unknown")
-    params = parsed.get("parameters", [])
-
-    properties: Dict[str, Any] = {}
-    required: List[str] = []
-
-    for p_name, p_type, p_default in params:
-        properties[p_name] = _python_type_to_jsonschema(p_type)
-        if p_default is None:
-            required.append(p_name)
-
-    schema = {
-        "name": name,
-        "description": f"Auto-generated tool for function {name}",
-        "parameters": {
-            "type": "object",
-            "properties": properties,
-            "required": required,
-        },
-    }
-    return schema
+    return tool_schema(parse_signature(signature))
 
 
 CALL_RE = re.compile(r"^\s*([A-Za-z_]\w*)\s*\((.*)\)\s*$", re.DOTALL)
+ASSIGN_RE = re.compile(r"^\s*[A-Za-z_]\w*\s*=\s*(?=[A-Za-z_]\w*\s*\()")
+FENCE_RE = re.compile(r"^\s*```[\w-]*\s*$", re.MULTILINE)
 
 
 def _split_args(arg_str: str) -> List[str]:
@@ -94,6 +68,27 @@ def _split_args(arg_str: str) -> List[str]:
     return [p for p in parts if p]
 
 
+def _literal(node: ast.expr) -> Any:
+    try:
+        return ast.literal_eval(node)
+    except Exception:
+        return ast.unparse(node) if hasattr(ast, "unparse") else str(node)
+
+
+def _call_arguments(call_node: ast.Call, param_names: List[str]) -> Dict[str, Any]:
+    args_out: Dict[str, Any] = {}
+    # positional
+    for i, arg in enumerate(call_node.args):
+        if i < len(param_names):
+            args_out[param_names[i]] = _literal(arg)
+    # keywords
+    for kw in call_node.keywords:
+        if kw.arg is None:
+            continue
+        args_out[kw.arg] = _literal(kw.value)
+    return args_out
+
+
 def parse_function_call(call: str, param_names: List[str]) -> Tuple[str, Dict[str, Any]]:
     m = CALL_RE.match(call)
     if not m:
@@ -106,25 +101,7 @@ def parse_function_call(call: str, param_names: List[str]) -> Tuple[str, Dict[st
         node = ast.parse(f"f({args_str})", mode="eval")
         if not isinstance(node.body, ast.Call):
             raise ValueError("not a call")
-        call_node: ast.Call = node.body  # type: ignore
-        args_out: Dict[str, Any] = {}
-        # positional
-        for i, arg in enumerate(call_node.args):
-            if i < len(param_names):
-                try:
-                    args_out[param_names[i]] = ast.literal_eval(arg)
-                except Exception:
-                    args_out[param_names[i]] = ast.unparse(arg) if hasattr(ast, "unparse") else str(arg)
-        # keywords
-        for kw in call_node.keywords:
-            key = kw.arg if kw.arg is not None else None
-            if key is None:
-                continue
-            try:
-                args_out[key] = ast.literal_eval(kw.value)
-            except Exception:
-                args_out[key] = ast.unparse(kw.value) if hasattr(ast, "unparse") else str(kw.value)
-        return name, args_out
+        return name, _call_arguments(node.body, param_names)
     except Exception:
         # Fallback manual split
         args_out: Dict[str, Any] = {}
@@ -141,116 +118,318 @@ def parse_function_call(call: str, param_names: List[str]) -> Tuple[str, Dict[st
         return name, args_out
 
 
-def convert(run_id: str, out_path: str | None = None) -> str:
-    base_dir = os.path.join("pipeline", "data", run_id)
-    functions_fp = os.path.join(base_dir, "functions.json")
-    multi_turn_fp = os.path.join(base_dir, "multi_turn_queries.json")
+def parse_calls(
+    block: str, names_for: Callable[[str], List[str]]
+) -> List[Tuple[str, Dict[str, Any]]]:
+    """Every call in a simple/parallel <function_call(s)> block, e.g.
+    "a = f(x=1)\nb = f(x=2)", parsed with a single ast.parse."""
+    text = FENCE_RE.sub("", block).strip()
+    try:
+        module = ast.parse(text)
+    except SyntaxError:
+        # line by line, without the result variable
+        calls = []
+        for line in text.splitlines():
+            line = ASSIGN_RE.sub("", line, count=1)
+            m = CALL_RE.match(line)
+            if m:
+                calls.append(parse_function_call(line, names_for(m.group(1))))
+        return calls
+    calls = []
+    for stmt in module.body:
+        value = getattr(stmt, "value", None) if isinstance(stmt, (ast.Assign, ast.AnnAssign, ast.Expr)) else None
+        if not isinstance(value, ast.Call):
+            continue
+        func = value.func
+        name = func.id if isinstance(func, ast.Name) else func.attr if isinstance(func, ast.Attribute) else None
+        if name:
+            calls.append((name, _call_arguments(value, names_for(name))))
+    return calls
+
 
-    if not os.path.exists(functions_fp) or not os.path.exists(multi_turn_fp):
-        raise FileNotFoundError("Required files not found. Make sure functions.json and multi_turn_queries.json exist.")
+# query type -> (S3 artifact, converted output)
+KINDS: Dict[str, Tuple[str, str]] = {
+    "multi_turn": ("multi_turn_queries", "multi_turn_eng"),
+    "simple": ("simple_queries", "simple_eng"),
+    "parallel": ("parallel_queries", "parallel_eng"),
+    "multiple": ("multiple_queries", "multiple_eng"),
+}
 
-    with open(functions_fp, "r", encoding="utf-8") as f:
-        functions_data = json.load(f)
+# the function registry of the run being converted, per process
+_registry: Optional[FunctionRegistry] = None
 
-    # Build function signature map: name -> signature
-    name_to_sig: Dict[str, str] = {}
-    name_to_param_names: Dict[str, List[str]] = {}
 
-    for entry in functions_data:
-        for func in entry.get("functions", []):
-            sig = func["function"]
+def _build_tools(function_schemas: List[str]) -> Tuple[List[Dict[str, Any]], Dict[str, List[str]]]:
+    # tools from function_schemas; their parameter names resolve the
+    # sample's calls, falling back to any function of that name
+    tools: List[Dict[str, Any]] = []
+    param_names: Dict[str, List[str]] = {}
+    for sig in function_schemas:
+        entry = _registry.lookup(sig)
+        if entry is not None:
+            name, tool, names = entry.name, entry.tool, entry.param_names
+        else:
+            # not one of this run's functions: parse it here
             parsed = parse_signature(sig)
             name = parsed.get("function_name")
-            if not name:
-                continue
-            name_to_sig[name] = sig
-            name_to_param_names[name] = [p[0] for p in parsed.get("parameters", [])]
+            tool = tool_schema(parsed)
+            names = [p[0] for p in parsed.get("parameters", [])]
+        if not name or name in param_names:
+            continue
+        tools.append(tool)
+        param_names[name] = names
+    return tools, param_names
+
+
+def _names_for(param_names: Dict[str, List[str]], name: str) -> List[str]:
+    names = param_names.get(name)
+    if names is None:
+        same_name = _registry.named(name)
+        names = same_name[0].param_names if same_name else []
+    return names
+
+
+def _multi_turn_item(run_id: str, idx: int, sample: Dict[str, Any]) -> Dict[str, Any]:
+    trace: List[Dict[str, str]] = sample.get("trace", [])
+    tools, param_names = _build_tools(sample.get("function_schemas", []))
+
+    # build messages from trace triples
+    messages: List[Dict[str, Any]] = []
+    # iterate in steps of 3: query, function_call, tool
+    i = 0
+    while i < len(trace):
+        t = trace[i:i+3]
+        if len(t) < 2:
+            break
+        q = t[0].get("query") if "query" in t[0] else None
+        fc = None
+        tool_resp = None
+        if len(t) >= 2:
+            fc = t[1].get("function_call") if "function_call" in t[1] else None
+        if len(t) >= 3:
+            tool_resp = t[2].get("tool") if "tool" in t[2] else None
+
+        if q:
+            messages.append({"role": "user", "content": q})
+        if fc:
+            m = CALL_RE.match(fc)
+            func_name = None
+            args_obj: Dict[str, Any] = {}
+            if m:
+                func_name, args_obj = parse_function_call(fc, _names_for(param_names, m.group(1)))
+                # parse_function_call returns name, args
+            # Build assistant with tool_calls
+            if func_name:
+                messages.append({
+                    "role": "assistant",
+                    "tool_calls": [
+                        {
+                            "type": "function",
+                            "function": {
+                                "name": func_name,
+                                "arguments": args_obj,
+                            }
+                        }
+                    ]
+                })
+        if tool_resp is not None:
+            # Tool responses are strings or JSON-like
+            # Keep as string
+            messages.append({"role": "tool", "content": str(tool_resp)})
+        i += 3
+
+    return {
+        "id": f"ex_{run_id}_{idx:06d}_{uuid.uuid4().hex[:8]}",
+        "tools": tools,
+        "messages": messages,
+        "label_kind": "full",
+    }
+
+
+def _query_item(kind: str, run_id: str, idx: int, sample: Dict[str, Any]) -> Dict[str, Any]:
+    """One user query answered by one (simple, multiple) or several
+    (parallel) tool calls; multiple queries offer the distractors as tools."""
+    schemas = sample.get("function_schemas")
+    if schemas is None:
+        schemas = [sample["function_schema"]] if sample.get("function_schema") else []
+    tools, param_names = _build_tools(schemas)
+    calls = parse_calls(sample.get("function_call", ""), lambda name: _names_for(param_names, name))
+
+    messages: List[Dict[str, Any]] = [{"role": "user", "content": sample.get("user_query", "")}]
+    if calls:
+        messages.append({
+            "role": "assistant",
+            "tool_calls": [
+                {"type": "function", "function": {"name": name, "arguments": args}}
+                for name, args in calls
+            ],
+        })
+    return {
+        "id": f"ex_{run_id}_{kind}_{idx:06d}_{uuid.uuid4().hex[:8]}",
+        "tools": tools,
+        "messages": messages,
+        "label_kind": "full",
+    }
 
-    with open(multi_turn_fp, "r", encoding="utf-8") as f:
-        multi_turn_data = json.load(f)
+
+def _init_worker(base_dir: str) -> None:
+    global _registry
+    with span("load_functions", cat="parse"):
+        _registry = FunctionRegistry.load(function_index_path(base_dir))
+
+
+def _convert_chunk(task: Tuple[str, str, int, List[Any]]) -> List[str]:
+    """JSON lines for a chunk of samples; raw JSONL lines are decoded here,
+    in the worker."""
+    kind, run_id, start, samples = task
+    lines = []
+    with span("convert_chunk", cat="parse", kind=kind, start=start, samples=len(samples)):
+        for offset, sample in enumerate(samples):
+            if isinstance(sample, (bytes, str)):
+                sample = json.loads(sample)
+            if kind == "multi_turn":
+                item = _multi_turn_item(run_id, start + offset, sample)
+            else:
+                item = _query_item(kind, run_id, start + offset, sample)
+            lines.append(json.dumps(item, ensure_ascii=False))
+    return lines
+
+
+def _convert_chunk_traced(task: Tuple[str, str, int, List[Any]]) -> Tuple[List[str], List[Any]]:
+    """_convert_chunk in a pool worker, with the spans it recorded."""
+    lines = _convert_chunk(task)
+    return lines, export_events()
+
+
+def _chunks(path: str, size: int) -> Iterator[Tuple[int, List[Any]]]:
+    """(index of the first sample, samples) in input order. JSONL lines are
+    passed on undecoded, so decoding happens in the workers too."""
+    with open(path, "rb") as f:
+        if format_of(path) == "jsonl":
+            records: Iterator[Any] = (line for line in f if line.strip())
+        else:
+            records = iter_records(path)
+        start = 0
+        while True:
+            chunk = list(islice(records, size))
+            if not chunk:
+                return
+            yield start, chunk
+            start += len(chunk)
+
+
+def _ordered_map(
+    tasks: Iterator[Tuple[str, str, int, List[Any]]], workers: int, base_dir: str
+) -> Iterator[List[str]]:
+    """_convert_chunk over tasks on a process pool, results in task order.
+    At most two chunks per worker are in flight, so input is streamed."""
+    first = next(tasks, None)
+    if first is None:
+        return
+    second = next(tasks, None)
+    if workers <= 1 or second is None:
+        # one chunk is not worth starting a pool for
+        yield _convert_chunk(first)
+        if second is not None:
+            yield _convert_chunk(second)
+            for task in tasks:
+                yield _convert_chunk(task)
+        return
+    def result(pending: Deque[Any]) -> List[str]:
+        lines, events = pending.popleft().get()
+        merge_events(events, "convert worker")
+        return lines
+
+    with multiprocessing.Pool(workers, initializer=_init_worker, initargs=(base_dir,)) as pool:
+        pending: Deque[Any] = deque()
+        for task in chain((first, second), tasks):
+            pending.append(pool.apply_async(_convert_chunk_traced, (task,)))
+            if len(pending) >= 2 * workers:
+                yield result(pending)
+        while pending:
+            yield result(pending)
+
+
+def _workers() -> int:
+    try:
+        return max(1, int(os.getenv("CONVERT_WORKERS", "0")) or os.cpu_count() or 1)
+    except ValueError:
+        return os.cpu_count() or 1
+
+
+def convert_kind(
+    run_id: str,
+    kind: str,
+    out_path: Optional[str] = None,
+    workers: Optional[int] = None,
+    chunk_size: int = 1000,
+) -> str:
+    """Convert one query type's artifact to <kind>_eng.jsonl."""
+    global _registry
+    base_dir = os.path.join("pipeline", "data", run_id)
+    artifact, output = KINDS[kind]
+    # either format (.json / .jsonl) is accepted for both inputs
+    try:
+        artifact_path(base_dir, "functions")
+        input_fp = artifact_path(base_dir, artifact)
+    except FileNotFoundError:
+        raise FileNotFoundError(f"Required files not found. Make sure functions.json and {artifact}.json exist.")
+
+    # parsed signatures and tool schemas, built once by S2 (functions.index)
+    with span("load_functions", cat="parse"):
+        _registry = load_function_index(base_dir)
 
     if out_path is None:
-        out_path = os.path.join(base_dir, "multi_turn_eng.jsonl")
-
-    written = 0
-    with open(out_path, "w", encoding="utf-8") as out:
-        for idx, sample in enumerate(multi_turn_data):
-            trace: List[Dict[str, str]] = sample.get("trace", [])
-            function_schemas: List[str] = sample.get("function_schemas", [])
-
-            # tools from function_schemas
-            tools: List[Dict[str, Any]] = []
-            tool_names_seen = set()
-            for sig in function_schemas:
-                parsed = parse_signature(sig)
-                name = parsed.get("function_name")
-                if not name or name in tool_names_seen:
-                    continue
-                tools.append(build_tool_from_signature(sig))
-                tool_names_seen.add(name)
-
-            # build messages from trace triples
-            messages: List[Dict[str, Any]] = []
-            # iterate in steps of 3: query, function_call, tool
-            i = 0
-            while i < len(trace):
-                t = trace[i:i+3]
-                if len(t) < 2:
-                    break
-                q = t[0].get("query") if "query" in t[0] else None
-                fc = None
-                tool_resp = None
-                if len(t) >= 2:
-                    fc = t[1].get("function_call") if "function_call" in t[1] else None
-                if len(t) >= 3:
-                    tool_resp = t[2].get("tool") if "tool" in t[2] else None
-
-                if q:
-                    messages.append({"role": "user", "content": q})
-                if fc:
-                    m = CALL_RE.match(fc)
-                    func_name = None
-                    args_obj: Dict[str, Any] = {}
-                    if m:
-                        func_name, args_obj = parse_function_call(fc, name_to_param_names.get(m.group(1), []))
-                        # parse_function_call returns name, args
-                    # Build assistant with tool_calls
-                    if func_name:
-                        messages.append({
-                            "role": "assistant",
-                            "tool_calls": [
-                                {
-                                    "type": "function",
-                                    "function": {
-                                        "name": func_name,
-                                        "arguments": args_obj,
-                                    }
-                                }
-                            ]
-                        })
-                if tool_resp is not None:
-                    # Tool responses are strings or JSON-like
-                    # Keep as string
-                    messages.append({"role": "tool", "content": str(tool_resp)})
-                i += 3
-
-            item = {
-                "id": f"ex_{run_id}_{idx:06d}_{uuid.uuid4().hex[:8]}",
-                "tools": tools,
-                "messages": messages,
-                "label_kind": "full",
-            }
-            out.write(json.dumps(item, ensure_ascii=False) + "\n")
-            written += 1
+        out_path = os.path.join(base_dir, f"{output}.jsonl")
+    workers = workers or _workers()
+
+    tasks = ((kind, run_id, start, chunk) for start, chunk in _chunks(input_fp, chunk_size))
+    with span("convert", cat="parse", kind=kind, workers=workers), RecordWriter(out_path, "jsonl") as out:
+        for lines in _ordered_map(tasks, workers, base_dir):
+            out.write_many(Encoded(line) for line in lines)
+    logging.info(f"Converted {kind}: {out.count} sample(s) -> {out_path}")
     return out_path
 
 
+def convert(run_id: str, out_path: str | None = None, workers: Optional[int] = None) -> str:
+    return convert_kind(run_id, "multi_turn", out_path, workers)
+
+
+def convert_all(run_id: str, kinds: Optional[List[str]] = None, workers: Optional[int] = None) -> List[str]:
+    """Convert every requested query type whose artifact exists."""
+    base_dir = os.path.join("pipeline", "data", run_id)
+    written = []
+    for kind in kinds or list(KINDS):
+        try:
+            artifact_path(base_dir, KINDS[kind][0])
+        except FileNotFoundError:
+            if kinds:
+                raise
+            continue
+        written.append(convert_kind(run_id, kind, workers=workers))
+    return written
+
+
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument(
+        "--kinds", nargs="+", choices=list(KINDS), help="query types to convert (default: all present)"
+    )
+    arg_parser.add_argument(
+        "--workers", type=int, help="worker processes (default: CONVERT_WORKERS or the CPU count)"
+    )
+    args = arg_parser.parse_args()
     # Auto-detect run_id file
     run_id_fp = os.path.join(os.getcwd(), "run_id")
     if not os.path.exists(run_id_fp):
         raise SystemExit("run_id file not found. Please create one or pass run_id explicitly by editing the script.")
     with open(run_id_fp, "r", encoding="utf-8") as f:
         run_id = f.read().strip()
-    out = convert(run_id)
-    print(f"Wrote: {out}")
+    start_tracing(os.path.join("pipeline", "data", run_id, "trace_convert.json"))
+    try:
+        outputs = convert_all(run_id, args.kinds, args.workers)
+    finally:
+        stop_tracing()
+    for out in outputs:
+        print(f"Wrote: {out}")
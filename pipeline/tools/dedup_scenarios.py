@@ -0,0 +1,162 @@
+import json
+import logging
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from openai_utils import pack_size
+from pipeline.artifacts import RecordWriter, artifact_path, iter_records
+from pipeline.minhash import LSHIndex, MinHasher, jaccard, shingles
+
+# Near-duplicate scenario pruning between S1 and S2.
+# Models asked for several scenarios per curriculum row often return almost
+# the same text, and every duplicate costs an S2 request plus its S3 fan-out.
+# scenarios are streamed once: each is MinHashed over word shingles, its LSH
+# candidates among the scenarios kept so far are checked, and it is dropped
+# when one is at least the threshold similar. Only the kept signatures and
+# LSH buckets stay in memory (num_perm * 4 bytes per kept scenario, no text).
+# scenarios.json is rewritten in place; dropped scenarios go to
+# scenarios_pruned.jsonl with the kept scenario they duplicate (their
+# cluster; "index" and "duplicate_of" are both positions in the input), and
+# the counts and saved requests to scenario_dedup.json.
+#
+#   S1_DEDUP=0                   keep every scenario
+#   S1_DEDUP_THRESHOLD           estimated Jaccard similarity to drop at (default: 0.7)
+#   S1_DEDUP_SHINGLE             words per shingle (default: 3)
+
+NUM_PERM = 64
+SEED = 1
+PRUNED_NAME = "scenarios_pruned.jsonl"
+SUMMARY_NAME = "scenario_dedup.json"
+
+
+def _env_number(name: str, default, cast):
+    try:
+        return cast(os.getenv(name, str(default)))
+    except ValueError:
+        logging.warning(f"{name} is not a number, using {default}")
+        return default
+
+
+def dedup_enabled() -> bool:
+    return os.getenv("S1_DEDUP", "1") != "0"
+
+
+class _Signatures:
+    """Growable (n, num_perm) array of the kept scenarios' signatures."""
+
+    def __init__(self, num_perm: int):
+        self._data = np.empty((1024, num_perm), dtype=np.uint32)
+        self._size = 0
+
+    def append(self, signature: np.ndarray) -> None:
+        if self._size == len(self._data):
+            self._data = np.concatenate([self._data, np.empty_like(self._data)])
+        self._data[self._size] = signature
+        self._size += 1
+
+    def __getitem__(self, rows) -> np.ndarray:
+        return self._data[: self._size][rows]
+
+
+def _s3_generators() -> Tuple[int, int]:
+    """(requests per scenario, requests per function) of the S3 generators
+    run_s3_openai enables: multi-turn per scenario, simple and parallel per
+    function (before packing)."""
+    if os.getenv("ONLY_MULTI_TURN", "0") == "1":
+        return 1, 0
+    per_scenario = int(os.getenv("ENABLE_MULTI_TURN", "1") == "1")
+    per_function = sum(os.getenv(name, "1") == "1" for name in ("ENABLE_SIMPLE", "ENABLE_PARALLEL"))
+    return per_scenario, per_function
+
+
+def _s3_requests_per_scenario() -> Optional[int]:
+    """S3 requests one scenario turns into. Only known when S2_MAX_FUNCTIONS
+    caps the functions per scenario (or no per-function generator runs)."""
+    per_scenario, per_function = _s3_generators()
+    if per_function == 0:
+        return per_scenario
+    max_functions = os.getenv("S2_MAX_FUNCTIONS", "")
+    if not max_functions.isdigit():
+        return None
+    return round(per_scenario + per_function / pack_size("S3") * int(max_functions))
+
+
+def prune_scenarios(
+    run_dir: str, threshold: Optional[float] = None, shingle: Optional[int] = None
+) -> Dict[str, Any]:
+    """Drop near-duplicate scenarios from the run's scenarios artifact."""
+    if threshold is None:
+        threshold = _env_number("S1_DEDUP_THRESHOLD", 0.7, float)
+    if shingle is None:
+        shingle = max(1, _env_number("S1_DEDUP_SHINGLE", 3, int))
+    path = artifact_path(run_dir, "scenarios")
+    hasher = MinHasher(NUM_PERM, SEED)
+    lsh = LSHIndex(NUM_PERM, threshold)
+    signatures = _Signatures(NUM_PERM)
+    # input position of each kept scenario, by its LSH id
+    kept_index: List[int] = []
+
+    total = kept = 0
+    # writing to a temporary file lets the original be streamed meanwhile
+    with RecordWriter(path) as writer, RecordWriter(
+        os.path.join(run_dir, PRUNED_NAME), "jsonl"
+    ) as pruned:
+        for index, record in enumerate(iter_records(path)):
+            total += 1
+            signature = hasher.signature(shingles(record.get("scenario", ""), shingle))
+            candidates = np.fromiter(lsh.candidates(signature), dtype=np.int64)
+            if len(candidates):
+                scores = jaccard(signature, signatures[candidates])
+                best = int(np.argmax(scores))
+                if scores[best] >= threshold:
+                    pruned.write(
+                        {
+                            "index": index,
+                            "duplicate_of": kept_index[int(candidates[best])],
+                            "similarity": round(float(scores[best]), 3),
+                            **record,
+                        }
+                    )
+                    continue
+            lsh.add(kept, signature)
+            signatures.append(signature)
+            kept_index.append(index)
+            writer.write(record)
+            kept += 1
+
+    dropped = total - kept
+    per_scenario = _s3_requests_per_scenario()
+    summary = {
+        "scenarios": total,
+        "kept": kept,
+        "dropped": dropped,
+        "threshold": threshold,
+        "shingle": shingle,
+        "s2_requests_saved": -(-dropped // pack_size("S2")),
+        "s3_requests_saved": dropped * per_scenario if per_scenario is not None else None,
+    }
+    with open(os.path.join(run_dir, SUMMARY_NAME), "w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=2)
+    s3_saved = (
+        f"{summary['s3_requests_saved']}"
+        if per_scenario is not None
+        else f"{dropped} x ({_s3_generators()[0]} + {_s3_generators()[1]} per function)"
+    )
+    logging.info(
+        f"Scenario dedup: kept {kept}/{total}, dropped {dropped} near-duplicate(s) "
+        f"(threshold {threshold}); saves {summary['s2_requests_saved']} S2 and "
+        f"{s3_saved} S3 request(s)"
+    )
+    return summary
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    run_id_fp = os.path.join(os.getcwd(), "run_id")
+    if not os.path.exists(run_id_fp):
+        raise SystemExit("run_id file not found. Run from the repository root after S1.")
+    with open(run_id_fp, "r", encoding="utf-8") as f:
+        run_id = f.read().strip()
+    prune_scenarios(os.path.join("pipeline", "data", run_id))
@@ -114,6 +114,7 @@ def main(path: str) -> int:
 
 if __name__ == "__main__":
     if len(sys.argv) < 2:
-        print("Usage: python pipeline/tools/validate_multi_turn_eng.py <path-to-jsonl>")
+        print("Usage: python pipeline/tools/validate_multi_turn_eng.py <path-to-jsonl> [...]")
         sys.exit(2)
-    sys.exit(main(sys.argv[1]))
+    # every file is checked and reported, the exit code covers them all
+    sys.exit(max([main(path) for path in sys.argv[1:]]))
@@ -2,6 +2,7 @@ import asyncio
 from pydantic import BaseModel
 from dria import DriaDataset, DatasetGenerator, Model, Dria
 from pipeline.s1_scenario import Scenario
+from pipeline.tools.dedup_scenarios import dedup_enabled, prune_scenarios
 import uuid
 import logging
 import os
@@ -58,6 +59,8 @@ async def generate_scenarios(run_id):
         ],
     )
     dataset.to_json(filepath=f"pipeline/data/{run_id}/scenarios.json")
+    if dedup_enabled():
+        prune_scenarios(f"pipeline/data/{run_id}")
 
 
 async def main():
@@ -1,13 +1,23 @@
+import argparse
 import asyncio
 import csv
-import json
 import logging
 import os
 import uuid
-import time
 from typing import List, Dict
-from tqdm import tqdm
-from openai_utils import render_template, extract_tags, chat_complete
+from openai_utils import (
+    assemble_prompt,
+    extract_tags,
+    IncrementalTagParser,
+    close_clients,
+    open_clients,
+    set_cache_namespace,
+    open_usage_ledger,
+    start_tracing,
+)
+from pipeline.artifacts import output_path, write_records
+from pipeline.journal import StageJournal, input_key, run_journaled
+from pipeline.tools.dedup_scenarios import dedup_enabled, prune_scenarios
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 
@@ -29,7 +39,6 @@ async def generate_scenarios_openai(run_id: str):
     os.makedirs(f"pipeline/data/{run_id}", exist_ok=True)
 
     template_path = "pipeline/s1_scenario/prompt.md"
-    data: List[Dict] = []
 
     rows = read_curriculum("pipeline/data/curriculum.csv")
     # Optional: limit number of curriculum rows (to reduce API calls)
@@ -39,50 +48,86 @@ async def generate_scenarios_openai(run_id: str):
             rows = rows[: int(s1_limit_rows)]
         except Exception:
             pass
-    for row in tqdm(rows):
-        prompt = render_template(
+    system = (
+        "You are a careful data generator. Follow the format strictly and wrap each scenario inside <scenario> tags."
+    )
+
+    num_scenarios = os.getenv("S1_NUM_SCENARIOS", "1")
+    scenario_cap = int(num_scenarios) if num_scenarios.isdigit() else None
+
+    def build_prompt(row: Dict[str, str]) -> str:
+        return assemble_prompt(
             template_path,
             {
                 "domain": row["domain"],
                 "subdomain": row["subdomain"],
                 # default number of scenarios
-                "num_scenarios": os.getenv("S1_NUM_SCENARIOS", "1"),
+                "num_scenarios": num_scenarios,
             },
+            trailing=("domain", "subdomain"),
         )
-        system = (
-            "You are a careful data generator. Follow the format strictly and wrap each scenario inside <scenario> tags."
-        )
-        content = chat_complete(prompt=prompt, system=system)
-        scenarios = extract_tags(content, "scenario")
-        for sce in scenarios:
-            data.append(
-                {
-                    "domain": row["domain"],
-                    "subdomain": row["subdomain"],
-                    "entities": row.get("entities", ""),
-                    "scenario": sce.strip(),
-                }
-            )
-        # Optional: rate limiting sleep between calls
-        try:
-            rate_sleep = float(os.getenv("OPENAI_RATE_SLEEP", "0"))
-            if rate_sleep > 0:
-                time.sleep(rate_sleep)
-        except Exception:
-            pass
 
-    with open(f"pipeline/data/{run_id}/scenarios.json", "w", encoding="utf-8") as f:
-        f.write(json.dumps(data, ensure_ascii=False, indent=2))
+    def parse_row(row: Dict[str, str], content: str) -> List[Dict[str, str]]:
+        return [
+            {
+                "domain": row["domain"],
+                "subdomain": row["subdomain"],
+                "entities": row.get("entities", ""),
+                "scenario": sce.strip(),
+            }
+            # the same cap whatever the transport (stream, pack, batch, cache)
+            for sce in extract_tags(content, "scenario")[:scenario_cap]
+        ]
+
+    keys = [input_key(i, row, num_scenarios) for i, row in enumerate(rows)]
+    with StageJournal(f"pipeline/data/{run_id}/journal/scenarios.jsonl") as journal:
+        await run_journaled(
+            journal,
+            list(zip(keys, rows)),
+            build_prompt,
+            parse_row,
+            system=system,
+            stage="S1",
+            batch_dir=f"pipeline/data/{run_id}/batch",
+            batch_name="s1_scenarios",
+            # when streaming, stop once the requested number of scenarios is in
+            make_parser=lambda: IncrementalTagParser(("scenario",), target=scenario_cap),
+        )
+        write_records(
+            output_path(f"pipeline/data/{run_id}", "scenarios"), journal.iter_outputs(keys)
+        )
+    if dedup_enabled():
+        prune_scenarios(f"pipeline/data/{run_id}")
 
 
-async def main():
-    run_id = uuid.uuid4().hex
-    with open("run_id", "w", encoding="utf-8") as f:
-        f.write(run_id)
+async def main(resume: bool = False):
+    if resume and os.path.exists("run_id"):
+        # continue the interrupted run recorded in ./run_id
+        with open("run_id", "r", encoding="utf-8") as f:
+            run_id = f.read().strip()
+    else:
+        run_id = uuid.uuid4().hex
+        with open("run_id", "w", encoding="utf-8") as f:
+            f.write(run_id)
     logging.info(f"Run ID: {run_id}")
-    await generate_scenarios_openai(run_id)
+    set_cache_namespace(run_id)
+    open_clients()
+    open_usage_ledger(f"pipeline/data/{run_id}")
+    start_tracing(f"pipeline/data/{run_id}/trace_s1.json")
+    try:
+        await generate_scenarios_openai(run_id)
+    finally:
+        await close_clients()
     logging.info("Generated Scenarios (OpenAI mode)")
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--batch", action="store_true", help="use the OpenAI Batch API")
+    arg_parser.add_argument(
+        "--resume", action="store_true", help="continue the run in ./run_id instead of starting a new one"
+    )
+    args = arg_parser.parse_args()
+    if args.batch:
+        os.environ["OPENAI_BATCH"] = "1"
+    asyncio.run(main(resume=args.resume))
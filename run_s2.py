@@ -1,6 +1,7 @@
 import asyncio
 from dria import DriaDataset, DatasetGenerator, Model, Dria
 from pipeline import Scenario, Functions
+from pipeline.registry import write_function_index
 import logging
 import os
 from dotenv import load_dotenv
@@ -48,6 +49,7 @@ async def generate_functions(run_id):
         ],
     )
     dataset.to_json(filepath=f"pipeline/data/{run_id}/functions.json")
+    write_function_index(f"pipeline/data/{run_id}")
 
 
 async def main():
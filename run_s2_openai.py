@@ -1,11 +1,26 @@
+import argparse
 import asyncio
 import json
 import logging
 import os
-import time
+from itertools import islice
 from typing import Any, Dict, List
-from tqdm import tqdm
-from openai_utils import render_template, extract_tags, extract_code_fence, chat_complete
+from openai_utils import (
+    assemble_prompt,
+    render_packed,
+    pack_size,
+    parse_tags,
+    extract_code_fence,
+    IncrementalTagParser,
+    close_clients,
+    open_clients,
+    set_cache_namespace,
+    open_usage_ledger,
+    start_tracing,
+)
+from pipeline.artifacts import artifact_path, iter_records, output_path, write_records
+from pipeline.journal import StageJournal, keyed, run_journaled
+from pipeline.registry import write_function_index
 from pipeline.s2_functions.parser import parse_signature
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
@@ -44,76 +59,111 @@ def _coerce_expected(expected_text: str, return_type: str) -> Any:
 
 async def generate_functions_openai(run_id: str):
     # read scenarios
-    with open(f"pipeline/data/{run_id}/scenarios.json", "r", encoding="utf-8") as f:
-        scenario_inputs: List[Dict[str, Any]] = json.load(f)
+    scenarios_fp = artifact_path(f"pipeline/data/{run_id}", "scenarios")
 
     # Optional: limit number of scenarios to process (to reduce API calls)
-    s2_limit = os.getenv("S2_LIMIT_SCENARIOS")
-    if s2_limit:
+    s2_limit = None
+    if os.getenv("S2_LIMIT_SCENARIOS"):
         try:
-            scenario_inputs = scenario_inputs[: int(s2_limit)]
+            s2_limit = int(os.getenv("S2_LIMIT_SCENARIOS"))
         except Exception:
             pass
 
     template_path = "pipeline/s2_functions/prompt.md"
-    out: List[Dict[str, Any]] = []
 
-    for inp in tqdm(scenario_inputs):
-        prompt = render_template(template_path, {"scenario": inp["scenario"]})
-        system = (
-            "You are a careful data generator. Follow the format strictly, include multiple <function> blocks each with a <signature> code fence and an <expected> value."
-        )
-        content = chat_complete(prompt=prompt, system=system)
-        func_blocks = extract_tags(content, "function")
+    system = (
+        "You are a careful data generator. Follow the format strictly, include multiple <function> blocks each with a <signature> code fence and an <expected> value."
+    )
+
+    # Optional: cap functions per scenario; when streaming, the request is
+    # also cancelled once this many complete <function> blocks have arrived
+    max_functions = os.getenv("S2_MAX_FUNCTIONS", "")
+    function_cap = int(max_functions) if max_functions.isdigit() else None
+
+    def build_prompt(inp: Dict[str, Any]) -> str:
+        return assemble_prompt(template_path, {"scenario": inp["scenario"]}, trailing=("scenario",))
+
+    def build_pack(inps: List[Dict[str, Any]]) -> str:
+        return render_packed(template_path, {}, "scenario", [inp["scenario"] for inp in inps])
+
+    def parse_scenario(inp: Dict[str, Any], content: str) -> Dict[str, Any]:
+        func_blocks = parse_tags(content, ("function", "signature", "expected"))
 
         functions: List[Dict[str, Any]] = []
         for fb in func_blocks:
-            sig_blocks = extract_tags(fb, "signature")
-            if not sig_blocks:
+            if fb.tag != "function":
+                continue
+            signature = fb.first("signature")
+            if signature is None:
                 continue
             # extract code fence labelled python from signature tag content
-            code_blocks = extract_code_fence(sig_blocks[0], lang="python")
+            code_blocks = extract_code_fence(signature, lang="python")
             if not code_blocks:
                 continue
             schema = code_blocks[0]
             parsed = parse_signature(schema)
             return_type = parsed.get("return_type", "")
 
-            exp_blocks = extract_tags(fb, "expected")
-            expected_raw = exp_blocks[0] if exp_blocks else ""
+            expected_raw = fb.first("expected") or ""
             expected = _coerce_expected(expected_raw, return_type)
 
             functions.append({"function": schema, "expected": expected})
 
-        out.append(
-            {
-                "scenario": inp["scenario"],
-                "domain": inp["domain"],
-                "subdomain": inp["subdomain"],
-                "functions": functions,
-            }
+        return {
+            "scenario": inp["scenario"],
+            "domain": inp["domain"],
+            "subdomain": inp["subdomain"],
+            # the same cap whatever the transport (stream, pack, batch, cache)
+            "functions": functions[:function_cap],
+        }
+
+    def jobs():
+        # scenarios are streamed from disk on each pass, never held as a list
+        return keyed(islice(iter_records(scenarios_fp), s2_limit), max_functions)
+
+    with StageJournal(f"pipeline/data/{run_id}/journal/functions.jsonl") as journal:
+        await run_journaled(
+            journal,
+            jobs(),
+            build_prompt,
+            parse_scenario,
+            system=system,
+            stage="S2",
+            batch_dir=f"pipeline/data/{run_id}/batch",
+            batch_name="s2_functions",
+            make_parser=lambda: IncrementalTagParser(
+                ("function",),
+                children=("signature", "expected"),
+                target=function_cap,
+            ),
+            pack_size=pack_size("S2"),
+            build_pack=build_pack,
         )
-
-        # Optional: rate limiting sleep between calls
-        try:
-            rate_sleep = float(os.getenv("OPENAI_RATE_SLEEP", "0"))
-            if rate_sleep > 0:
-                time.sleep(rate_sleep)
-        except Exception:
-            pass
-
-    os.makedirs(f"pipeline/data/{run_id}", exist_ok=True)
-    with open(f"pipeline/data/{run_id}/functions.json", "w", encoding="utf-8") as f:
-        f.write(json.dumps(out, ensure_ascii=False, indent=2))
+        write_records(
+            output_path(f"pipeline/data/{run_id}", "functions"),
+            journal.iter_outputs(key for key, _ in jobs()),
+        )
+    write_function_index(f"pipeline/data/{run_id}")
 
 
 async def main():
     with open("run_id", "r", encoding="utf-8") as fp:
         run_id = fp.read().strip()
     logging.info(f"Run ID: {run_id}")
-    await generate_functions_openai(run_id)
+    set_cache_namespace(run_id)
+    open_clients()
+    open_usage_ledger(f"pipeline/data/{run_id}")
+    start_tracing(f"pipeline/data/{run_id}/trace_s2.json")
+    try:
+        await generate_functions_openai(run_id)
+    finally:
+        await close_clients()
     logging.info("Generated Functions (OpenAI mode)")
 
 
 if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--batch", action="store_true", help="use the OpenAI Batch API")
+    if arg_parser.parse_args().batch:
+        os.environ["OPENAI_BATCH"] = "1"
     asyncio.run(main())
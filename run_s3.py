@@ -1,10 +1,20 @@
 import asyncio
 import json
-import random
 
 from dria import DriaDataset, DatasetGenerator, Model, Dria
 from pipeline import SimpleQuery, ParallelQuery, MultiTurnQuery
 from pipeline.s3_queries.multiturn.task import Function
+from pipeline.artifacts import artifact_path, iter_records
+from pipeline.distractors import (
+    attach_distractors,
+    hard_negative_ratio,
+    make_rng,
+    reservoir_sample,
+    sample_distractors,
+)
+from pipeline.query_dedup import PairDeduplicator, dedup_artifact, dedup_enabled
+from pipeline.registry import load_function_index
+from pipeline.similarity import load_similarity_index
 import logging
 import os
 from dotenv import load_dotenv
@@ -16,7 +26,7 @@ logging.basicConfig(
 )
 
 
-async def generate_simple_queries(run_id):
+async def generate_simple_queries(run_id, dedup=None):
     """Generate Simple Queries"""
     dataset = DriaDataset(
         f"simple_queries_{run_id}",
@@ -25,11 +35,8 @@ async def generate_simple_queries(run_id):
     )
     generator = DatasetGenerator(dataset)
 
-    with open(f"pipeline/data/{run_id}/functions.json", "r") as f:
-        function_inputs = json.load(f)
-
     instructions = []
-    for inp in function_inputs:
+    for inp in iter_records(artifact_path(f"pipeline/data/{run_id}", "functions")):
         for func in inp["functions"]:
             instructions.append(
                 {
@@ -57,9 +64,11 @@ async def generate_simple_queries(run_id):
         ],
     )
     dataset.to_json(filepath=f"pipeline/data/{run_id}/simple_queries.json")
+    if dedup is not None:
+        dedup_artifact(f"pipeline/data/{run_id}", "simple_queries", dedup)
 
 
-async def generate_parallel_queries(run_id):
+async def generate_parallel_queries(run_id, dedup=None):
     """Generate Parallel Functions"""
     dataset = DriaDataset(
         f"__parallel_queries_{run_id}",
@@ -68,11 +77,8 @@ async def generate_parallel_queries(run_id):
     )
     generator = DatasetGenerator(dataset)
 
-    with open(f"pipeline/data/{run_id}/functions.json", "r") as f:
-        function_inputs = json.load(f)
-
     instructions = []
-    for inp in function_inputs:
+    for inp in iter_records(artifact_path(f"pipeline/data/{run_id}", "functions")):
         for func in inp["functions"]:
             instructions.append(
                 {
@@ -95,62 +101,23 @@ async def generate_parallel_queries(run_id):
         ],
     )
     dataset.to_json(filepath=f"pipeline/data/{run_id}/parallel_queries.json")
+    if dedup is not None:
+        dedup_artifact(f"pipeline/data/{run_id}", "parallel_queries", dedup)
 
 
 async def generate_multiple_queries(run_id):
     """Generate Functions"""
 
-    with open(f"pipeline/data/{run_id}/functions.json", "r") as f:
-        function_inputs = json.load(f)
+    registry = load_function_index(f"pipeline/data/{run_id}")
+    rng = make_rng()
+    distractors = sample_distractors(registry.scenarios, rng, len(registry))
 
-    func_map = {}
-    for idx, inp in enumerate(function_inputs):
-        for func in inp["functions"]:
-            if random.random() > 0.5:
-                # add 2 functions
-                others = [
-                    f["function"]
-                    for f in inp["functions"]
-                    if f["function"] != func["function"]
-                ]
-                try:
-                    distractors = random.sample(others, 2)
-                except:
-                    distractors = others
-            else:
-                # add 3 functions
-                others = [
-                    f["function"]
-                    for f in inp["functions"]
-                    if f["function"] != func["function"]
-                ]
-                if len(others) >= 3:
-                    distractors = random.sample(others, 3)
-                elif len(others) == 2:
-                    distractors = random.sample(others, 2)
-                else:
-                    distractors = others
-
-            if random.random() > 0.5:
-                # add outer elements
-                r = list(range(len(function_inputs)))
-                r.remove(idx)
-                distractors.append(
-                    random.choice(function_inputs[random.choice(r)]["functions"])[
-                        "function"
-                    ]
-                )
-
-            func_map[func["function"]] = distractors
-
-    with open(f"pipeline/data/{run_id}/simple_queries.json", "r") as f:
-        simple_queries = json.load(f)
-
-    samples = random.sample(simple_queries, 10000)
-    for sample in samples:
-        distractors = func_map[sample["function_schema"]]
-        sample["function_schemas"] = [sample["function_schema"]] + distractors
-        del sample["function_schema"]
+    samples = reservoir_sample(
+        iter_records(artifact_path(f"pipeline/data/{run_id}", "simple_queries")), 10000, rng
+    )
+    ratio = hard_negative_ratio()
+    index = load_similarity_index(f"pipeline/data/{run_id}", registry) if ratio > 0 else None
+    attach_distractors(samples, registry, distractors, rng, index, ratio)
 
     with open(f"pipeline/data/{run_id}/multiple_queries.json", "w") as f:
         f.write(json.dumps(samples))
@@ -165,11 +132,8 @@ async def generate_multi_turn_queries(run_id):
     )
     generator = DatasetGenerator(dataset)
 
-    with open(f"pipeline/data/{run_id}/functions.json", "r") as f:
-        function_inputs = json.load(f)
-
     instructions = []
-    for inp in function_inputs:
+    for inp in iter_records(artifact_path(f"pipeline/data/{run_id}", "functions")):
         function_schemas = []
 
         for func in inp["functions"]:
@@ -205,8 +169,11 @@ async def main():
     with open("run_id", "r") as run_id:
         run_id = run_id.read()
     logging.info(f"Run ID: {run_id}")
-    await generate_simple_queries(run_id)
-    await generate_parallel_queries(run_id)
+    dedup = PairDeduplicator(run_id) if dedup_enabled() else None
+    await generate_simple_queries(run_id, dedup)
+    await generate_parallel_queries(run_id, dedup)
+    if dedup is not None:
+        dedup.save()
     await generate_multiple_queries(run_id)
     await generate_multi_turn_queries(run_id)
     logging.info("Generated Queries")
@@ -1,205 +1,295 @@
+import argparse
 import asyncio
 import json
 import logging
 import os
-import random
-from typing import Any, Dict, List
-from tqdm import tqdm
-from openai_utils import render_template, extract_tags, chat_complete
+from contextlib import ExitStack
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+from openai_utils import (
+    assemble_prompt,
+    render_packed,
+    pack_size,
+    group_records,
+    parse_tags,
+    IncrementalTagParser,
+    close_clients,
+    open_clients,
+    set_cache_namespace,
+    open_usage_ledger,
+    start_tracing,
+)
+from pipeline.artifacts import artifact_path, iter_records, output_path, write_records
+from pipeline.distractors import (
+    attach_distractors,
+    hard_negative_ratio,
+    make_rng,
+    reservoir_sample,
+    sample_distractors,
+)
+from pipeline.journal import StageJournal, StageStep, input_key, run_steps
+from pipeline.query_dedup import PairDeduplicator, dedup_enabled
+from pipeline.registry import FunctionRegistry, load_function_index
+from pipeline.similarity import load_similarity_index
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 
 
-async def generate_simple_queries_openai(run_id: str):
-    dataset: List[Dict[str, Any]] = []
+def simple_queries_step(journal: StageJournal, num_queries: str, pack: int = 1) -> StageStep:
+    template_path = "pipeline/s3_queries/simple/prompt.md"
+    system = (
+        "You are a careful data generator. Output multiple <user_query> and <function_call> tag pairs as instructed."
+    )
 
-    with open(f"pipeline/data/{run_id}/functions.json", "r", encoding="utf-8") as f:
-        function_inputs: List[Dict[str, Any]] = json.load(f)
+    def build_prompt(job) -> str:
+        _, func = job
+        return assemble_prompt(
+            template_path,
+            {
+                "function_schema": func["function"],
+                "num_queries": num_queries,
+            },
+            trailing=("function_schema",),
+        )
 
-    template_path = "pipeline/s3_queries/simple/prompt.md"
-    num_queries = os.getenv("S3_SIMPLE_NUM", "2")
-
-    for inp in function_inputs:
-        for func in inp.get("functions", []):
-            prompt = render_template(
-                template_path,
-                {
-                    "function_schema": func["function"],
-                    "num_queries": num_queries,
-                },
-            )
-            system = (
-                "You are a careful data generator. Output multiple <user_query> and <function_call> tag pairs as instructed."
-            )
-            content = chat_complete(prompt=prompt, system=system)
-            queries = extract_tags(content, "user_query")
-            calls = extract_tags(content, "function_call")
-            for q, c in zip(queries, calls):
-                dataset.append(
-                    {
-                        "user_query": q,
-                        "function_call": c,
-                        "function_schema": func["function"],
-                        "domain": inp["domain"],
-                        "subdomain": inp["subdomain"],
-                    }
-                )
-
-    with open(
-        f"pipeline/data/{run_id}/simple_queries.json", "w", encoding="utf-8"
-    ) as f:
-        f.write(json.dumps(dataset, ensure_ascii=False, indent=2))
-
-
-async def generate_parallel_queries_openai(run_id: str):
-    dataset: List[Dict[str, Any]] = []
-
-    with open(f"pipeline/data/{run_id}/functions.json", "r", encoding="utf-8") as f:
-        function_inputs: List[Dict[str, Any]] = json.load(f)
+    def build_pack(jobs) -> str:
+        return render_packed(
+            template_path,
+            {"num_queries": num_queries},
+            "function_schema",
+            [func["function"] for _, func in jobs],
+        )
 
+    def parse_job(job, content: str) -> List[Dict[str, Any]]:
+        inp, func = job
+        nodes = parse_tags(content, ("user_query", "function_call"))
+        return [
+            {
+                "user_query": pair["user_query"],
+                "function_call": pair["function_call"],
+                "function_schema": func["function"],
+                "domain": inp["domain"],
+                "subdomain": inp["subdomain"],
+            }
+            for pair in group_records(nodes, ("user_query", "function_call"))
+        ]
+
+    return StageStep(
+        "simple",
+        journal,
+        build_prompt,
+        parse_job,
+        system,
+        make_parser=lambda: IncrementalTagParser(
+            ("user_query", "function_call"),
+            target=int(num_queries) if num_queries.isdigit() else None,
+        ),
+        pack_size=pack,
+        build_pack=build_pack,
+    )
+
+
+def parallel_queries_step(journal: StageJournal, num_queries: str, pack: int = 1) -> StageStep:
     template_path = "pipeline/s3_queries/parallel/prompt.md"
-    num_queries = os.getenv("S3_PARALLEL_NUM", "2")
-
-    for inp in tqdm(function_inputs):
-        for func in inp.get("functions", []):
-            prompt = render_template(
-                template_path,
-                {
-                    "function_schema": func["function"],
-                    "num_queries": num_queries,
-                },
-            )
-            system = (
-                "You are a careful data generator. Output <user_query> and <function_calls> pairs as instructed."
-            )
-            content = chat_complete(prompt=prompt, system=system)
-            queries = extract_tags(content, "user_query")
-            calls_blocks = extract_tags(content, "function_calls")
-            for q, c in zip(queries, calls_blocks):
-                dataset.append(
-                    {
-                        "user_query": q,
-                        "function_call": c,  # store multiple calls as a single string (multi-line)
-                        "function_schema": func["function"],
-                        "domain": inp["domain"],
-                        "subdomain": inp["subdomain"],
-                    }
-                )
-
-    with open(
-        f"pipeline/data/{run_id}/parallel_queries.json", "w", encoding="utf-8"
-    ) as f:
-        f.write(json.dumps(dataset, ensure_ascii=False, indent=2))
-
-
-async def generate_multiple_queries_openai(run_id: str):
-    with open(f"pipeline/data/{run_id}/functions.json", "r", encoding="utf-8") as f:
-        function_inputs: List[Dict[str, Any]] = json.load(f)
-
-    # Build distractors map similar to original implementation
-    func_map: Dict[str, List[str]] = {}
-    for idx, inp in enumerate(function_inputs):
-        for func in inp.get("functions", []):
-            # choose distractors from same scenario first
-            others = [
-                f["function"] for f in inp.get("functions", []) if f["function"] != func["function"]
-            ]
-            distractors: List[str] = []
-            if random.random() > 0.5:
-                try:
-                    distractors = random.sample(others, 2)
-                except Exception:
-                    distractors = others
-            else:
-                if len(others) >= 3:
-                    distractors = random.sample(others, 3)
-                elif len(others) == 2:
-                    distractors = random.sample(others, 2)
-                else:
-                    distractors = others
-
-            # occasionally add an outer element
-            if random.random() > 0.5 and len(function_inputs) > 1:
-                r = list(range(len(function_inputs)))
-                try:
-                    r.remove(idx)
-                except ValueError:
-                    pass
-                if r:
-                    outer = random.choice(function_inputs[random.choice(r)])
-                    try:
-                        # pick any function from the outer entry
-                        if outer.get("functions"):
-                            distractors.append(random.choice(outer["functions"]) ["function"])  # type: ignore
-                    except Exception:
-                        pass
-
-            func_map[func["function"]] = distractors
-
-    with open(f"pipeline/data/{run_id}/simple_queries.json", "r", encoding="utf-8") as f:
-        simple_queries: List[Dict[str, Any]] = json.load(f)
-
-    k = min(len(simple_queries), 10000)
-    samples = random.sample(simple_queries, k) if k > 0 else []
-    for sample in samples:
-        distractors = func_map.get(sample["function_schema"], [])
-        sample["function_schemas"] = [sample["function_schema"]] + distractors
-        del sample["function_schema"]
-
-    with open(
-        f"pipeline/data/{run_id}/multiple_queries.json", "w", encoding="utf-8"
-    ) as f:
-        f.write(json.dumps(samples, ensure_ascii=False, indent=2))
-
-
-async def generate_multi_turn_queries_openai(run_id: str):
-    dataset: List[Dict[str, Any]] = []
-    with open(f"pipeline/data/{run_id}/functions.json", "r", encoding="utf-8") as f:
-        function_inputs: List[Dict[str, Any]] = json.load(f)
+    system = (
+        "You are a careful data generator. Output <user_query> and <function_calls> pairs as instructed."
+    )
 
+    def build_prompt(job) -> str:
+        _, func = job
+        return assemble_prompt(
+            template_path,
+            {
+                "function_schema": func["function"],
+                "num_queries": num_queries,
+            },
+            trailing=("function_schema",),
+        )
+
+    def build_pack(jobs) -> str:
+        return render_packed(
+            template_path,
+            {"num_queries": num_queries},
+            "function_schema",
+            [func["function"] for _, func in jobs],
+        )
+
+    def parse_job(job, content: str) -> List[Dict[str, Any]]:
+        inp, func = job
+        nodes = parse_tags(content, ("user_query", "function_calls"))
+        return [
+            {
+                "user_query": pair["user_query"],
+                # store multiple calls as a single string (multi-line)
+                "function_call": pair["function_calls"],
+                "function_schema": func["function"],
+                "domain": inp["domain"],
+                "subdomain": inp["subdomain"],
+            }
+            for pair in group_records(nodes, ("user_query", "function_calls"))
+        ]
+
+    return StageStep(
+        "parallel",
+        journal,
+        build_prompt,
+        parse_job,
+        system,
+        make_parser=lambda: IncrementalTagParser(
+            ("user_query", "function_calls"),
+            target=int(num_queries) if num_queries.isdigit() else None,
+        ),
+        pack_size=pack,
+        build_pack=build_pack,
+    )
+
+
+def multi_turn_queries_step(journal: StageJournal) -> StageStep:
     template_path = "pipeline/s3_queries/multiturn/prompt.md"
+    system = (
+        "You are a careful data generator. Produce a <dialogue> containing repeated <query>, <function_call>, and <tool> tags as per instructions."
+    )
 
-    for inp in function_inputs:
-        function_schemas_obj = inp.get("functions", [])
-        prompt = render_template(
+    def build_prompt(inp: Dict[str, Any]) -> str:
+        return assemble_prompt(
             template_path,
             {
                 "scenario": inp["scenario"],
-                "function_schemas": json.dumps(function_schemas_obj, ensure_ascii=False),
+                "function_schemas": json.dumps(inp.get("functions", []), ensure_ascii=False),
             },
+            trailing=("scenario", "function_schemas"),
         )
-        system = (
-            "You are a careful data generator. Produce a <dialogue> containing repeated <query>, <function_call>, and <tool> tags as per instructions."
-        )
-        content = chat_complete(prompt=prompt, system=system)
 
-        dialogue_blocks = extract_tags(content, "dialogue")
-        if not dialogue_blocks:
-            continue
-        dlg = dialogue_blocks[0]
-        queries = extract_tags(dlg, "query")
-        calls = extract_tags(dlg, "function_call")
-        tools = extract_tags(dlg, "tool")
+    def parse_job(inp: Dict[str, Any], content: str) -> List[Dict[str, Any]]:
+        nodes = parse_tags(content, ("dialogue", "query", "function_call", "tool"))
+        dialogues = [n for n in nodes if n.tag == "dialogue"]
+        if not dialogues:
+            return []
 
         traces: List[Dict[str, str]] = []
-        for q, c, t in zip(queries, calls, tools):
-            traces.append({"query": q})
-            traces.append({"function_call": c})
-            traces.append({"tool": t})
+        for turn in group_records(dialogues[0].children, ("query", "function_call", "tool")):
+            traces.append({"query": turn["query"]})
+            traces.append({"function_call": turn["function_call"]})
+            traces.append({"tool": turn["tool"]})
 
-        dataset.append(
+        return [
             {
                 "trace": traces,
-                "function_schemas": [f["function"] for f in function_schemas_obj],
+                "function_schemas": [f["function"] for f in inp.get("functions", [])],
                 "domain": inp["domain"],
                 "subdomain": inp["subdomain"],
             }
+        ]
+
+    return StageStep(
+        "multi_turn",
+        journal,
+        build_prompt,
+        parse_job,
+        system,
+        # when streaming, the request is cancelled at </dialogue>
+        make_parser=lambda: IncrementalTagParser(
+            ("query", "function_call", "tool"), stop_tag="dialogue"
+        ),
+    )
+
+
+async def generate_multiple_queries_openai(run_id: str, registry: FunctionRegistry):
+    """Attach distractors to sampled simple queries (no requests)."""
+    rng = make_rng()
+    distractors = sample_distractors(registry.scenarios, rng, len(registry))
+
+    # sample while streaming instead of loading every simple query
+    samples = reservoir_sample(
+        iter_records(artifact_path(f"pipeline/data/{run_id}", "simple_queries")), 10000, rng
+    )
+    ratio = hard_negative_ratio()
+    index = load_similarity_index(f"pipeline/data/{run_id}", registry) if ratio > 0 else None
+    attach_distractors(samples, registry, distractors, rng, index, ratio)
+
+    write_records(output_path(f"pipeline/data/{run_id}", "multiple_queries"), samples)
+
+
+async def generate_queries_openai(
+    run_id: str,
+    enable_simple: bool = True,
+    enable_parallel: bool = True,
+    enable_multiple: bool = True,
+    enable_multi: bool = True,
+):
+    """Stage 3 in a single pass over functions.
+
+    Each entry is read once and fanned out to every enabled generator:
+    one multi-turn job per entry, one simple/parallel job per function.
+    All requests share the S3 in-flight budget.
+    """
+    run_dir = f"pipeline/data/{run_id}"
+    functions_fp = artifact_path(run_dir, "functions")
+    simple_num = os.getenv("S3_SIMPLE_NUM", "2")
+    parallel_num = os.getenv("S3_PARALLEL_NUM", "2")
+
+    with ExitStack() as stack:
+
+        def journal(name: str) -> StageJournal:
+            return stack.enter_context(StageJournal(f"{run_dir}/journal/{name}.jsonl"))
+
+        # artifact name -> (step, prompt params); per-step keys in input order
+        # are collected during the pass to write the artifacts afterwards
+        function_steps: Dict[str, Tuple[StageStep, str]] = {}
+        if enable_simple:
+            function_steps["simple_queries"] = (
+                simple_queries_step(journal("simple_queries"), simple_num, pack_size("S3")),
+                simple_num,
+            )
+        if enable_parallel:
+            function_steps["parallel_queries"] = (
+                parallel_queries_step(journal("parallel_queries"), parallel_num, pack_size("S3")),
+                parallel_num,
+            )
+        multi_step: Optional[StageStep] = (
+            multi_turn_queries_step(journal("multi_turn_queries")) if enable_multi else None
+        )
+        keys: Dict[str, List[str]] = {name: [] for name in function_steps}
+        keys["multi_turn_queries"] = []
+
+        def work() -> Iterator[Tuple[StageStep, str, Any]]:
+            fn_index = 0
+            for entry_index, inp in enumerate(iter_records(functions_fp)):
+                functions = inp.get("functions", [])
+                if multi_step is not None:
+                    key = input_key(entry_index, inp)
+                    keys["multi_turn_queries"].append(key)
+                    yield multi_step, key, inp
+                for func in functions:
+                    for name, (step, params) in function_steps.items():
+                        key = input_key(fn_index, func, params)
+                        keys[name].append(key)
+                        yield step, key, (inp, func)
+                    fn_index += 1
+
+        await run_steps(
+            work(),
+            stage="S3",
+            batch_dir=f"{run_dir}/batch",
+            batch_name="s3",
+            desc="S3",
         )
 
-    with open(
-        f"pipeline/data/{run_id}/multi_turn_queries.json", "w", encoding="utf-8"
-    ) as f:
-        f.write(json.dumps(dataset, ensure_ascii=False, indent=2))
+        dedup = PairDeduplicator(run_id) if dedup_enabled() else None
+        for name, (step, _) in function_steps.items():
+            records = step.journal.iter_outputs(keys[name])
+            if dedup is not None:
+                records = dedup.filter(name, records)
+            write_records(output_path(run_dir, name), records)
+        if dedup is not None and function_steps:
+            dedup.save()
+        if multi_step is not None:
+            write_records(
+                output_path(run_dir, "multi_turn_queries"),
+                multi_step.journal.iter_outputs(keys["multi_turn_queries"]),
+            )
+
+    if enable_multiple:
+        await generate_multiple_queries_openai(run_id, load_function_index(run_dir))
 
 
 async def main():
@@ -219,16 +309,26 @@ async def main():
         enable_multiple = False
         enable_multi = True
 
-    if enable_simple:
-        await generate_simple_queries_openai(run_id)
-    if enable_parallel:
-        await generate_parallel_queries_openai(run_id)
-    if enable_multiple:
-        await generate_multiple_queries_openai(run_id)
-    if enable_multi:
-        await generate_multi_turn_queries_openai(run_id)
+    set_cache_namespace(run_id)
+    open_clients()
+    open_usage_ledger(f"pipeline/data/{run_id}")
+    start_tracing(f"pipeline/data/{run_id}/trace_s3.json")
+    try:
+        await generate_queries_openai(
+            run_id,
+            enable_simple=enable_simple,
+            enable_parallel=enable_parallel,
+            enable_multiple=enable_multiple,
+            enable_multi=enable_multi,
+        )
+    finally:
+        await close_clients()
     logging.info("Generated Queries (OpenAI mode)")
 
 
 if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--batch", action="store_true", help="use the OpenAI Batch API")
+    if arg_parser.parse_args().batch:
+        os.environ["OPENAI_BATCH"] = "1"
     asyncio.run(main())
@@ -9,19 +9,23 @@ if (!(Test-Path -Path "run_id")) {
 }
 
 $run_id = (Get-Content -Path "run_id").Trim()
-$functionsPath = Join-Path -Path "pipeline/data/$run_id" -ChildPath "functions.json"
-if (!(Test-Path -Path $functionsPath)) {
-  Write-Host "functions.json not found for run_id=$run_id, running Stage 2 (OpenAI)..."
-  python run_s2_openai.py
+
+# Artifacts are .json or .jsonl depending on PIPELINE_OUTPUT_FORMAT
+function Test-Artifact([string]$name) {
+  (Test-Path -Path "pipeline/data/$run_id/$name.json") -or (Test-Path -Path "pipeline/data/$run_id/$name.jsonl")
 }
-$scenariosPath = Join-Path -Path "pipeline/data/$run_id" -ChildPath "scenarios.json"
 
-# Ensure scenarios.json exists for this run_id; if missing, rerun Stage 1 to create a fresh run_id
-if (!(Test-Path -Path $scenariosPath)) {
-  Write-Host "scenarios.json not found for run_id=$run_id, running Stage 1 (OpenAI)..."
+# Ensure scenarios exist for this run_id; if missing, rerun Stage 1 to create a fresh run_id
+if (!(Test-Artifact "scenarios")) {
+  Write-Host "scenarios not found for run_id=$run_id, running Stage 1 (OpenAI)..."
   python run_s1_openai.py
   $run_id = (Get-Content -Path "run_id").Trim()
 }
 
+if (!(Test-Artifact "functions")) {
+  Write-Host "functions not found for run_id=$run_id, running Stage 2 (OpenAI)..."
+  python run_s2_openai.py
+}
+
 $env:ONLY_MULTI_TURN = "1"
 python run_s3_openai.py
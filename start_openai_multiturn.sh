@@ -11,15 +11,20 @@ fi
 
 RUN_ID=$(cat run_id)
 
-# Ensure scenarios.json exists for this run_id; if missing, rerun Stage 1 to create a fresh run_id
-if [ ! -f "pipeline/data/$RUN_ID/scenarios.json" ]; then
-  echo "scenarios.json not found for run_id=$RUN_ID, running Stage 1 (OpenAI)..."
+# Artifacts are .json or .jsonl depending on PIPELINE_OUTPUT_FORMAT
+has_artifact() {
+  [ -f "pipeline/data/$RUN_ID/$1.json" ] || [ -f "pipeline/data/$RUN_ID/$1.jsonl" ]
+}
+
+# Ensure scenarios exist for this run_id; if missing, rerun Stage 1 to create a fresh run_id
+if ! has_artifact scenarios; then
+  echo "scenarios not found for run_id=$RUN_ID, running Stage 1 (OpenAI)..."
   python run_s1_openai.py
   RUN_ID=$(cat run_id)
 fi
 
-if [ ! -f "pipeline/data/$RUN_ID/functions.json" ]; then
-  echo "functions.json not found for run_id=$RUN_ID, running Stage 2 (OpenAI)..."
+if ! has_artifact functions; then
+  echo "functions not found for run_id=$RUN_ID, running Stage 2 (OpenAI)..."
   python run_s2_openai.py
 fi
 